@@ -0,0 +1,661 @@
+"""
+Database benchmarks for POPAYS Bot
+
+Every benchmark runs against a throwaway SQLite file, so the real
+delivery_bot.db is never touched. The storage benchmark also runs against
+Postgres, in a throwaway schema, when TEST_DATABASE_URL is set.
+
+Usage:
+    python benchmark.py            # run all benchmarks
+    python benchmark.py pool       # run a single benchmark
+"""
+import os
+import sys
+import asyncio
+import json
+import itertools
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+import logging
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+from database import (
+    DatabaseManager, AsyncDatabaseManager, ORDER_SELECT, _decode_order, _distance_km, _order_search_row,
+    geohash_encode, new_record_id,
+)
+
+# Keep benchmark output readable
+logging.disable(logging.INFO)
+
+SAMPLE_ORDER = {
+    'type': 'order',
+    'customer': {'name': 'Test Mijoz', 'phone': '+998 91 123 45 67', 'location': "Qo'qon"},
+    'items': [
+        {'name': 'Burger', 'quantity': 2, 'total': 50000, 'selectedSize': 'Katta'},
+        {'name': 'Lavash', 'quantity': 1, 'total': 28000, 'selectedSize': ''},
+        {'name': 'Cola', 'quantity': 2, 'total': 16000, 'selectedSize': '0.5L'},
+    ],
+    'total': 94000,
+    'branch': 'Kosmonavt',
+    'timestamp': '2025-09-21T12:00:00',
+}
+
+@contextmanager
+def temp_database(**kwargs):
+    """Yield a DatabaseManager backed by a temporary file"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = DatabaseManager(os.path.join(tmp_dir, "bench.db"), **kwargs)
+        manager.init_database()
+        try:
+            yield manager
+        finally:
+            manager.close()
+
+def timed(func, iterations: int) -> float:
+    """Return mean seconds per call of func over iterations"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+def report(name: str, seconds: float):
+    print(f"  {name:<40} {seconds * 1e6:10.1f} µs/call")
+
+def bench_pool(iterations: int = 2000):
+    """Per-call latency of a fresh connection per query vs pooled connections"""
+    print("📊 Connection pool: get_order latency")
+    with temp_database() as manager:
+        order_id = manager.create_order(1, 'bench', 'Bench', SAMPLE_ORDER)
+
+        def fresh_connection():
+            with sqlite3.connect(manager.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
+                cursor.fetchone()
+                cursor.execute('SELECT item_name, quantity, price, selected_size FROM order_items WHERE order_id = ?', (order_id,))
+                cursor.fetchall()
+            conn.close()
+
+        def pooled_connection():
+            # Same queries as get_order, without its order cache
+            with manager.pool.connection() as conn:
+                manager._fetch_order(conn.cursor(), 'main', order_id)
+
+        report("fresh sqlite3.connect per call", timed(fresh_connection, iterations))
+        report("pooled connection", timed(pooled_connection, iterations))
+
+async def _measure_loop_lag(submit, concurrency: int, interval: float = 0.001) -> float:
+    """Run concurrent submissions and return the worst event-loop stall in seconds"""
+    worst_lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal worst_lag
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            worst_lag = max(worst_lag, loop.time() - expected)
+
+    async def arrive(i):
+        # Spread submissions out like real updates arriving from Telegram
+        await asyncio.sleep(i * interval / 4)
+        await submit(i)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.gather(*(arrive(i) for i in range(concurrency)))
+    done.set()
+    await ticker_task
+    return worst_lag
+
+def bench_loop_lag(concurrency: int = 200):
+    """Event-loop lag while orders are submitted concurrently"""
+    print(f"📊 Event-loop lag: {concurrency} concurrent create_order calls")
+    with temp_database() as manager:
+        async_manager = AsyncDatabaseManager(manager)
+
+        async def submit_sync(i):
+            manager.create_order(i, 'bench', 'Bench', SAMPLE_ORDER)
+
+        async def submit_async(i):
+            await async_manager.create_order(i, 'bench', 'Bench', SAMPLE_ORDER)
+
+        sync_lag = asyncio.run(_measure_loop_lag(submit_sync, concurrency))
+        async_lag = asyncio.run(_measure_loop_lag(submit_async, concurrency))
+        asyncio.run(async_manager.close())
+
+    print(f"  {'sync DatabaseManager in handlers':<40} {sync_lag * 1e3:10.1f} ms max lag")
+    print(f"  {'AsyncDatabaseManager':<40} {async_lag * 1e3:10.1f} ms max lag")
+
+def seed_orders(manager: DatabaseManager, count: int, users: int = 50):
+    """Insert count sample orders spread over a number of users"""
+    for i in range(count):
+        manager.create_order(i % users, f'user{i % users}', 'Bench', SAMPLE_ORDER)
+
+def bench_order_listing(orders: int = 300, iterations: int = 50):
+    """Listing orders with one item query per order vs one query per page"""
+    print(f"📊 Order listing: {orders} orders x {len(SAMPLE_ORDER['items'])} items")
+    with temp_database() as manager:
+        seed_orders(manager, orders)
+
+        # Both sides read the same order rows and build the same OrderRows;
+        # only the way items are fetched differs
+        def list_orders(fetch_items):
+            with manager.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'SELECT {ORDER_SELECT} FROM orders ORDER BY created_at DESC LIMIT ?', (orders,))
+                order_rows = cursor.fetchall()
+                items_by_order = fetch_items(cursor, [order_row[0] for order_row in order_rows])
+                return [_decode_order(order_row, items_by_order.get(order_row[0], [])) for order_row in order_rows]
+
+        def items_per_order(cursor, order_ids):
+            items_by_order = {}
+            for order_id in order_ids:
+                cursor.execute('''
+                    SELECT item_name, quantity, price, selected_size
+                    FROM order_items WHERE order_id = ? ORDER BY id
+                ''', (order_id,))
+                items_by_order[order_id] = cursor.fetchall()
+            return items_by_order
+
+        assert ([order.to_dict() for order in list_orders(items_per_order)]
+                == [order.to_dict() for order in list_orders(manager._get_items_for_orders)])
+        report("one item query per order (N+1)", timed(lambda: list_orders(items_per_order), iterations))
+        report("one IN (...) query per page", timed(lambda: list_orders(manager._get_items_for_orders), iterations))
+
+def bulk_seed_orders(manager: DatabaseManager, count: int):
+    """Insert count bare orders in one transaction, bypassing create_order"""
+    with manager.pool.connection() as conn:
+        conn.executemany('''
+            INSERT INTO orders (id, user_id, order_data, total_amount, status, created_at)
+            VALUES (?, ?, '{}', 50000, 'pending', datetime('2025-01-01', ? || ' seconds'))
+        ''', ((f"{i:08x}", i % 500, i * 30) for i in range(count)))
+
+def bench_admin_pages(orders: int = 100_000, per_page: int = 5, iterations: int = 200):
+    """Deep admin pages with OFFSET vs keyset cursors"""
+    print(f"📊 Admin pagination: {orders} orders, {per_page} per page")
+    with temp_database() as manager:
+        bulk_seed_orders(manager, orders)
+        deep_offset = orders - per_page * 2
+        deep_row = manager.get_recent_orders_admin(limit=deep_offset)[-1]
+        deep_cursor = (deep_row['created_at'], deep_row['id'])
+
+        def offset_page(offset):
+            with manager.pool.connection() as conn:
+                conn.execute('''
+                    SELECT * FROM orders ORDER BY created_at DESC LIMIT ? OFFSET ?
+                ''', (per_page, offset)).fetchall()
+
+        report("OFFSET, page 1", timed(lambda: offset_page(0), iterations))
+        report(f"OFFSET, page {deep_offset // per_page + 1}", timed(lambda: offset_page(deep_offset), iterations))
+        report("keyset, page 1", timed(lambda: manager.get_recent_orders_admin(limit=per_page), iterations))
+        report(f"keyset, page {deep_offset // per_page + 1}",
+               timed(lambda: manager.get_recent_orders_admin(limit=per_page, before=deep_cursor), iterations))
+
+def bench_search(orders: int = 200_000, iterations: int = 50):
+    """Admin order search: FTS5 index vs LIKE scans"""
+    print(f"📊 Order search: {orders} orders")
+    with temp_database() as manager:
+        rows = []
+        for i in range(orders):
+            order = synthetic_order(i)
+            customer = order['customer']
+            rows.append((f"{i:08x}", i % 5000, f"user{i % 5000}", customer['name'], customer['phone'],
+                         [item['name'] for item in order['items']]))
+        with manager.pool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO orders (id, user_id, username, customer_name, customer_phone, order_data, total_amount,
+                                    created_at)
+                VALUES (?, ?, ?, ?, ?, '{}', 50000, datetime('2025-01-01', ? || ' seconds'))
+            ''', ((order_id, user_id, username, name, phone, i * 30)
+                  for i, (order_id, user_id, username, name, phone, _) in enumerate(rows)))
+            conn.executemany('''
+                INSERT INTO order_items (order_id, item_name, quantity, price) VALUES (?, ?, 1, 10000)
+            ''', ((row[0], name) for row in rows for name in row[5]))
+            conn.executemany('''
+                INSERT INTO orders_fts (order_id, customer_name, customer_phone, username, items)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (_order_search_row(order_id, name, phone, username, items)
+                  for order_id, _, username, name, phone, items in rows))
+
+        def like_scan(term):
+            with manager.pool.connection() as conn:
+                pattern = f"%{term}%"
+                return conn.execute('''
+                    SELECT id FROM orders o
+                    WHERE customer_name LIKE ? OR customer_phone LIKE ? OR username LIKE ?
+                       OR EXISTS (SELECT 1 FROM order_items WHERE order_id = o.id AND item_name LIKE ?)
+                    ORDER BY created_at DESC LIMIT 10
+                ''', (pattern, pattern, pattern, pattern)).fetchall()
+
+        # "Mijoz" and "Lavash" are in most orders: common words matched as prefixes
+        for term in ("Mijoz 123456", "91 777", "user4999", "Mijoz", "Lavash"):
+            report(f"LIKE scan: {term!r}", timed(lambda: like_scan(term), max(1, iterations // 10)))
+            report(f"search_orders: {term!r}", timed(lambda: manager.search_orders(term), iterations))
+
+def bench_radius(locations: int = 200_000, iterations: int = 50):
+    """Locations near a point: geohash cell ranges vs a coordinate scan"""
+    print(f"📊 Radius lookups: {locations} locations around Qo'qon")
+    rng = random.Random(7)
+    with temp_database() as manager:
+        rows = []
+        for i in range(locations):
+            latitude = 40.45 + rng.random() * 0.15
+            longitude = 70.88 + rng.random() * 0.15
+            rows.append((f"{i:08x}", i % 5000, latitude, longitude, geohash_encode(latitude, longitude)))
+        with manager.pool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO locations (id, user_id, latitude, longitude, geohash) VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+
+        def coordinate_scan(radius_km):
+            with manager.pool.connection() as conn:
+                rows = conn.execute("SELECT id, latitude, longitude FROM locations").fetchall()
+            return [row for row in rows if _distance_km(40.523, 70.956, row[1], row[2]) <= radius_km]
+
+        for radius_km in (0.2, 0.5, 1.0):
+            report(f"coordinate scan: {radius_km} km", timed(lambda: coordinate_scan(radius_km), max(1, iterations // 10)))
+            report(f"get_locations_within_radius: {radius_km} km",
+                   timed(lambda: manager.get_locations_within_radius(40.523, 70.956, radius_km), iterations))
+
+def bench_branch_stats(orders: int = 200_000, iterations: int = 50):
+    """Per-branch daily report: GROUP BY over orders vs the daily_branch_stats rollup"""
+    print(f"📊 Branch report: {orders} orders over the last year")
+    branches = ('Kosmonavt filiali', 'Derezlik filiali')
+    with temp_database() as manager:
+        with manager.pool.connection() as conn:
+            # The insert trigger keeps the rollup current, as it does for create_order
+            conn.executemany('''
+                INSERT INTO orders (id, user_id, order_data, total_amount, status, nearest_branch, created_at)
+                VALUES (?, ?, '{}', 50000, 'completed', ?, datetime('now', ? || ' seconds'))
+            ''', ((f"{i:08x}", i % 500, branches[i % 2], -i * 150) for i in range(orders)))
+
+        def group_by_scan():
+            with manager.pool.connection() as conn:
+                return conn.execute('''
+                    SELECT date(created_at, '+5 hours'), nearest_branch, COUNT(*), SUM(total_amount)
+                    FROM orders WHERE created_at >= datetime('now', '-7 days')
+                    GROUP BY 1, 2 ORDER BY 1 DESC, 2
+                ''').fetchall()
+
+        report("GROUP BY over orders (7 days)", timed(group_by_scan, iterations))
+        report("get_daily_branch_stats(7)", timed(lambda: manager.get_daily_branch_stats(7), iterations))
+        report("get_daily_branch_stats(30)", timed(lambda: manager.get_daily_branch_stats(30), iterations))
+
+def bench_current_order(orders: int = 100_000, iterations: int = 2000):
+    """Active-order lookup: partial index seek, then the in-process cache"""
+    print(f"📊 Current order: {orders} orders, 2% pending")
+    with temp_database() as manager:
+        with manager.pool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO orders (id, user_id, order_data, total_amount, status, created_at)
+                VALUES (?, ?, '{}', 50000, ?, datetime('2025-01-01', ? || ' seconds'))
+            ''', ((f"{i:08x}", i % 500, 'pending' if i % 50 == 0 else 'completed', i * 30)
+                  for i in range(orders)))
+
+        def uncached():
+            manager.active_orders.clear()
+            return manager.get_user_current_order(100)
+
+        report("index seek (cache cleared)", timed(uncached, iterations))
+        report("cached", timed(lambda: manager.get_user_current_order(100), iterations))
+
+def bench_order_cache(orders: int = 400, iterations: int = 2000):
+    """get_order for the callback pattern: read back orders created moments ago"""
+    print(f"📊 Order cache: get_order on {orders} freshly created orders")
+    with temp_database() as manager:
+        order_ids = [manager.create_order(i, 'bench', 'Bench', SAMPLE_ORDER) for i in range(orders)]
+        picks = itertools.cycle(order_ids)
+
+        def uncached():
+            manager.orders.clear()
+            return manager.get_order(next(picks)).order_data
+
+        report("database read + decode", timed(uncached, iterations))
+        for order_id in order_ids:
+            manager.get_order(order_id)
+        report("cached", timed(lambda: manager.get_order(next(picks)).order_data, iterations))
+        print(f"   {manager.get_cache_stats()['orders']}")
+
+def bench_startup(runs: int = 5):
+    """Import cost of the database module and of bringing a database up to date"""
+    print("📊 Startup: import database, construct DatabaseManager, init_database")
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Import in a clean interpreter from an empty directory; anything
+        # written there means the import touched disk
+        script = ("import time; start = time.perf_counter(); import database; "
+                  "print(time.perf_counter() - start)")
+        env = dict(os.environ, PYTHONPATH=package_dir)
+        import_times = [
+            float(subprocess.run([sys.executable, '-c', script], cwd=tmp_dir, env=env,
+                                 capture_output=True, text=True, check=True).stdout)
+            for _ in range(runs)
+        ]
+        report("import database (best of runs)", min(import_times))
+        print(f"  {'files created by the import':<40} {len(os.listdir(tmp_dir)):10d}")
+
+        db_path = os.path.join(tmp_dir, "bench.db")
+        report("DatabaseManager() constructor", timed(lambda: DatabaseManager(db_path), 1000))
+        print(f"  {'database file after constructor':<40} {'yes' if os.path.exists(db_path) else 'no':>10}")
+
+        manager = DatabaseManager(db_path)
+        try:
+            report("init_database, new file", timed(manager.init_database, 1))
+            report("init_database, up to date", timed(manager.init_database, 1000))
+        finally:
+            manager.close()
+
+def bench_status_race(orders: int = 200, contenders: int = 4):
+    """Concurrent accept/reject taps on the same orders: winners per order and latency"""
+    print(f"📊 Status race: {contenders} concurrent transitions on each of {orders} orders")
+    with temp_database() as manager:
+        order_ids = [manager.create_order(i, 'bench', 'Bench', SAMPLE_ORDER) for i in range(orders)]
+        async_manager = AsyncDatabaseManager(manager)
+
+        async def race():
+            statuses = itertools.cycle(('accepted', 'rejected'))
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                async_manager.transition_order_status(order_id, next(statuses))
+                for order_id in order_ids for _ in range(contenders)
+            ))
+            elapsed = time.perf_counter() - start
+            await async_manager.close()
+            return results, elapsed
+
+        results, elapsed = asyncio.run(race())
+        winners = sum(1 for order in results if order)
+        report("transition_order_status", elapsed / len(results))
+        print(f"  {'winners / orders':<40} {winners:>6} / {orders}")
+
+def bench_item_insert(iterations: int = 300):
+    """Write-transaction hold time for order items: one execute per item vs executemany"""
+    print("📊 Order item insert: write transaction hold time")
+    with temp_database() as manager:
+        order_id = manager.create_order(1, 'bench', 'Bench', SAMPLE_ORDER)
+        item_sql = '''
+            INSERT INTO order_items (order_id, item_name, quantity, price, selected_size)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+
+        for item_count in (1, 10, 50):
+            rows = [(order_id, f'Item {i}', 1, 10000, '') for i in range(item_count)]
+
+            def hold_time(insert):
+                with manager.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    start = time.perf_counter()
+                    cursor.execute("BEGIN IMMEDIATE")
+                    insert(cursor)
+                    conn.commit()
+                    return time.perf_counter() - start
+
+            def per_item(cursor):
+                for row in rows:
+                    cursor.execute(item_sql, row)
+
+            def bulk(cursor):
+                cursor.executemany(item_sql, rows)
+
+            per_item_time = sum(hold_time(per_item) for _ in range(iterations)) / iterations
+            bulk_time = sum(hold_time(bulk) for _ in range(iterations)) / iterations
+            report(f"{item_count:>2} items, execute per item", per_item_time)
+            report(f"{item_count:>2} items, executemany", bulk_time)
+
+def bench_record_ids(rows: int = 300_000, batch: int = 1000):
+    """Insert throughput and B-tree size for random uuid4[:8] vs time-ordered ids"""
+    print(f"📊 Record ids: {rows} inserts into a TEXT primary key, {batch} per transaction")
+    generators = (
+        ("uuid4()[:8] (random)", lambda: str(uuid.uuid4())[:8]),
+        ("new_record_id (time-ordered)", new_record_id),
+    )
+    payload = json.dumps(SAMPLE_ORDER)
+    for name, new_id in generators:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "ids.db"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE orders (id TEXT PRIMARY KEY, order_data TEXT)")
+            collisions = 0
+            segment_times = []
+            start = time.perf_counter()
+            for batch_start in range(0, rows, batch):
+                segment_start = time.perf_counter()
+                with conn:
+                    for _ in range(batch):
+                        try:
+                            conn.execute("INSERT INTO orders VALUES (?, ?)", (new_id(), payload))
+                        except sqlite3.IntegrityError:
+                            collisions += 1
+                segment_times.append(time.perf_counter() - segment_start)
+            elapsed = time.perf_counter() - start
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            conn.close()
+
+        # Throughput over the last tenth, when the index no longer fits in cache
+        tail = segment_times[-max(1, len(segment_times) // 10):]
+        tail_rate = batch * len(tail) / sum(tail)
+        print(f"  {name:<32} {rows / elapsed:8.0f} rows/s overall, {tail_rate:8.0f} rows/s at the end, "
+              f"{pages * page_size / 2**20:6.1f} MiB, {collisions} collisions")
+
+def synthetic_order(i: int):
+    """Order payload with a varying basket, shaped like web app orders"""
+    menu = SAMPLE_ORDER['items']
+    items = [dict(menu[(i + k) % len(menu)], quantity=1 + (i + k) % 3) for k in range(1 + i % 5)]
+    return dict(
+        SAMPLE_ORDER,
+        customer={'name': f'Mijoz {i}', 'phone': f'+998 91 {i % 1000:03d} {i % 100:02d} {i % 97:02d}',
+                  'location': "Qo'qon"},
+        items=items,
+        total=sum(item['total'] for item in items),
+    )
+
+def bench_payload_size(orders: int = 20_000, reads: int = 2000):
+    """Database size and read cost with JSON text vs compact order payloads"""
+    print(f"📊 Order payload storage: {orders} synthetic orders")
+    for name, compact in (("json.dumps text", False), ("compact (deduplicated + zlib)", True)):
+        with temp_database(compact_payload=compact) as manager:
+            order_ids = [manager.create_order(i % 500, 'bench', 'Bench', synthetic_order(i)) for i in range(orders)]
+            with manager.pool.connection() as conn:
+                conn.execute("VACUUM")
+                payload_bytes = conn.execute("SELECT SUM(length(order_data)) FROM orders").fetchone()[0]
+                pages = conn.execute("PRAGMA page_count").fetchone()[0]
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+
+            sample = order_ids[::max(1, orders // reads)]
+            read_time = timed(lambda: [manager.get_order(order_id).order_data for order_id in sample], 1) / len(sample)
+            print(f"  {name:<32} {pages * page_size / 2**20:6.2f} MiB file, "
+                  f"{payload_bytes / orders:6.0f} B/payload, {read_time * 1e6:6.1f} µs get_order + decode")
+
+def _decode_order_as_dict(order_row, items):
+    """The per-row dict literal the listing methods used to build"""
+    return {
+        'id': order_row[0],
+        'user_id': order_row[1],
+        'username': order_row[2],
+        'first_name': order_row[3],
+        'customer_name': order_row[4],
+        'customer_phone': order_row[5],
+        'customer_location': order_row[6],
+        'order_data': json.loads(order_row[7]) if order_row[7] else {},
+        'total_amount': order_row[8],
+        'latitude': order_row[9],
+        'longitude': order_row[10],
+        'delivery_fee': order_row[11] or 0,
+        'nearest_branch': order_row[12],
+        'status': order_row[13],
+        'created_at': order_row[14],
+        'updated_at': order_row[15],
+        'items': [
+            {'name': item[0], 'quantity': item[1], 'total': item[2], 'selectedSize': item[3]}
+            for item in items
+        ]
+    }
+
+def bench_row_memory(orders: int = 10_000):
+    """Memory held by decoded orders: dicts vs OrderRow/OrderItemRow"""
+    print(f"📊 Decoded row memory: {orders} orders x {len(SAMPLE_ORDER['items'])} items")
+    # JSON text payloads, which both variants can decode: this compares row
+    # shapes, not payload formats (bench_payload_size covers those)
+    with temp_database(compact_payload=False) as manager:
+        seed_orders(manager, orders)
+        with manager.pool.connection() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute(f"SELECT {ORDER_SELECT} FROM orders").fetchall()
+            items_by_order = manager._get_items_for_orders(cursor, [row[0] for row in rows])
+
+    def decode_row(order_row, items):
+        # Touch order_data so both variants hold the decoded payload
+        order = _decode_order(order_row, items)
+        order.order_data
+        return order
+
+    for name, decode in (("dict per order and item", _decode_order_as_dict),
+                         ("OrderRow / OrderItemRow", decode_row)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        decoded = [decode(row, items_by_order.get(row[0], [])) for row in rows]
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del decoded
+        print(f"  {name:<40} {current / 2**20:8.1f} MiB held, {peak / 2**20:8.1f} MiB peak, {elapsed * 1e3:7.1f} ms")
+
+def bench_list_payload(orders: int = 5000):
+    """CPU time and peak memory of an order list with eager, lazy and no payload"""
+    print(f"📊 Order list payload: get_all_orders(limit={orders})")
+    with temp_database() as manager:
+        seed_orders(manager, orders)
+
+        def eager():
+            # What every listing used to do: decode order_data for each row
+            return [order.order_data for order in manager.get_all_orders(limit=orders)]
+
+        variants = (
+            ("eager json.loads per row", eager),
+            ("lazy order_data (not accessed)", lambda: manager.get_all_orders(limit=orders)),
+            ("projection without order_data", lambda: manager.get_all_orders(limit=orders, with_payload=False)),
+        )
+        for name, func in variants:
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del result
+            print(f"  {name:<40} {elapsed * 1e3:8.1f} ms, {peak / 2**20:7.1f} MiB peak")
+
+async def _run_storage_workload(storage, concurrency: int, rounds: int):
+    """Concurrent order writes, point reads and admin pages through the Storage interface"""
+    results = []
+
+    start = time.perf_counter()
+    order_ids = []
+    for _ in range(rounds):
+        order_ids += await asyncio.gather(*(
+            storage.create_order(i, 'bench', 'Bench', SAMPLE_ORDER) for i in range(concurrency)
+        ))
+    results.append(("create_order", time.perf_counter() - start, len(order_ids)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(storage.get_order(order_id) for order_id in order_ids))
+    results.append(("get_order", time.perf_counter() - start, len(order_ids)))
+
+    start = time.perf_counter()
+    pages, before = 0, None
+    while True:
+        page = await storage.get_recent_orders_admin(limit=5, before=before, with_payload=False)
+        if not page:
+            break
+        pages += 1
+        before = (page[-1]['created_at'], page[-1]['id'])
+    results.append(("get_recent_orders_admin page", time.perf_counter() - start, pages))
+
+    for name, elapsed, calls in results:
+        print(f"  {name:<40} {elapsed / calls * 1e6:10.1f} µs/call, {calls / elapsed:8.0f} calls/s")
+
+def bench_storage(concurrency: int = 50, rounds: int = 20):
+    """Same async workload against each available storage backend"""
+    print(f"📊 Storage backends: {concurrency} concurrent tasks x {rounds} rounds")
+
+    async def sqlite_run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = AsyncDatabaseManager(DatabaseManager(os.path.join(tmp_dir, "bench.db")))
+            await storage.initialize()
+            try:
+                await _run_storage_workload(storage, concurrency, rounds)
+            finally:
+                await storage.close()
+
+    print("  sqlite")
+    asyncio.run(sqlite_run())
+
+    dsn = os.getenv('TEST_DATABASE_URL')
+    if not dsn:
+        print("  postgres: set TEST_DATABASE_URL to include it")
+        return
+
+    from database_pg import PostgresStorage, asyncpg
+    if asyncpg is None:
+        print("  postgres: asyncpg is not installed, skipped")
+        return
+
+    async def postgres_run():
+        schema = f"popays_bench_{uuid.uuid4().hex[:8]}"
+        storage = PostgresStorage(dsn, max_size=concurrency, schema=schema)
+        await storage.initialize()
+        try:
+            await _run_storage_workload(storage, concurrency, rounds)
+        finally:
+            await storage.close()
+            conn = await asyncpg.connect(dsn)
+            try:
+                await conn.execute(f'DROP SCHEMA "{schema}" CASCADE')
+            finally:
+                await conn.close()
+
+    print("  postgres")
+    asyncio.run(postgres_run())
+
+BENCHMARKS = {
+    'pool': bench_pool,
+    'loop_lag': bench_loop_lag,
+    'order_listing': bench_order_listing,
+    'admin_pages': bench_admin_pages,
+    'item_insert': bench_item_insert,
+    'row_memory': bench_row_memory,
+    'list_payload': bench_list_payload,
+    'storage': bench_storage,
+    'record_ids': bench_record_ids,
+    'payload_size': bench_payload_size,
+    'search': bench_search,
+    'radius': bench_radius,
+    'branch_stats': bench_branch_stats,
+    'current_order': bench_current_order,
+    'order_cache': bench_order_cache,
+    'startup': bench_startup,
+    'status_race': bench_status_race,
+}
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ Unknown benchmark: {name}. Available: {', '.join(BENCHMARKS)}")
+            return 1
+    for name in names:
+        BENCHMARKS[name]()
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -59,3 +59,10 @@ FREE_DELIVERY_THRESHOLD = 150000  # in sum
 FREE_DELIVERY_RADIUS = 3.0  # km - masofaga qarab to'lovsiz yetkazib berish
 DISTANCE_FEE_PER_KM = 5000  # sum per km for distance over 3km
 MAX_DELIVERY_DISTANCE = 20.0  # km - maksimal yetkazib berish masofasi
+
+# Database backend: 'sqlite' (DATABASE_URL is the file path) or 'postgres' (DATABASE_URL is the DSN)
+DB_BACKEND = os.getenv('DB_BACKEND', 'sqlite')
+DATABASE_URL = os.getenv('DATABASE_URL', 'delivery_bot.db')
+
+# Database retention
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))  # orders, locations and admin logs older than this move to the archive database
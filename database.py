@@ -1,236 +1,1087 @@
+import os
 import sqlite3
+import re
+import math
 import json
-import uuid
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+import zlib
+import time
+import secrets
+import queue
+import asyncio
+import functools
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
 import logging
 
+if TYPE_CHECKING:
+    # storage imports this module, so the Protocol is only needed for annotations
+    from storage import Storage
+
 logger = logging.getLogger(__name__)
 
+# Secondary indexes, one per hot filter/sort in DatabaseManager
+INDEX_STATEMENTS = [
+    # Item lookups by order
+    "CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)",
+    # get_user_orders, per-user aggregates and broadcast list
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)",
+    # get_all_orders / get_recent_orders_admin
+    "CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)",
+    # Status breakdown and revenue in get_statistics
+    "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, total_amount)",
+    # Location counts and age-based lookups
+    "CREATE INDEX IF NOT EXISTS idx_locations_created_at ON locations (created_at)",
+    # get_admin_logs
+    "CREATE INDEX IF NOT EXISTS idx_admin_logs_created_at ON admin_logs (created_at)",
+]
+
+# Columns added to orders over time, in the order they were introduced
+LEGACY_ORDER_COLUMNS = [
+    ('username', 'TEXT'),
+    ('first_name', 'TEXT'),
+    ('customer_name', 'TEXT'),
+    ('customer_phone', 'TEXT'),
+    ('customer_location', 'TEXT'),
+    ('total_amount', 'REAL'),
+    ('status', "TEXT DEFAULT 'pending'"),
+    # SQLite cannot ADD COLUMN with a non-constant default
+    ('updated_at', 'TIMESTAMP'),
+    ('latitude', 'REAL'),
+    ('longitude', 'REAL'),
+    ('delivery_fee', 'INTEGER DEFAULT 0'),
+    ('nearest_branch', 'TEXT'),
+]
+
+# Order statuses tracked by the order_stats rollup
+ORDER_STATUSES = ('pending', 'accepted', 'rejected', 'completed', 'cancelled')
+
+# Allowed status changes: new status -> statuses it may be set from
+ORDER_TRANSITIONS = {
+    'accepted': ('pending',),
+    'rejected': ('pending',),
+    'cancelled': ('pending',),
+    'completed': ('accepted',),
+}
+
+# Explicit orders column list; SELECT * breaks on databases whose columns
+# were added by ALTER TABLE in a different order
+ORDER_COLUMNS = (
+    'id', 'user_id', 'username', 'first_name', 'customer_name', 'customer_phone',
+    'customer_location', 'order_data', 'total_amount', 'latitude', 'longitude',
+    'delivery_fee', 'nearest_branch', 'status', 'created_at', 'updated_at',
+)
+ORDER_SELECT = ', '.join(ORDER_COLUMNS)
+# List projection: same positions, but the order_data blob is never read
+ORDER_LIST_SELECT = ', '.join('NULL' if column == 'order_data' else column for column in ORDER_COLUMNS)
+
+# Explicit locations column list, for the same reason
+LOCATION_COLUMNS = (
+    'id', 'user_id', 'username', 'first_name', 'address', 'latitude', 'longitude',
+    'accuracy', 'map_links', 'created_at',
+)
+LOCATION_SELECT = ', '.join(LOCATION_COLUMNS)
+
+# Keep IN (...) lookups well below SQLite's bound-parameter limit
+ITEMS_QUERY_CHUNK_SIZE = 500
+
+# Schema name the archive database is attached under
+ARCHIVE_SCHEMA = 'archive'
+# Archived tables and the lookup indexes the archive needs for fallback reads
+ARCHIVE_INDEXES = {
+    'orders': ('CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_phone ON orders(phone_normalized)',),
+    'order_items': ('CREATE INDEX IF NOT EXISTS archive.idx_archive_order_items_order_id ON order_items(order_id)',),
+    'locations': (),
+    'admin_logs': (),
+}
+
+# Record IDs: 8 characters of milliseconds since ID_EPOCH_MS followed by
+# 4 characters of per-millisecond sequence, in Crockford base32
+ID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ID_EPOCH_MS = 1735689600000  # 2025-01-01 UTC; 40 bits of milliseconds last until 2059
+ID_TIME_CHARS = 8
+ID_SEQUENCE_CHARS = 4
+ID_SEQUENCE_LIMIT = 32 ** ID_SEQUENCE_CHARS
+# Inserts retried with a fresh id after a primary key collision
+ID_MAX_ATTEMPTS = 3
+
+def _encode_base32(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(ID_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+class RecordIdGenerator:
+    """Short, time-sortable, monotonic record IDs (ULID-style)
+
+    IDs are 12 characters, e.g. 0JQ4X8MB3K7Z, and sort in creation order,
+    so new rows append to the right edge of the primary key B-tree instead
+    of landing on a random page. Within one millisecond the sequence part
+    starts at a random value and counts up; when it runs out the timestamp
+    part is advanced. Two processes can still collide in the same
+    millisecond, so inserts retry with a new id on a primary key conflict.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def new_id(self) -> str:
+        with self._lock:
+            now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                # Leave headroom to count up within the millisecond
+                self._sequence = secrets.randbelow(ID_SEQUENCE_LIMIT // 2)
+            else:
+                self._sequence += 1
+                if self._sequence >= ID_SEQUENCE_LIMIT:
+                    self._last_ms += 1
+                    self._sequence = secrets.randbelow(ID_SEQUENCE_LIMIT // 2)
+            return (_encode_base32(self._last_ms, ID_TIME_CHARS)
+                    + _encode_base32(self._sequence, ID_SEQUENCE_CHARS))
+
+new_record_id = RecordIdGenerator().new_id
+
+def _is_duplicate_id(error: sqlite3.IntegrityError, table: str) -> bool:
+    """True when an insert failed because the generated id already exists"""
+    return f"UNIQUE constraint failed: {table}.id" in str(error)
+
+# order_data fields that are also stored in their own columns, keyed by
+# column, with the type a value must have to round-trip unchanged
+PAYLOAD_CUSTOMER_FIELDS = (('name', str), ('phone', str), ('location', str))
+PAYLOAD_ITEM_FIELDS = (('name', str), ('quantity', int), ('total', int), ('selectedSize', str))
+PAYLOAD_FORMAT_VERSION = 1
+
+def _strip_fields(source: Dict[str, Any], stored: tuple, fields: tuple) -> Tuple[Dict[str, Any], List[str]]:
+    """Drop fields whose value is already stored verbatim in a column"""
+    residual = dict(source)
+    stripped = []
+    for (key, kind), value in zip(fields, stored):
+        if key in residual and type(residual[key]) is kind and residual[key] == value:
+            del residual[key]
+            stripped.append(key)
+    return residual, stripped
+
+def _encode_payload(order_data: Dict[str, Any], customer_row: tuple, item_rows: List[tuple]) -> bytes:
+    """Compact order_data: drop fields duplicated in columns, then zlib-compress
+
+    customer_row is (customer_name, customer_phone, customer_location) and
+    item_rows are (name, quantity, price, size) in order_items order. Only
+    values that read back identically are dropped, so _decode_payload
+    returns an equal dict.
+    """
+    residual = dict(order_data)
+    envelope = {'v': PAYLOAD_FORMAT_VERSION, 'customer': [], 'items': []}
+    
+    customer = order_data.get('customer')
+    if isinstance(customer, dict):
+        residual['customer'], envelope['customer'] = _strip_fields(customer, customer_row, PAYLOAD_CUSTOMER_FIELDS)
+    
+    items = order_data.get('items')
+    if isinstance(items, list) and len(items) == len(item_rows):
+        residual_items = []
+        for item, item_row in zip(items, item_rows):
+            if isinstance(item, dict):
+                item, stripped = _strip_fields(item, item_row, PAYLOAD_ITEM_FIELDS)
+            else:
+                stripped = []
+            residual_items.append(item)
+            envelope['items'].append(stripped)
+        residual['items'] = residual_items
+    
+    envelope['data'] = residual
+    return zlib.compress(json.dumps(envelope, separators=(',', ':')).encode())
+
+def _decode_payload(payload: bytes, customer_row: tuple, item_rows: List[tuple]) -> Dict[str, Any]:
+    """Inverse of _encode_payload, using the row's columns and items"""
+    envelope = json.loads(zlib.decompress(payload))
+    order_data = envelope['data']
+    
+    if envelope['customer']:
+        stored = dict(zip((key for key, _ in PAYLOAD_CUSTOMER_FIELDS), customer_row))
+        order_data['customer'].update((key, stored[key]) for key in envelope['customer'])
+    
+    for item, stripped, item_row in zip(order_data.get('items', ()), envelope['items'], item_rows):
+        stored = dict(zip((key for key, _ in PAYLOAD_ITEM_FIELDS), item_row))
+        # REAL columns come back as floats; stripped values were ints
+        item.update((key, int(stored[key]) if key in ('quantity', 'total') else stored[key]) for key in stripped)
+    
+    return order_data
+
+class _SlotRow(Mapping):
+    """Read-only dict-style access to the _fields of a __slots__ row"""
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict copy, e.g. for json.dumps"""
+        return {key: getattr(self, key) for key in self._fields}
+
+class OrderItemRow(_SlotRow):
+    """Compact order item row"""
+    __slots__ = ('name', 'quantity', 'total', 'selectedSize')
+    _fields = __slots__
+
+    def __init__(self, name, quantity, total, selectedSize):
+        self.name = name
+        self.quantity = quantity
+        self.total = total
+        self.selectedSize = selectedSize
+
+class OrderRow(_SlotRow):
+    """Compact decoded order with read-only dict-style access
+    
+    Handlers keep using order['status'] / order.get('items'); the row
+    itself stores fields in __slots__ instead of a per-order dict. The
+    order_data payload (JSON text, or a compact blob from _encode_payload)
+    is only decoded on first access, and is {} for rows loaded without it
+    (with_payload=False).
+    """
+    _fields = ORDER_COLUMNS + ('items',)
+    __slots__ = tuple(field for field in _fields if field != 'order_data') + ('_payload', '_order_data')
+
+    def __init__(self, *values):
+        for key, value in zip(self._fields, values):
+            if key == 'order_data':
+                self._payload = value
+                self._order_data = None
+            else:
+                setattr(self, key, value)
+
+    @property
+    def order_data(self) -> Dict[str, Any]:
+        if self._order_data is None:
+            if isinstance(self._payload, bytes):
+                self._order_data = _decode_payload(
+                    self._payload,
+                    (self.customer_name, self.customer_phone, self.customer_location),
+                    [(item.name, item.quantity, item.total, item.selectedSize) for item in self.items],
+                )
+            else:
+                self._order_data = json.loads(self._payload) if self._payload else {}
+            self._payload = None
+        return self._order_data
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict copy, e.g. for json.dumps"""
+        data = super().to_dict()
+        data['items'] = [item.to_dict() for item in self.items]
+        return data
+
+def _decode_order(order_row: tuple, items: List[tuple]) -> OrderRow:
+    """Decode an ORDER_SELECT row and its (name, quantity, price, size) item rows"""
+    (order_id, user_id, username, first_name, customer_name, customer_phone,
+     customer_location, order_data, total_amount, latitude, longitude,
+     delivery_fee, nearest_branch, status, created_at, updated_at) = order_row
+    return OrderRow(
+        order_id, user_id, username, first_name, customer_name, customer_phone,
+        customer_location, order_data, total_amount, latitude, longitude,
+        delivery_fee or 0, nearest_branch, status, created_at, updated_at,
+        [OrderItemRow(*item) for item in items]
+    )
+
+def _location_dict(location_row: tuple) -> Dict[str, Any]:
+    """Location dict from a row selected with LOCATION_SELECT"""
+    location_data = dict(zip(LOCATION_COLUMNS, location_row))
+    location_data['map_links'] = json.loads(location_row[8]) if location_row[8] else {}
+    return location_data
+
+def _migration_base_schema(cursor):
+    """Create base tables and add columns missing from pre-versioned databases"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            customer_name TEXT,
+            customer_phone TEXT,
+            customer_location TEXT,
+            order_data TEXT NOT NULL,
+            total_amount REAL,
+            latitude REAL,
+            longitude REAL,
+            delivery_fee INTEGER DEFAULT 0,
+            nearest_branch TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS locations (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            address TEXT,
+            latitude REAL,
+            longitude REAL,
+            accuracy REAL,
+            map_links TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT NOT NULL,
+            item_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            selected_size TEXT,
+            FOREIGN KEY (order_id) REFERENCES orders (id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admin_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            action TEXT NOT NULL,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Databases created before versioning may lack later orders columns
+    cursor.execute("PRAGMA table_info(orders)")
+    columns = {column[1] for column in cursor.fetchall()}
+    for column, definition in LEGACY_ORDER_COLUMNS:
+        if column not in columns:
+            logger.info(f"Migrating orders table - adding {column} column")
+            cursor.execute(f"ALTER TABLE orders ADD COLUMN {column} {definition}")
+
+def _migration_indexes(cursor):
+    """Create secondary indexes for the hot query paths"""
+    for statement in INDEX_STATEMENTS:
+        cursor.execute(statement)
+
+def _migration_keyset_index(cursor):
+    """Index orders by (created_at, id) for keyset pagination"""
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_created_at")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_id ON orders (created_at, id)")
+
+def _rebuild_order_stats(cursor, include_archive: bool = False):
+    """Recompute the order_stats row from the orders and locations tables
+
+    With include_archive the attached archive's rows are counted too, so
+    the all-time counters survive archival.
+    """
+    orders = "main.orders"
+    locations = "main.locations"
+    if include_archive:
+        orders = (f"(SELECT status, total_amount FROM main.orders "
+                  f"UNION ALL SELECT status, total_amount FROM {ARCHIVE_SCHEMA}.orders)")
+        locations = f"(SELECT id FROM main.locations UNION ALL SELECT id FROM {ARCHIVE_SCHEMA}.locations)"
+    
+    cursor.execute(f"SELECT status, COUNT(*) FROM {orders} GROUP BY status")
+    status_counts = dict(cursor.fetchall())
+    cursor.execute(f"SELECT COUNT(*) FROM {orders}")
+    total_orders = cursor.fetchone()[0]
+    cursor.execute(f"SELECT SUM(total_amount) FROM {orders} WHERE status = 'completed'")
+    total_revenue = cursor.fetchone()[0] or 0
+    cursor.execute(f"SELECT COUNT(*) FROM {locations}")
+    total_locations = cursor.fetchone()[0]
+    
+    status_columns = ', '.join(f"{status}_orders" for status in ORDER_STATUSES)
+    placeholders = ', '.join('?' * (len(ORDER_STATUSES) + 3))
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO order_stats (id, total_orders, total_revenue, total_locations, {status_columns})
+        VALUES (1, {placeholders})
+    ''', (total_orders, total_revenue, total_locations,
+          *(status_counts.get(status, 0) for status in ORDER_STATUSES)))
+
+def _migration_order_stats(cursor):
+    """Add the order_stats rollup row kept current by triggers"""
+    status_columns = ''.join(
+        f"{status}_orders INTEGER NOT NULL DEFAULT 0,\n" for status in ORDER_STATUSES
+    )
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS order_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_orders INTEGER NOT NULL DEFAULT 0,
+            total_revenue REAL NOT NULL DEFAULT 0,
+            total_locations INTEGER NOT NULL DEFAULT 0,
+            {status_columns}
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    insert_status_updates = ''.join(
+        f", {status}_orders = {status}_orders + (NEW.status IS '{status}')" for status in ORDER_STATUSES
+    )
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_insert AFTER INSERT ON orders
+        BEGIN
+            UPDATE order_stats SET
+                total_orders = total_orders + 1,
+                total_revenue = total_revenue
+                    + CASE WHEN NEW.status = 'completed' THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+                {insert_status_updates}
+            WHERE id = 1;
+        END
+    ''')
+    
+    update_status_updates = ''.join(
+        f", {status}_orders = {status}_orders - (OLD.status IS '{status}') + (NEW.status IS '{status}')"
+        for status in ORDER_STATUSES
+    )
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_update AFTER UPDATE OF status, total_amount ON orders
+        BEGIN
+            UPDATE order_stats SET
+                total_revenue = total_revenue
+                    - CASE WHEN OLD.status = 'completed' THEN COALESCE(OLD.total_amount, 0) ELSE 0 END
+                    + CASE WHEN NEW.status = 'completed' THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+                {update_status_updates}
+            WHERE id = 1;
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_location AFTER INSERT ON locations
+        BEGIN
+            UPDATE order_stats SET total_locations = total_locations + 1 WHERE id = 1;
+        END
+    ''')
+    
+    _rebuild_order_stats(cursor)
+
+def _migration_users(cursor):
+    """Add the users table and backfill it from existing orders"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            total_spent REAL NOT NULL DEFAULT 0,
+            last_order_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_last_order ON users (last_order_at)")
+    
+    # Bare columns next to MAX() come from the user's latest order
+    cursor.execute('''
+        INSERT OR REPLACE INTO users (user_id, username, first_name, order_count, total_spent, last_order_at)
+        SELECT user_id, username, first_name, COUNT(*), COALESCE(SUM(total_amount), 0), MAX(created_at)
+        FROM orders
+        GROUP BY user_id
+    ''')
+
+# Uzbekistan numbers: +998, then a 2-digit operator/area code and 7 digits
+DEFAULT_COUNTRY_CODE = '998'
+NATIONAL_NUMBER_LENGTH = 9
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """E.164 form of a phone number as typed in the web app, or None
+
+    "+998 91 123-45-67", "998911234567", "91 123 45 67", "8 91 1234567"
+    and "00998911234567" all become "+998911234567". Other numbers
+    written with a leading + or 00 keep their own country code.
+    """
+    if not phone:
+        return None
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    international = phone.strip().startswith('+')
+    if digits.startswith('00'):
+        digits = digits[2:]
+        international = True
+    
+    if len(digits) == NATIONAL_NUMBER_LENGTH and not international:
+        return f"+{DEFAULT_COUNTRY_CODE}{digits}"
+    if len(digits) == NATIONAL_NUMBER_LENGTH + 1 and digits.startswith('8') and not international:
+        # Old trunk prefix: 8 91 123 45 67
+        return f"+{DEFAULT_COUNTRY_CODE}{digits[1:]}"
+    if digits.startswith(DEFAULT_COUNTRY_CODE) and len(digits) == len(DEFAULT_COUNTRY_CODE) + NATIONAL_NUMBER_LENGTH:
+        return f"+{digits}"
+    if international and 8 <= len(digits) <= 15:
+        return f"+{digits}"
+    return None
+
+def _phone_search_terms(phone: str) -> str:
+    """Digits-only forms of a phone number, with and without the 998 country code"""
+    digits = ''.join(ch for ch in phone or '' if ch.isdigit())
+    if digits.startswith('998') and len(digits) > 9:
+        return f"{digits} {digits[3:]}"
+    return digits
+
+def _order_search_row(order_id: str, customer_name: str, customer_phone: str,
+                      username: str, item_names: List[str]) -> tuple:
+    """orders_fts row for one order"""
+    phone = f"{customer_phone or ''} {_phone_search_terms(customer_phone)}".strip()
+    return (order_id, customer_name or '', phone, username or '', ' '.join(name or '' for name in item_names))
+
+def _search_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query: whole words, the last one as a prefix
+
+    Words are quoted, so FTS5 operators and punctuation typed by an admin
+    are treated as text. Only the last word is a prefix ("Ali Vali" finds
+    "Ali Valiyev"); prefixes of up to eight characters are served by the
+    prefix indexes (SEARCH_PREFIX_LENGTHS), longer ones cost a merge over
+    every matching term.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return ''
+    return ' '.join([f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*'])
+
+def _migration_order_search(cursor):
+    """Add the orders_fts full-text index and backfill it from existing orders"""
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+            order_id UNINDEXED,
+            customer_name,
+            customer_phone,
+            username,
+            items,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4'
+        )
+    ''')
+    
+    # Oldest first, so FTS rowids follow order age like new inserts do
+    cursor.execute('''
+        SELECT o.id, o.customer_name, o.customer_phone, o.username,
+               (SELECT group_concat(item_name, ' ') FROM order_items WHERE order_id = o.id)
+        FROM orders o
+        ORDER BY o.created_at, o.id
+    ''')
+    rows = [
+        _order_search_row(order_id, name, phone, username, [items or ''])
+        for order_id, name, phone, username, items in cursor.fetchall()
+    ]
+    cursor.executemany('''
+        INSERT INTO orders_fts (order_id, customer_name, customer_phone, username, items)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+
+def _migration_phone_normalized(cursor):
+    """Add orders.phone_normalized with an index, filled from customer_phone"""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(orders)")}
+    if 'phone_normalized' not in columns:
+        cursor.execute("ALTER TABLE orders ADD COLUMN phone_normalized TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders (phone_normalized, created_at)")
+
+    cursor.execute('''
+        SELECT id, customer_phone FROM orders
+        WHERE phone_normalized IS NULL AND customer_phone IS NOT NULL
+    ''')
+    cursor.executemany(
+        "UPDATE orders SET phone_normalized = ? WHERE id = ?",
+        [(normalize_phone(phone), order_id) for order_id, phone in cursor.fetchall() if normalize_phone(phone)],
+    )
+
+# Geohash cells for locations and orders: 9 characters is a ~5 m cell,
+# and every shorter prefix selects one contiguous range of the index
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# Most cells a bounding-box query reads: a cell and its eight neighbours
+GEOHASH_MAX_CELLS = 9
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LATITUDE = math.pi * EARTH_RADIUS_KM / 180
+
+def geohash_encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Standard base32 geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        # Bits alternate longitude, latitude, longitude, ...
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+def _geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """(height, width) in degrees of a geohash cell of the given length"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+def _geohash_cells(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[str]:
+    """Geohash prefixes whose cells together cover a bounding box
+
+    Uses the longest prefix for which the box spans at most a 3x3 block
+    of cells, i.e. one cell and its neighbours.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _geohash_cell_size(precision)
+        rows = range(int((min_lat + 90.0) // height), int((max_lat + 90.0) // height) + 1)
+        columns = range(int((min_lon + 180.0) // width), int((max_lon + 180.0) // width) + 1)
+        if len(rows) * len(columns) <= GEOHASH_MAX_CELLS:
+            break
+    # Encode each cell's centre, which lies safely inside it
+    return sorted({
+        geohash_encode(-90.0 + (row + 0.5) * height, -180.0 + (column + 0.5) * width, precision)
+        for row in rows
+        for column in columns
+    })
+
+def _radius_bbox(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) of a box containing the circle"""
+    lat_delta = radius_km / KM_PER_DEGREE_LATITUDE
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    # Degrees of longitude are shortest on the poleward edge of the box
+    widest_cos = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    lon_delta = radius_km / (KM_PER_DEGREE_LATITUDE * max(widest_cos, 1e-6))
+    return min_lat, max(longitude - lon_delta, -180.0), max_lat, min(longitude + lon_delta, 180.0)
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Haversine distance, as in utils.calculate_distance (kept here so this module needs no config)"""
+    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def _migration_geohash(cursor):
+    """Add a geohash column and index to locations and orders, filled from their coordinates"""
+    for table in ('locations', 'orders'):
+        columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if 'geohash' not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN geohash TEXT")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_geohash ON {table} (geohash)")
+
+        cursor.execute(f'''
+            SELECT id, latitude, longitude FROM {table}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND geohash IS NULL
+        ''')
+        cursor.executemany(
+            f"UPDATE {table} SET geohash = ? WHERE id = ?",
+            [(geohash_encode(latitude, longitude), row_id) for row_id, latitude, longitude in cursor.fetchall()],
+        )
+
+# Report days are Tashkent calendar days (UTC+5, no DST); created_at is UTC
+STATS_DAY_OFFSET = '+5 hours'
+
+def _stats_day(column: str) -> str:
+    """SQL expression for the local report day of a UTC timestamp column"""
+    return f"date({column}, '{STATS_DAY_OFFSET}')"
+
+def _rebuild_daily_branch_stats(cursor, include_archive: bool = False):
+    """Recompute every daily_branch_stats row from the orders table"""
+    orders = "main.orders"
+    if include_archive:
+        orders = (f"(SELECT created_at, nearest_branch, status, total_amount FROM main.orders "
+                  f"UNION ALL SELECT created_at, nearest_branch, status, total_amount FROM {ARCHIVE_SCHEMA}.orders)")
+    status_columns = ''.join(f", {status}_orders" for status in ORDER_STATUSES)
+    status_sums = ''.join(f", SUM(status IS '{status}')" for status in ORDER_STATUSES)
+    cursor.execute("DELETE FROM daily_branch_stats")
+    cursor.execute(f'''
+        INSERT INTO daily_branch_stats (day, branch, total_orders, order_amount, revenue{status_columns})
+        SELECT {_stats_day('created_at')}, COALESCE(nearest_branch, ''), COUNT(*),
+               TOTAL(total_amount), TOTAL(CASE WHEN status = 'completed' THEN total_amount END){status_sums}
+        FROM {orders}
+        GROUP BY 1, 2
+    ''')
+
+def _migration_daily_branch_stats(cursor):
+    """Add the daily_branch_stats rollup kept current by triggers on orders"""
+    status_columns = ''.join(
+        f"{status}_orders INTEGER NOT NULL DEFAULT 0,\n" for status in ORDER_STATUSES
+    )
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS daily_branch_stats (
+            day TEXT NOT NULL,
+            branch TEXT NOT NULL,
+            total_orders INTEGER NOT NULL DEFAULT 0,
+            order_amount REAL NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            {status_columns}
+            PRIMARY KEY (day, branch)
+        ) WITHOUT ROWID
+    ''')
+
+    # One upsert adds an order to its (day, branch) bucket; the update
+    # trigger first takes the old row version out of its bucket, so status,
+    # amount and branch changes all move the counts to the right place
+    status_names = ''.join(f", {status}_orders" for status in ORDER_STATUSES)
+    status_values = ''.join(f", NEW.status IS '{status}'" for status in ORDER_STATUSES)
+    status_increments = ''.join(
+        f", {status}_orders = {status}_orders + excluded.{status}_orders" for status in ORDER_STATUSES
+    )
+    add_new_order = f'''
+        INSERT INTO daily_branch_stats (day, branch, total_orders, order_amount, revenue{status_names})
+        VALUES ({_stats_day('NEW.created_at')}, COALESCE(NEW.nearest_branch, ''), 1,
+                COALESCE(NEW.total_amount, 0),
+                CASE WHEN NEW.status = 'completed' THEN COALESCE(NEW.total_amount, 0) ELSE 0 END{status_values})
+        ON CONFLICT (day, branch) DO UPDATE SET
+            total_orders = total_orders + 1,
+            order_amount = order_amount + excluded.order_amount,
+            revenue = revenue + excluded.revenue{status_increments};
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_branch_stats_insert AFTER INSERT ON orders
+        BEGIN
+            {add_new_order}
+        END
+    ''')
+
+    status_decrements = ''.join(
+        f", {status}_orders = {status}_orders - (OLD.status IS '{status}')" for status in ORDER_STATUSES
+    )
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_branch_stats_update
+        AFTER UPDATE OF status, total_amount, nearest_branch, created_at ON orders
+        BEGIN
+            UPDATE daily_branch_stats SET
+                total_orders = total_orders - 1,
+                order_amount = order_amount - COALESCE(OLD.total_amount, 0),
+                revenue = revenue
+                    - CASE WHEN OLD.status = 'completed' THEN COALESCE(OLD.total_amount, 0) ELSE 0 END
+                {status_decrements}
+            WHERE day = {_stats_day('OLD.created_at')} AND branch = COALESCE(OLD.nearest_branch, '');
+            {add_new_order}
+        END
+    ''')
+
+    _rebuild_daily_branch_stats(cursor)
+
+def _migration_active_order_index(cursor):
+    """Add a partial index over pending orders for get_user_current_order"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_user_pending ON orders (user_id, created_at)
+        WHERE status = 'pending'
+    ''')
+
+def _migration_outbox(cursor):
+    """Add the outbox table for notifications written with their order"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at)
+        WHERE status = 'pending'
+    ''')
+
+# Prefix lengths indexed by orders_fts; a longer prefix in a search
+# merges the doclist of every term it matches before the LIMIT applies
+SEARCH_PREFIX_LENGTHS = '2 3 4 5 6 7 8'
+
+def _migration_search_prefixes(cursor):
+    """Rebuild orders_fts with prefix indexes for words of up to eight characters
+
+    A common word typed in full ("Lavash") is still searched as a prefix,
+    and with only the 2-4 character indexes that read its whole doclist.
+    """
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE orders_fts_rebuild USING fts5(
+            order_id UNINDEXED,
+            customer_name,
+            customer_phone,
+            username,
+            items,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '{SEARCH_PREFIX_LENGTHS}'
+        )
+    ''')
+    # Copy rows with their rowids, which follow order age; archived orders stay searchable
+    cursor.execute('''
+        INSERT INTO orders_fts_rebuild (rowid, order_id, customer_name, customer_phone, username, items)
+        SELECT rowid, order_id, customer_name, customer_phone, username, items FROM orders_fts
+    ''')
+    cursor.execute("DROP TABLE orders_fts")
+    cursor.execute("ALTER TABLE orders_fts_rebuild RENAME TO orders_fts")
+
+# Ordered schema migrations; the position in this list is the schema version
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_indexes,
+    _migration_keyset_index,
+    _migration_order_stats,
+    _migration_users,
+    _migration_order_search,
+    _migration_phone_normalized,
+    _migration_geohash,
+    _migration_daily_branch_stats,
+    _migration_active_order_index,
+    _migration_outbox,
+    _migration_search_prefixes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections"""
+
+    def __init__(self, db_path: str, max_size: int = 5, timeout: float = 30.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """Open a connection and apply per-connection settings once"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        # Wait for a write lock held by another process (db_tools, a second
+        # bot instance) instead of failing with "database is locked"
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        # Only takes effect on a new file (and must precede WAL); existing
+        # files are converted by `db_tools.py enable-incremental-vacuum`
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one while below max_size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._create_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Hand out a pooled connection for the duration of one task"""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+def _default_archive_path(db_path: str) -> str:
+    """delivery_bot.db -> delivery_bot_archive.db"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+# Users whose current order is remembered between location, confirm and cancel steps
+ACTIVE_ORDER_CACHE_SIZE = 1024
+# Recently created or read orders, for the accept/reject/confirm callbacks
+ORDER_CACHE_SIZE = 512
+
+class LRUCache:
+    """Small thread-safe LRU mapping for per-process read caches
+
+    get returns `default` for keys that are not cached, so None can be
+    cached as a real value. Every invalidation bumps `generation`; a
+    reader that loaded a value from the database passes the generation it
+    saw before the read to put, so a result that raced an invalidation is
+    not cached. hits and misses count get calls for monitoring.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value, generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def discard_where(self, predicate):
+        """Drop every entry whose value matches predicate"""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, value in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring the cache"""
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+# Marks a cache miss, since None is a cached "no active order" answer
+_NOT_CACHED = object()
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "delivery_bot.db"):
-        """Initialize database manager with SQLite database"""
+    def __init__(self, db_path: str = "delivery_bot.db", pool_size: int = 5,
+                 archive_path: Optional[str] = None, compact_payload: bool = True):
+        """Initialize database manager with SQLite database
+        
+        compact_payload stores new order_data payloads without the fields
+        already kept in columns and order_items, zlib-compressed. Rows in
+        either format are read back the same way.
+        
+        Nothing is opened here; call init_database() (or
+        AsyncDatabaseManager.initialize()) once before the first query.
+        """
         self.db_path = db_path
-        self.init_database()
+        self.archive_path = archive_path or _default_archive_path(db_path)
+        self.compact_payload = compact_payload
+        self.pool = ConnectionPool(db_path, max_size=pool_size)
+        # user_id -> pending OrderRow or None; only valid while this process
+        # is the one changing order status
+        self.active_orders = LRUCache(ACTIVE_ORDER_CACHE_SIZE)
+        # order_id -> OrderRow, under the same assumption
+        self.orders = LRUCache(ORDER_CACHE_SIZE)
+
+    def close(self):
+        """Close pooled database connections"""
+        logger.info(f"Read caches: {self.get_cache_stats()}")
+        self.pool.close_all()
+    
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Size and hit/miss counters of the in-process read caches"""
+        return {
+            'orders': self.orders.stats(),
+            'active_orders': self.active_orders.stats(),
+        }
     
     def init_database(self):
-        """Initialize database tables"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Create orders table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS orders (
-                        id TEXT PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        customer_name TEXT,
-                        customer_phone TEXT,
-                        customer_location TEXT,
-                        order_data TEXT NOT NULL,
-                        total_amount REAL,
-                        latitude REAL,
-                        longitude REAL,
-                        delivery_fee INTEGER DEFAULT 0,
-                        nearest_branch TEXT,
-                        status TEXT DEFAULT 'pending',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Create locations table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS locations (
-                        id TEXT PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        address TEXT,
-                        latitude REAL,
-                        longitude REAL,
-                        accuracy REAL,
-                        map_links TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Create order_items table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS order_items (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        order_id TEXT NOT NULL,
-                        item_name TEXT NOT NULL,
-                        quantity INTEGER NOT NULL,
-                        price REAL NOT NULL,
-                        selected_size TEXT,
-                        FOREIGN KEY (order_id) REFERENCES orders (id)
-                    )
-                ''')
-                
-                # Create admin_logs table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS admin_logs (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        action TEXT NOT NULL,
-                        details TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Migrate existing database if needed
-                self._migrate_database(cursor)
-                
-                conn.commit()
-                logger.info("Database initialized successfully")
-                
-                # Add new columns to existing orders table if they don't exist
-                self._migrate_orders_table()
-                
-        except Exception as e:
-            logger.error(f"Error initializing database: {e}")
+        """Bring the database schema up to date
 
-    def _migrate_orders_table(self):
-        """Add new columns to orders table if they don't exist"""
+        The applied schema version is kept in PRAGMA user_version, so an
+        up-to-date database costs a single PRAGMA read. Pending migrations
+        run in order inside one transaction.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Check if latitude column exists
-                cursor.execute("PRAGMA table_info(orders)")
-                columns = [column[1] for column in cursor.fetchall()]
-                
-                # Add missing columns
-                if 'latitude' not in columns:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN latitude REAL")
-                    logger.info("Added latitude column to orders table")
+                current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                if current_version >= SCHEMA_VERSION:
+                    return
                 
-                if 'longitude' not in columns:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN longitude REAL")
-                    logger.info("Added longitude column to orders table")
+                cursor.execute("BEGIN IMMEDIATE")
                 
-                if 'delivery_fee' not in columns:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN delivery_fee INTEGER DEFAULT 0")
-                    logger.info("Added delivery_fee column to orders table")
-                
-                if 'nearest_branch' not in columns:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN nearest_branch TEXT")
-                    logger.info("Added nearest_branch column to orders table")
+                # Another process may have migrated while we waited for the lock
+                current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                for version in range(current_version + 1, SCHEMA_VERSION + 1):
+                    migration = MIGRATIONS[version - 1]
+                    logger.info(f"Applying database migration {version}: {migration.__doc__}")
+                    migration(cursor)
                 
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
                 conn.commit()
-                logger.info("Orders table migration completed successfully")
+                logger.info(f"Database migrated from version {current_version} to {SCHEMA_VERSION}")
                 
         except Exception as e:
-            logger.error(f"Error migrating orders table: {e}")
-            raise
-    
-    def _migrate_database(self, cursor):
-        """Migrate existing database schema if needed"""
-        try:
-            # Check if username column exists in orders table
-            cursor.execute("PRAGMA table_info(orders)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'username' not in columns:
-                logger.info("Migrating orders table - adding username column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN username TEXT")
-            
-            if 'first_name' not in columns:
-                logger.info("Migrating orders table - adding first_name column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN first_name TEXT")
-            
-            if 'customer_name' not in columns:
-                logger.info("Migrating orders table - adding customer_name column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN customer_name TEXT")
-            
-            if 'customer_phone' not in columns:
-                logger.info("Migrating orders table - adding customer_phone column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN customer_phone TEXT")
-            
-            if 'customer_location' not in columns:
-                logger.info("Migrating orders table - adding customer_location column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN customer_location TEXT")
-            
-            if 'total_amount' not in columns:
-                logger.info("Migrating orders table - adding total_amount column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN total_amount REAL")
-            
-            if 'status' not in columns:
-                logger.info("Migrating orders table - adding status column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'pending'")
-            
-            if 'updated_at' not in columns:
-                logger.info("Migrating orders table - adding updated_at column")
-                cursor.execute("ALTER TABLE orders ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-            
-            # Check if locations table exists
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='locations'")
-            if not cursor.fetchone():
-                logger.info("Creating locations table")
-                cursor.execute('''
-                    CREATE TABLE locations (
-                        id TEXT PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        address TEXT,
-                        latitude REAL,
-                        longitude REAL,
-                        accuracy REAL,
-                        map_links TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-            
-            # Check if order_items table exists
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='order_items'")
-            if not cursor.fetchone():
-                logger.info("Creating order_items table")
-                cursor.execute('''
-                    CREATE TABLE order_items (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        order_id TEXT NOT NULL,
-                        item_name TEXT NOT NULL,
-                        quantity INTEGER NOT NULL,
-                        price REAL NOT NULL,
-                        selected_size TEXT,
-                        FOREIGN KEY (order_id) REFERENCES orders (id)
-                    )
-                ''')
-            
-            # Check if admin_logs table exists
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='admin_logs'")
-            if not cursor.fetchone():
-                logger.info("Creating admin_logs table")
-                cursor.execute('''
-                    CREATE TABLE admin_logs (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        action TEXT NOT NULL,
-                        details TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-            
-            logger.info("Database migration completed")
-            
-        except Exception as e:
-            logger.error(f"Error during database migration: {e}")
-            raise
+            logger.error(f"Error initializing database: {e}")
     
     def create_order(self, user_id: int, username: str, first_name: str, 
-                    order_data: Dict[str, Any]) -> str:
-        """Create a new order in the database"""
+                    order_data: Dict[str, Any], outbox: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> str:
+        """Create a new order in the database
+        
+        outbox is a list of (kind, payload) notifications queued in the
+        same transaction; each payload gets the new order's id as
+        'order_id'. OutboxDispatcher delivers them after the commit.
+        """
         try:
-            order_id = str(uuid.uuid4())[:8]
-            
             # Extract customer information
             customer = order_data.get('customer', {})
             customer_name = customer.get('name', '')
@@ -240,29 +1091,83 @@ class DatabaseManager:
             # Calculate total amount
             total_amount = order_data.get('total', 0)
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Insert order
-                cursor.execute('''
-                    INSERT INTO orders (id, user_id, username, first_name, customer_name, 
-                                      customer_phone, customer_location, order_data, total_amount)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (order_id, user_id, username, first_name, customer_name, 
-                     customer_phone, customer_location, json.dumps(order_data), total_amount))
-                
-                # Insert order items
-                items = order_data.get('items', [])
-                for item in items:
-                    cursor.execute('''
-                        INSERT INTO order_items (order_id, item_name, quantity, price, selected_size)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (order_id, item.get('name', ''), item.get('quantity', 1), 
-                         item.get('total', 0), item.get('selectedSize', '')))
-                
-                conn.commit()
-                logger.info(f"Order {order_id} created successfully")
-                return order_id
+            # Prepare rows before taking the write lock
+            items = [
+                (item.get('name', ''), item.get('quantity', 1),
+                 item.get('total', 0), item.get('selectedSize', ''))
+                for item in order_data.get('items', [])
+            ]
+            if self.compact_payload:
+                payload = _encode_payload(order_data, (customer_name, customer_phone, customer_location), items)
+            else:
+                payload = json.dumps(order_data)
+            
+            for attempt in range(ID_MAX_ATTEMPTS):
+                order_id = new_record_id()
+                try:
+                    with self.pool.connection() as conn:
+                        cursor = conn.cursor()
+                        
+                        # Insert order
+                        cursor.execute('''
+                            INSERT INTO orders (id, user_id, username, first_name, customer_name,
+                                              customer_phone, customer_location, order_data, total_amount,
+                                              phone_normalized)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', (order_id, user_id, username, first_name, customer_name,
+                             customer_phone, customer_location, payload, total_amount,
+                             normalize_phone(customer_phone)))
+                        
+                        # Insert all order items with one prepared statement
+                        cursor.executemany('''
+                            INSERT INTO order_items (order_id, item_name, quantity, price, selected_size)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', [(order_id, *item) for item in items])
+                        
+                        # Read the stored row back for the cache: column affinity turns
+                        # int amounts and prices into REAL, and RETURNING reports them
+                        # before that conversion
+                        cursor.execute(f"SELECT {ORDER_SELECT} FROM orders WHERE id = ?", (order_id,))
+                        order_row = cursor.fetchone()
+                        stored_items = self._get_items_for_orders(cursor, [order_id]).get(order_id, [])
+                        
+                        # Keep the search index in the same transaction
+                        cursor.execute('''
+                            INSERT INTO orders_fts (order_id, customer_name, customer_phone, username, items)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', _order_search_row(order_id, customer_name, customer_phone, username,
+                                                [item[0] for item in items]))
+                        
+                        # Keep the per-user rollup in the same transaction
+                        cursor.execute('''
+                            INSERT INTO users (user_id, username, first_name, order_count, total_spent, last_order_at)
+                            VALUES (?, ?, ?, 1, ?, CURRENT_TIMESTAMP)
+                            ON CONFLICT (user_id) DO UPDATE SET
+                                username = excluded.username,
+                                first_name = excluded.first_name,
+                                order_count = order_count + 1,
+                                total_spent = total_spent + excluded.total_spent,
+                                last_order_at = excluded.last_order_at
+                        ''', (user_id, username, first_name, total_amount or 0))
+                        
+                        # Notifications commit or roll back together with the order
+                        if outbox:
+                            cursor.executemany('''
+                                INSERT INTO outbox (kind, payload) VALUES (?, ?)
+                            ''', [(kind, json.dumps(dict(payload, order_id=order_id))) for kind, payload in outbox])
+                        
+                        conn.commit()
+                    break
+                except sqlite3.IntegrityError as e:
+                    if attempt == ID_MAX_ATTEMPTS - 1 or not _is_duplicate_id(e, 'orders'):
+                        raise
+                    logger.warning(f"Order id {order_id} already exists, retrying with a new id")
+            
+            self.active_orders.pop(user_id)
+            # The channel post and the admin callbacks read it back right away
+            self.orders.put(order_id, _decode_order(order_row, stored_items))
+            logger.info(f"Order {order_id} created successfully")
+            return order_id
                 
         except Exception as e:
             logger.error(f"Error creating order: {e}")
@@ -272,8 +1177,6 @@ class DatabaseManager:
                        location_data: Dict[str, Any]) -> str:
         """Create a new location record in the database"""
         try:
-            location_id = str(uuid.uuid4())[:8]
-            
             # Extract location information
             coordinates = location_data.get('coordinates', {})
             address = location_data.get('address', '')
@@ -281,118 +1184,205 @@ class DatabaseManager:
             longitude = coordinates.get('longitude')
             accuracy = coordinates.get('accuracy')
             maps = location_data.get('maps', {})
+            geohash = geohash_encode(latitude, longitude) if latitude is not None and longitude is not None else None
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT INTO locations (id, user_id, username, first_name, address,
-                                         latitude, longitude, accuracy, map_links)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (location_id, user_id, username, first_name, address,
-                     latitude, longitude, accuracy, json.dumps(maps)))
-                
-                conn.commit()
-                logger.info(f"Location {location_id} created successfully")
-                return location_id
+            for attempt in range(ID_MAX_ATTEMPTS):
+                location_id = new_record_id()
+                try:
+                    with self.pool.connection() as conn:
+                        cursor = conn.cursor()
+                        
+                        cursor.execute('''
+                            INSERT INTO locations (id, user_id, username, first_name, address,
+                                                 latitude, longitude, accuracy, map_links, geohash)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', (location_id, user_id, username, first_name, address,
+                             latitude, longitude, accuracy, json.dumps(maps), geohash))
+                        
+                        conn.commit()
+                    break
+                except sqlite3.IntegrityError as e:
+                    if attempt == ID_MAX_ATTEMPTS - 1 or not _is_duplicate_id(e, 'locations'):
+                        raise
+                    logger.warning(f"Location id {location_id} already exists, retrying with a new id")
+            
+            logger.info(f"Location {location_id} created successfully")
+            return location_id
                 
         except Exception as e:
             logger.error(f"Error creating location: {e}")
             raise
     
-    def get_order(self, order_id: str) -> Optional[Dict[str, Any]]:
-        """Get order by ID"""
+    def _attach_archive(self, cursor, create: bool = False) -> bool:
+        """Attach the archive database to this connection if it is available
+
+        Without create, nothing is attached until an archive run has
+        created the file.
+        """
+        if not create and not os.path.exists(self.archive_path):
+            return False
+        attached = {row[1] for row in cursor.execute("PRAGMA database_list")}
+        if ARCHIVE_SCHEMA not in attached:
+            cursor.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (self.archive_path,))
+        return True
+    
+    def _fetch_order(self, cursor, schema: str, order_id: str) -> Optional[OrderRow]:
+        """Read one order and its items from the main or archive schema"""
+        cursor.execute(f'''
+            SELECT {ORDER_SELECT} FROM {schema}.orders WHERE id = ?
+        ''', (order_id,))
+        
+        order_row = cursor.fetchone()
+        if not order_row:
+            return None
+        
+        # Get order items
+        cursor.execute(f'''
+            SELECT item_name, quantity, price, selected_size 
+            FROM {schema}.order_items WHERE order_id = ?
+            ORDER BY id
+        ''', (order_id,))
+        
+        items = cursor.fetchall()
+        
+        return _decode_order(order_row, items)
+    
+    def get_order(self, order_id: str) -> Optional[OrderRow]:
+        """Get order by ID, falling back to the archive for old orders
+        
+        Recently created or read orders come from the orders cache;
+        status and location updates drop the cached row.
+        """
+        order = self.orders.get(order_id)
+        if order is not None:
+            return order
+        generation = self.orders.generation
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM orders WHERE id = ?
-                ''', (order_id,))
-                
-                order_row = cursor.fetchone()
-                if not order_row:
-                    return None
-                
-                # Get order items
-                cursor.execute('''
-                    SELECT item_name, quantity, price, selected_size 
-                    FROM order_items WHERE order_id = ?
-                ''', (order_id,))
-                
-                items = cursor.fetchall()
-                
-                # Reconstruct order data
-                order_data = {
-                    'id': order_row[0],
-                    'user_id': order_row[1],
-                    'username': order_row[2],
-                    'first_name': order_row[3],
-                    'customer_name': order_row[4],
-                    'customer_phone': order_row[5],
-                    'customer_location': order_row[6],
-                    'order_data': json.loads(order_row[7]),
-                    'total_amount': order_row[8],
-                    'latitude': order_row[9],
-                    'longitude': order_row[10],
-                    'delivery_fee': order_row[11] or 0,
-                    'nearest_branch': order_row[12],
-                    'status': order_row[13],
-                    'created_at': order_row[14],
-                    'updated_at': order_row[15],
-                    'items': [
-                        {
-                            'name': item[0],
-                            'quantity': item[1],
-                            'total': item[2],
-                            'selectedSize': item[3]
-                        } for item in items
-                    ]
-                }
+                order = self._fetch_order(cursor, 'main', order_id)
+                if order is None and self._attach_archive(cursor):
+                    order = self._fetch_order(cursor, ARCHIVE_SCHEMA, order_id)
                 
-                return order_data
+                if order is not None:
+                    self.orders.put(order_id, order, generation)
+                return order
                 
         except Exception as e:
             logger.error(f"Error getting order {order_id}: {e}")
             return None
     
     def get_location(self, location_id: str) -> Optional[Dict[str, Any]]:
-        """Get location by ID"""
+        """Get location by ID, falling back to the archive for old locations"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM locations WHERE id = ?
+                cursor.execute(f'''
+                    SELECT {LOCATION_SELECT} FROM main.locations WHERE id = ?
                 ''', (location_id,))
                 
                 location_row = cursor.fetchone()
+                if not location_row and self._attach_archive(cursor):
+                    cursor.execute(f'''
+                        SELECT {LOCATION_SELECT} FROM {ARCHIVE_SCHEMA}.locations WHERE id = ?
+                    ''', (location_id,))
+                    location_row = cursor.fetchone()
                 if not location_row:
                     return None
                 
-                location_data = {
-                    'id': location_row[0],
-                    'user_id': location_row[1],
-                    'username': location_row[2],
-                    'first_name': location_row[3],
-                    'address': location_row[4],
-                    'latitude': location_row[5],
-                    'longitude': location_row[6],
-                    'accuracy': location_row[7],
-                    'map_links': json.loads(location_row[8]) if location_row[8] else {},
-                    'created_at': location_row[9]
-                }
-                
-                return location_data
-                
+                return _location_dict(location_row)
+        
         except Exception as e:
             logger.error(f"Error getting location {location_id}: {e}")
             return None
     
+    def _select_in_bbox(self, cursor, table: str, columns: str,
+                        bbox: Tuple[float, float, float, float]) -> List[tuple]:
+        """Rows of table inside bbox, read as one geohash range per covering cell"""
+        min_lat, min_lon, max_lat, max_lon = bbox
+        rows = []
+        for prefix in _geohash_cells(*bbox):
+            # '~' sorts after every geohash character, closing the prefix range
+            cursor.execute(f'''
+                SELECT {columns} FROM main.{table}
+                WHERE geohash >= ? AND geohash < ?
+                  AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+            ''', (prefix, prefix + '~', min_lat, max_lat, min_lon, max_lon))
+            rows.extend(cursor.fetchall())
+        return rows
+    
+    def get_locations_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                              limit: int = 100) -> List[Dict[str, Any]]:
+        """Locations inside a latitude/longitude box, newest first"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                rows = self._select_in_bbox(cursor, 'locations', LOCATION_SELECT,
+                                            (min_lat, min_lon, max_lat, max_lon))
+                rows.sort(key=lambda row: (row[9], row[0]), reverse=True)
+                return [_location_dict(row) for row in rows[:limit]]
+        
+        except Exception as e:
+            logger.error(f"Error getting locations in bounding box: {e}")
+            return []
+    
+    def get_locations_within_radius(self, latitude: float, longitude: float, radius_km: float,
+                                    limit: int = 50) -> List[Dict[str, Any]]:
+        """Locations within radius_km of a point, nearest first, each with distance_km"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                rows = self._select_in_bbox(cursor, 'locations', LOCATION_SELECT,
+                                            _radius_bbox(latitude, longitude, radius_km))
+            
+            locations = []
+            for row in rows:
+                distance = _distance_km(latitude, longitude, row[5], row[6])
+                if distance <= radius_km:
+                    location = _location_dict(row)
+                    location['distance_km'] = round(distance, 3)
+                    locations.append(location)
+            locations.sort(key=lambda location: location['distance_km'])
+            return locations[:limit]
+        
+        except Exception as e:
+            logger.error(f"Error getting locations within radius: {e}")
+            return []
+    
+    def get_orders_within_radius(self, latitude: float, longitude: float, radius_km: float,
+                                 limit: int = 50, with_payload: bool = False) -> List[OrderRow]:
+        """Orders delivered within radius_km of a point, nearest first"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+                rows = self._select_in_bbox(cursor, 'orders', columns,
+                                            _radius_bbox(latitude, longitude, radius_km))
+                
+                nearby = []
+                for row in rows:
+                    distance = _distance_km(latitude, longitude, row[9], row[10])
+                    if distance <= radius_km:
+                        nearby.append((distance, row))
+                nearby.sort(key=lambda entry: entry[0])
+                orders = [row for _, row in nearby[:limit]]
+                
+                items_by_order = self._get_items_for_orders(cursor, [order_row[0] for order_row in orders])
+                return [
+                    _decode_order(order_row, items_by_order.get(order_row[0], []))
+                    for order_row in orders
+                ]
+        
+        except Exception as e:
+            logger.error(f"Error getting orders within radius: {e}")
+            return []
+    
     def update_order_status(self, order_id: str, status: str) -> bool:
         """Update order status"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -401,6 +1391,7 @@ class DatabaseManager:
                 ''', (status, order_id))
                 
                 conn.commit()
+                self._forget_order(order_id, status)
                 logger.info(f"Order {order_id} status updated to {status}")
                 return True
                 
@@ -408,147 +1399,185 @@ class DatabaseManager:
             logger.error(f"Error updating order status: {e}")
             return False
     
-    def get_user_orders(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get user's recent orders"""
+    def transition_order_status(self, order_id: str, status: str) -> Optional[OrderRow]:
+        """Move an order to status if ORDER_TRANSITIONS allows it from its current status
+        
+        The check and the write are one conditional UPDATE, so of several
+        concurrent callers exactly one gets the updated order back; the
+        others, and orders already past that point, get None.
+        """
+        sources = ORDER_TRANSITIONS.get(status)
+        if sources is None:
+            raise ValueError(f"No transitions lead to order status {status!r}")
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM orders WHERE user_id = ? 
+                cursor.execute(f'''
+                    UPDATE orders SET status = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status IN ({', '.join('?' * len(sources))})
+                    RETURNING {ORDER_SELECT}
+                ''', (status, order_id, *sources))
+                order_row = cursor.fetchone()
+                if not order_row:
+                    conn.commit()
+                    return None
+                
+                items = self._get_items_for_orders(cursor, [order_id])
+                conn.commit()
+            
+            self._forget_order(order_id, status)
+            order = _decode_order(order_row, items.get(order_id, []))
+            self.orders.put(order_id, order)
+            logger.info(f"Order {order_id} status changed to {status}")
+            return order
+        
+        except Exception as e:
+            logger.error(f"Error changing order {order_id} status to {status}: {e}")
+            return None
+    
+    def _forget_order(self, order_id: str, status: Optional[str] = None):
+        """Invalidate cached reads of order_id after it changed"""
+        self.orders.pop(order_id)
+        if status == 'pending':
+            # The order may have become someone's current order again
+            self.active_orders.clear()
+        else:
+            self.active_orders.discard_where(lambda order: order is not None and order['id'] == order_id)
+    
+    def get_user_current_order(self, user_id: int) -> Optional[OrderRow]:
+        """The user's newest pending order, or None
+        
+        Served from the active_orders cache when possible; otherwise one
+        seek on the idx_orders_user_pending partial index. create_order,
+        status changes and location updates invalidate the cached entry.
+        The order_data payload is not loaded.
+        """
+        order = self.active_orders.get(user_id, _NOT_CACHED)
+        if order is not _NOT_CACHED:
+            return order
+        generation = self.active_orders.generation
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # The literal 'pending' lets SQLite match the partial index
+                cursor.execute(f'''
+                    SELECT {ORDER_LIST_SELECT} FROM orders
+                    WHERE user_id = ? AND status = 'pending'
+                    ORDER BY created_at DESC LIMIT 1
+                ''', (user_id,))
+                order_row = cursor.fetchone()
+                order = None
+                if order_row:
+                    items = self._get_items_for_orders(cursor, [order_row[0]])
+                    order = _decode_order(order_row, items.get(order_row[0], []))
+                
+                self.active_orders.put(user_id, order, generation)
+                return order
+                
+        except Exception as e:
+            logger.error(f"Error getting current order for user {user_id}: {e}")
+            return None
+    
+    def _get_items_for_orders(self, cursor, order_ids: List[str], schema: str = 'main') -> Dict[str, List[tuple]]:
+        """Fetch items for many orders with a single IN (...) lookup per chunk"""
+        items_by_order = {}
+        for start in range(0, len(order_ids), ITEMS_QUERY_CHUNK_SIZE):
+            chunk = order_ids[start:start + ITEMS_QUERY_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT order_id, item_name, quantity, price, selected_size 
+                FROM {schema}.order_items WHERE order_id IN ({placeholders})
+                ORDER BY id
+            ''', chunk)
+            for row in cursor.fetchall():
+                items_by_order.setdefault(row[0], []).append(row[1:])
+        return items_by_order
+    
+    def get_user_orders(self, user_id: int, limit: int = 10, with_payload: bool = True) -> List[OrderRow]:
+        """Get user's recent orders
+        
+        Pass with_payload=False for list views that never read order_data;
+        the blob column is then not selected at all.
+        """
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+                cursor.execute(f'''
+                    SELECT {columns} FROM orders WHERE user_id = ? 
                     ORDER BY created_at DESC LIMIT ?
                 ''', (user_id, limit))
                 
                 orders = cursor.fetchall()
                 
-                result = []
-                for order_row in orders:
-                    # Get order items
-                    cursor.execute('''
-                        SELECT item_name, quantity, price, selected_size 
-                        FROM order_items WHERE order_id = ?
-                    ''', (order_row[0],))
-                    
-                    items = cursor.fetchall()
-                    
-                    order_data = {
-                        'id': order_row[0],
-                        'user_id': order_row[1],
-                        'username': order_row[2],
-                        'first_name': order_row[3],
-                        'customer_name': order_row[4],
-                        'customer_phone': order_row[5],
-                        'customer_location': order_row[6],
-                        'order_data': json.loads(order_row[7]),
-                        'total_amount': order_row[8],
-                        'latitude': order_row[9],
-                        'longitude': order_row[10],
-                        'delivery_fee': order_row[11] or 0,
-                        'nearest_branch': order_row[12],
-                        'status': order_row[13],
-                        'created_at': order_row[14],
-                        'updated_at': order_row[15],
-                        'items': [
-                            {
-                                'name': item[0],
-                                'quantity': item[1],
-                                'total': item[2],
-                                'selectedSize': item[3]
-                            } for item in items
-                        ]
-                    }
-                    result.append(order_data)
+                # Get items for the whole page in one query
+                items_by_order = self._get_items_for_orders(cursor, [order_row[0] for order_row in orders])
                 
-                return result
+                return [
+                    _decode_order(order_row, items_by_order.get(order_row[0], []))
+                    for order_row in orders
+                ]
                 
         except Exception as e:
             logger.error(f"Error getting user orders: {e}")
             return []
     
-    def get_all_orders(self, limit: int = 50) -> List[Dict[str, Any]]:
+    def get_all_orders(self, limit: int = 50, with_payload: bool = True) -> List[OrderRow]:
         """Get all orders (for admin)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM orders ORDER BY created_at DESC LIMIT ?
+                columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+                cursor.execute(f'''
+                    SELECT {columns} FROM orders ORDER BY created_at DESC LIMIT ?
                 ''', (limit,))
                 
                 orders = cursor.fetchall()
                 
-                result = []
-                for order_row in orders:
-                    # Get order items
-                    cursor.execute('''
-                        SELECT item_name, quantity, price, selected_size 
-                        FROM order_items WHERE order_id = ?
-                    ''', (order_row[0],))
-                    
-                    items = cursor.fetchall()
-                    
-                    order_data = {
-                        'id': order_row[0],
-                        'user_id': order_row[1],
-                        'username': order_row[2],
-                        'first_name': order_row[3],
-                        'customer_name': order_row[4],
-                        'customer_phone': order_row[5],
-                        'customer_location': order_row[6],
-                        'order_data': json.loads(order_row[7]),
-                        'total_amount': order_row[8],
-                        'latitude': order_row[9],
-                        'longitude': order_row[10],
-                        'delivery_fee': order_row[11] or 0,
-                        'nearest_branch': order_row[12],
-                        'status': order_row[13],
-                        'created_at': order_row[14],
-                        'updated_at': order_row[15],
-                        'items': [
-                            {
-                                'name': item[0],
-                                'quantity': item[1],
-                                'total': item[2],
-                                'selectedSize': item[3]
-                            } for item in items
-                        ]
-                    }
-                    result.append(order_data)
+                # Get items for the whole page in one query
+                items_by_order = self._get_items_for_orders(cursor, [order_row[0] for order_row in orders])
                 
-                return result
+                return [
+                    _decode_order(order_row, items_by_order.get(order_row[0], []))
+                    for order_row in orders
+                ]
                 
         except Exception as e:
             logger.error(f"Error getting all orders: {e}")
             return []
     
     def get_statistics(self) -> Dict[str, Any]:
-        """Get database statistics"""
+        """Get database statistics from the order_stats rollup row
+        
+        The row is maintained by triggers on orders and locations, so this
+        is a single primary-key read. Counters are all-time totals; use
+        rebuild_statistics() to recover from drift.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Count orders by status
-                cursor.execute('''
-                    SELECT status, COUNT(*) FROM orders GROUP BY status
+                status_columns = ', '.join(f"{status}_orders" for status in ORDER_STATUSES)
+                cursor.execute(f'''
+                    SELECT total_orders, total_revenue, total_locations, {status_columns}
+                    FROM order_stats WHERE id = 1
                 ''')
-                status_counts = dict(cursor.fetchall())
+                row = cursor.fetchone()
+                if not row:
+                    return {}
                 
-                # Total orders
-                cursor.execute('SELECT COUNT(*) FROM orders')
-                total_orders = cursor.fetchone()[0]
-                
-                # Total revenue
-                cursor.execute('SELECT SUM(total_amount) FROM orders WHERE status = "completed"')
-                total_revenue = cursor.fetchone()[0] or 0
-                
-                # Total locations
-                cursor.execute('SELECT COUNT(*) FROM locations')
-                total_locations = cursor.fetchone()[0]
+                status_counts = {
+                    status: count for status, count in zip(ORDER_STATUSES, row[3:]) if count
+                }
                 
                 return {
-                    'total_orders': total_orders,
-                    'total_revenue': total_revenue,
-                    'total_locations': total_locations,
+                    'total_orders': row[0],
+                    'total_revenue': row[1] or 0,
+                    'total_locations': row[2],
                     'orders_by_status': status_counts
                 }
                 
@@ -556,23 +1585,70 @@ class DatabaseManager:
             logger.error(f"Error getting statistics: {e}")
             return {}
     
+    def get_daily_branch_stats(self, days: int = 7, branch: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Per-branch totals for the last `days` report days, newest day first
+        
+        Reads only the daily_branch_stats rollup (a primary-key range on
+        day). Orders without a known branch are grouped under branch ''.
+        """
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                status_columns = ''.join(f", {status}_orders" for status in ORDER_STATUSES)
+                branch_filter = "AND branch = ?" if branch is not None else ""
+                cursor.execute(f'''
+                    SELECT day, branch, total_orders, order_amount, revenue{status_columns}
+                    FROM daily_branch_stats
+                    WHERE day > date('now', '{STATS_DAY_OFFSET}', ?) AND total_orders > 0 {branch_filter}
+                    ORDER BY day DESC, branch
+                ''', (f'-{days} days', *(() if branch is None else (branch,))))
+                
+                return [
+                    {
+                        'day': row[0],
+                        'branch': row[1],
+                        'total_orders': row[2],
+                        'order_amount': row[3],
+                        'revenue': row[4],
+                        'orders_by_status': {
+                            status: count for status, count in zip(ORDER_STATUSES, row[5:]) if count
+                        },
+                    }
+                    for row in cursor.fetchall()
+                ]
+        
+        except Exception as e:
+            logger.error(f"Error getting daily branch statistics: {e}")
+            return []
+    
+    def rebuild_statistics(self) -> bool:
+        """Recompute the order_stats and daily_branch_stats rollups with full scans (drift recovery)"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                include_archive = self._attach_archive(cursor)
+                cursor.execute("BEGIN IMMEDIATE")
+                _rebuild_order_stats(cursor, include_archive)
+                _rebuild_daily_branch_stats(cursor, include_archive)
+                conn.commit()
+                logger.info("Order statistics rebuilt")
+                return True
+                
+        except Exception as e:
+            logger.error(f"Error rebuilding statistics: {e}")
+            return False
+    
     def get_all_users_with_orders(self, limit: int = 50) -> List[Dict[str, Any]]:
         """Get all users who have placed orders (for admin)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                    SELECT DISTINCT 
-                        user_id, 
-                        username, 
-                        first_name,
-                        COUNT(*) as order_count,
-                        SUM(total_amount) as total_spent,
-                        MAX(created_at) as last_order_date
-                    FROM orders 
-                    GROUP BY user_id, username, first_name
-                    ORDER BY last_order_date DESC
+                    SELECT user_id, username, first_name, order_count, total_spent, last_order_at
+                    FROM users 
+                    ORDER BY last_order_at DESC
                     LIMIT ?
                 ''', (limit,))
                 
@@ -596,66 +1672,151 @@ class DatabaseManager:
             logger.error(f"Error getting users with orders: {e}")
             return []
     
-    def get_recent_orders_admin(self, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
-        """Get recent orders for admin panel with pagination"""
+    def get_recent_orders_admin(self, limit: int = 20, before: Optional[Tuple[str, str]] = None,
+                                after: Optional[Tuple[str, str]] = None,
+                                with_payload: bool = True) -> List[OrderRow]:
+        """Get recent orders for admin panel with keyset pagination
+        
+        Orders are sorted newest first by (created_at, id). Pass the
+        (created_at, id) of the last row on a page as `before` to get the
+        next (older) page, or of the first row as `after` to get the
+        previous (newer) page. Every page is a single index seek.
+        with_payload=False skips the order_data blob column.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM orders ORDER BY created_at DESC LIMIT ? OFFSET ?
-                ''', (limit, offset))
+                columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+                if before:
+                    cursor.execute(f'''
+                        SELECT {columns} FROM orders WHERE (created_at, id) < (?, ?)
+                        ORDER BY created_at DESC, id DESC LIMIT ?
+                    ''', (before[0], before[1], limit))
+                    orders = cursor.fetchall()
+                elif after:
+                    cursor.execute(f'''
+                        SELECT {columns} FROM orders WHERE (created_at, id) > (?, ?)
+                        ORDER BY created_at ASC, id ASC LIMIT ?
+                    ''', (after[0], after[1], limit))
+                    orders = cursor.fetchall()[::-1]
+                else:
+                    cursor.execute(f'''
+                        SELECT {columns} FROM orders ORDER BY created_at DESC, id DESC LIMIT ?
+                    ''', (limit,))
+                    orders = cursor.fetchall()
+                
+                # Get items for the whole page in one query
+                items_by_order = self._get_items_for_orders(cursor, [order_row[0] for order_row in orders])
+                
+                return [
+                    _decode_order(order_row, items_by_order.get(order_row[0], []))
+                    for order_row in orders
+                ]
                 
-                orders = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting recent orders for admin: {e}")
+            return []
+
+    def search_orders(self, query: str, limit: int = 10, with_payload: bool = False) -> List[OrderRow]:
+        """Find orders by customer name, phone, username or item name, newest first
+        
+        Every word in query must match one of those fields, the last one
+        as a prefix. Orders moved to the archive are still found.
+        """
+        match = _search_match_query(query)
+        if not match:
+            return []
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
                 
-                result = []
-                for order_row in orders:
-                    # Get order items
-                    cursor.execute('''
-                        SELECT item_name, quantity, price, selected_size 
-                        FROM order_items WHERE order_id = ?
-                    ''', (order_row[0],))
-                    
-                    items = cursor.fetchall()
-                    
-                    order_data = {
-                        'id': order_row[0],
-                        'user_id': order_row[1],
-                        'username': order_row[2],
-                        'first_name': order_row[3],
-                        'customer_name': order_row[4],
-                        'customer_phone': order_row[5],
-                        'customer_location': order_row[6],
-                        'order_data': json.loads(order_row[7]) if order_row[7] else {},
-                        'total_amount': order_row[8],
-                        'latitude': order_row[9],
-                        'longitude': order_row[10],
-                        'delivery_fee': order_row[11] or 0,
-                        'nearest_branch': order_row[12],
-                        'status': order_row[13],
-                        'created_at': order_row[14],
-                        'updated_at': order_row[15],
-                        'items': [
-                            {
-                                'name': item[0],
-                                'quantity': item[1],
-                                'total': item[2],
-                                'selectedSize': item[3]
-                            } for item in items
-                        ]
-                    }
-                    result.append(order_data)
+                cursor.execute('''
+                    SELECT order_id FROM orders_fts WHERE orders_fts MATCH ?
+                    ORDER BY rowid DESC LIMIT ?
+                ''', (match, limit))
+                order_ids = [row[0] for row in cursor.fetchall()]
+                if not order_ids:
+                    return []
+                
+                columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+                placeholders = ', '.join('?' * len(order_ids))
+                cursor.execute(f'''
+                    SELECT {columns} FROM main.orders WHERE id IN ({placeholders})
+                ''', order_ids)
+                orders = {row[0]: row for row in cursor.fetchall()}
+                
+                missing = [order_id for order_id in order_ids if order_id not in orders]
+                if missing and self._attach_archive(cursor):
+                    placeholders = ', '.join('?' * len(missing))
+                    cursor.execute(f'''
+                        SELECT {columns} FROM {ARCHIVE_SCHEMA}.orders WHERE id IN ({placeholders})
+                    ''', missing)
+                    orders.update((row[0], row) for row in cursor.fetchall())
+                
+                # Items of archived orders were archived with them
+                archived = [order_id for order_id in missing if order_id in orders]
+                items_by_order = self._get_items_for_orders(
+                    cursor, [order_id for order_id in orders if order_id not in archived]
+                )
+                if archived:
+                    items_by_order.update(self._get_items_for_orders(cursor, archived, ARCHIVE_SCHEMA))
+                
+                return [
+                    _decode_order(orders[order_id], items_by_order.get(order_id, []))
+                    for order_id in order_ids if order_id in orders
+                ]
                 
-                return result
+        except Exception as e:
+            logger.error(f"Error searching orders: {e}")
+            return []
+
+    def get_orders_by_phone(self, phone: str, limit: int = 20, with_payload: bool = False) -> List[OrderRow]:
+        """Customer order history by phone number, newest first
+        
+        phone may be in any format normalize_phone understands; the lookup
+        is an index seek on phone_normalized. Archived orders are appended
+        after the live ones when the page is not yet full.
+        """
+        phone_normalized = normalize_phone(phone)
+        if not phone_normalized:
+            return []
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+                cursor.execute(f'''
+                    SELECT {columns} FROM main.orders WHERE phone_normalized = ?
+                    ORDER BY created_at DESC LIMIT ?
+                ''', (phone_normalized, limit))
+                orders = cursor.fetchall()
+                items_by_order = self._get_items_for_orders(cursor, [order_row[0] for order_row in orders])
+                
+                if len(orders) < limit and self._attach_archive(cursor):
+                    cursor.execute(f'''
+                        SELECT {columns} FROM {ARCHIVE_SCHEMA}.orders WHERE phone_normalized = ?
+                        ORDER BY created_at DESC LIMIT ?
+                    ''', (phone_normalized, limit - len(orders)))
+                    archived = cursor.fetchall()
+                    items_by_order.update(self._get_items_for_orders(
+                        cursor, [order_row[0] for order_row in archived], ARCHIVE_SCHEMA
+                    ))
+                    orders += archived
+                
+                return [
+                    _decode_order(order_row, items_by_order.get(order_row[0], []))
+                    for order_row in orders
+                ]
                 
         except Exception as e:
-            logger.error(f"Error getting recent orders for admin: {e}")
+            logger.error(f"Error getting orders by phone: {e}")
             return []
 
     def get_total_orders_count(self) -> int:
         """Get total count of orders"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT COUNT(*) FROM orders')
                 return cursor.fetchone()[0]
@@ -666,14 +1827,15 @@ class DatabaseManager:
     def update_order_location_and_fee(self, order_id: int, latitude: float, longitude: float, delivery_fee: int, nearest_branch: str):
         """Update order with location and delivery fee"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     UPDATE orders 
-                    SET latitude = ?, longitude = ?, delivery_fee = ?, nearest_branch = ?
+                    SET latitude = ?, longitude = ?, geohash = ?, delivery_fee = ?, nearest_branch = ?
                     WHERE id = ?
-                """, (latitude, longitude, delivery_fee, nearest_branch, order_id))
+                """, (latitude, longitude, geohash_encode(latitude, longitude), delivery_fee, nearest_branch, order_id))
                 conn.commit()
+                self._forget_order(order_id)
                 logger.info(f"Updated order {order_id} with location and delivery fee")
         except Exception as e:
             logger.error(f"Error updating order location and fee: {e}")
@@ -681,7 +1843,7 @@ class DatabaseManager:
     def log_admin_access(self, user_id: int, username: str, first_name: str, action: str, details: str = ""):
         """Log admin panel access"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO admin_logs (user_id, username, first_name, action, details)
@@ -692,10 +1854,29 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Error logging admin access: {e}")
 
+    def log_admin_access_batch(self, entries: List[tuple]) -> bool:
+        """Write many admin log entries in one transaction
+        
+        Each entry is (user_id, username, first_name, action, details, created_at).
+        """
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO admin_logs (user_id, username, first_name, action, details, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', entries)
+                conn.commit()
+                logger.info(f"Admin access logged: {len(entries)} entries")
+                return True
+        except Exception as e:
+            logger.error(f"Error logging admin access batch: {e}")
+            return False
+
     def get_admin_logs(self, limit: int = 50) -> List[Dict[str, Any]]:
         """Get admin access logs"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM admin_logs 
@@ -726,17 +1907,13 @@ class DatabaseManager:
     def get_all_users_for_broadcast(self) -> List[Dict[str, Any]]:
         """Get all unique users for broadcast messaging"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Get all unique users from orders table
+                # One row per user, kept current by create_order
                 cursor.execute('''
-                    SELECT DISTINCT 
-                        user_id, 
-                        username, 
-                        first_name
-                    FROM orders 
-                    WHERE user_id IS NOT NULL
+                    SELECT user_id, username, first_name
+                    FROM users 
                     ORDER BY user_id
                 ''')
                 
@@ -756,7 +1933,574 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Error getting users for broadcast: {e}")
             return []
+    
+    def backfill_phone_numbers(self, batch_size: int = 500) -> int:
+        """Fill phone_normalized for orders written before the column existed
+        
+        Same batching as compact_order_payloads: rowid order, one write
+        transaction per batch, safe to stop and rerun. Numbers that cannot
+        be normalized stay NULL. Returns the number of rows updated.
+        For db_tools.py (`backfill-phones`) only.
+        """
+        updated = 0
+        last_rowid = 0
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    cursor.execute('''
+                        SELECT rowid, id, customer_phone, phone_normalized
+                        FROM orders WHERE rowid > ?
+                        ORDER BY rowid LIMIT ?
+                    ''', (last_rowid, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        conn.commit()
+                        break
+                    last_rowid = rows[-1][0]
+                    
+                    updates = [
+                        (normalize_phone(phone), order_id)
+                        for _, order_id, phone, current in rows
+                        if current is None and normalize_phone(phone)
+                    ]
+                    cursor.executemany("UPDATE orders SET phone_normalized = ? WHERE id = ?", updates)
+                    conn.commit()
+                    updated += len(updates)
+                
+                logger.info(f"Backfilled phone_normalized for {updated} orders")
+                
+        except Exception as e:
+            logger.error(f"Error backfilling phone numbers: {e}")
+        return updated
+    
+    def claim_outbox_messages(self, limit: int = 20, lease_seconds: int = 60) -> List[Dict[str, Any]]:
+        """Take due outbox messages for delivery, oldest first
+        
+        Claiming counts an attempt and pushes next_attempt_at out by
+        lease_seconds, so a message whose sender died is retried once the
+        lease runs out instead of being lost. Delivery is at least once.
+        """
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute('''
+                    SELECT id, kind, payload, attempts FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_attempt_at, id LIMIT ?
+                ''', (limit,))
+                rows = cursor.fetchall()
+                cursor.executemany('''
+                    UPDATE outbox SET attempts = attempts + 1, next_attempt_at = datetime('now', ?)
+                    WHERE id = ?
+                ''', [(f'+{lease_seconds} seconds', row[0]) for row in rows])
+                conn.commit()
+                
+                return [
+                    {'id': row[0], 'kind': row[1], 'payload': json.loads(row[2]), 'attempts': row[3] + 1}
+                    for row in rows
+                ]
+        
+        except Exception as e:
+            logger.error(f"Error claiming outbox messages: {e}")
+            return []
+    
+    def complete_outbox_message(self, message_id: int) -> bool:
+        """Remove a delivered outbox message"""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error completing outbox message {message_id}: {e}")
+            return False
+    
+    def fail_outbox_message(self, message_id: int, error: str, retry_in: Optional[float] = None) -> bool:
+        """Record a failed delivery: retry after retry_in seconds, or give up when it is None
+        
+        Messages that were given up on stay in the table with status 'failed'.
+        """
+        try:
+            with self.pool.connection() as conn:
+                if retry_in is None:
+                    conn.execute('''
+                        UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?
+                    ''', (error[:500], message_id))
+                else:
+                    conn.execute('''
+                        UPDATE outbox SET last_error = ?, next_attempt_at = datetime('now', ?) WHERE id = ?
+                    ''', (error[:500], f'+{int(retry_in)} seconds', message_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error recording outbox failure for {message_id}: {e}")
+            return False
+    
+    def compact_order_payloads(self, batch_size: int = 500) -> int:
+        """Rewrite JSON text order_data payloads in the compact format
+        
+        Works through the orders table in rowid order, one write
+        transaction per batch; rows already compact are skipped, so the
+        job can be stopped and rerun. Shrunk rows leave pages half empty
+        rather than free, so run VACUUM afterwards to reclaim the space.
+        Returns the number of rows rewritten. For db_tools.py
+        (`compact-payloads`) only.
+        """
+        rewritten = 0
+        last_rowid = 0
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    cursor.execute('''
+                        SELECT rowid, id, order_data, customer_name, customer_phone, customer_location
+                        FROM orders WHERE rowid > ?
+                        ORDER BY rowid LIMIT ?
+                    ''', (last_rowid, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        conn.commit()
+                        break
+                    last_rowid = rows[-1][0]
+                    
+                    pending = [row for row in rows if isinstance(row[2], str)]
+                    items_by_order = self._get_items_for_orders(cursor, [row[1] for row in pending])
+                    updates = []
+                    for _, order_id, payload, *customer_row in pending:
+                        try:
+                            order_data = json.loads(payload)
+                        except ValueError:
+                            logger.warning(f"Order {order_id} has an unreadable payload, left as is")
+                            continue
+                        item_rows = items_by_order.get(order_id, [])
+                        updates.append((_encode_payload(order_data, tuple(customer_row), item_rows), order_id))
+                    
+                    cursor.executemany("UPDATE orders SET order_data = ? WHERE id = ?", updates)
+                    conn.commit()
+                    rewritten += len(updates)
+                
+                logger.info(f"Compacted {rewritten} order payloads")
+                
+        except Exception as e:
+            logger.error(f"Error compacting order payloads: {e}")
+        return rewritten
+    
+    def _sync_archive_schema(self, cursor) -> Dict[str, List[str]]:
+        """Create or extend the archive tables to match the live ones
+
+        Returns the live column list of every archived table.
+        """
+        columns = {}
+        for table, index_statements in ARCHIVE_INDEXES.items():
+            live_columns = cursor.execute(f"PRAGMA main.table_info({table})").fetchall()
+            archived_columns = {row[1] for row in cursor.execute(f"PRAGMA {ARCHIVE_SCHEMA}.table_info({table})")}
+            if not archived_columns:
+                cursor.execute(f"CREATE TABLE {ARCHIVE_SCHEMA}.{table} AS SELECT * FROM main.{table} WHERE 0")
+            else:
+                # Columns added by later migrations
+                for row in live_columns:
+                    if row[1] not in archived_columns:
+                        cursor.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.{table} ADD COLUMN {row[1]} {row[2]}")
+            self._ensure_archive_key(cursor, table, dedupe=bool(archived_columns))
+            for statement in index_statements:
+                cursor.execute(statement)
+            columns[table] = [row[1] for row in live_columns]
+        return columns
+    
+    def _ensure_archive_key(self, cursor, table: str, dedupe: bool):
+        """Give an archive table a unique index on the live id
+
+        CREATE TABLE AS copies no constraints, so archives made before this
+        index existed may hold rows copied twice by a retried run; with
+        dedupe those duplicates are dropped before the index is built.
+        """
+        key_index = f"idx_archive_{table}_key"
+        indexes = {row[1] for row in cursor.execute(f"PRAGMA {ARCHIVE_SCHEMA}.index_list({table})")}
+        if key_index in indexes:
+            return
+        if dedupe:
+            cursor.execute(f'''
+                DELETE FROM {ARCHIVE_SCHEMA}.{table}
+                WHERE rowid NOT IN (SELECT MIN(rowid) FROM {ARCHIVE_SCHEMA}.{table} GROUP BY id)
+            ''')
+            if cursor.rowcount:
+                logger.warning(f"Removed {cursor.rowcount} duplicate rows from {ARCHIVE_SCHEMA}.{table}")
+        # Superseded by the unique index
+        cursor.execute(f"DROP INDEX IF EXISTS {ARCHIVE_SCHEMA}.idx_archive_{table}_id")
+        cursor.execute(f"CREATE UNIQUE INDEX {ARCHIVE_SCHEMA}.{key_index} ON {table}(id)")
+    
+    def _move_rows(self, cursor, table: str, key: str, values: List[Any], columns: List[str]) -> int:
+        """Copy rows whose key is in values to the archive and delete them
+
+        Rows already in the archive, from a run that copied them but did
+        not get to delete them, are skipped rather than copied again.
+        """
+        column_list = ', '.join(columns)
+        placeholders = ', '.join('?' * len(values))
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.{table} ({column_list})
+            SELECT {column_list} FROM main.{table} WHERE {key} IN ({placeholders})
+        ''', values)
+        cursor.execute(f"DELETE FROM main.{table} WHERE {key} IN ({placeholders})", values)
+        return cursor.rowcount
+    
+    def archive_old_records(self, older_than_days: int = 30, batch_size: int = 500) -> Dict[str, int]:
+        """Move orders, locations and admin logs older than the cutoff to the archive
+
+        Rows move in batches of batch_size, one short write transaction per
+        batch, so the bot keeps serving while a large backlog is archived.
+        The order_stats and users rollups are all-time counters and are not
+        touched. Freed pages are returned to the filesystem with an
+        incremental vacuum afterwards, on files already converted by
+        enable_incremental_vacuum. Run from db_tools.py (`archive`); the
+        bot's AsyncDatabaseManager does not expose it.
+        """
+        batch_size = max(1, min(batch_size, ITEMS_QUERY_CHUNK_SIZE))
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+        moved = {table: 0 for table in ARCHIVE_INDEXES}
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                self._attach_archive(cursor, create=True)
+                cursor.execute("BEGIN IMMEDIATE")
+                columns = self._sync_archive_schema(cursor)
+                conn.commit()
+                
+                # (table, key column, child table moved with it)
+                plan = [
+                    ('orders', 'id', 'order_items'),
+                    ('locations', 'id', None),
+                    ('admin_logs', 'id', None),
+                ]
+                for table, key, child in plan:
+                    while True:
+                        cursor.execute("BEGIN IMMEDIATE")
+                        cursor.execute(f'''
+                            SELECT {key} FROM main.{table}
+                            WHERE created_at < ?
+                            ORDER BY created_at
+                            LIMIT ?
+                        ''', (cutoff, batch_size))
+                        keys = [row[0] for row in cursor.fetchall()]
+                        if not keys:
+                            conn.commit()
+                            break
+                        
+                        if child:
+                            moved[child] += self._move_rows(cursor, child, 'order_id', keys, columns[child])
+                        moved[table] += self._move_rows(cursor, table, key, keys, columns[table])
+                        conn.commit()
+                
+                self._incremental_vacuum(cursor)
+                if moved['orders']:
+                    self.active_orders.clear()
+                logger.info(f"Archived records older than {cutoff}: {moved}")
+                
+        except Exception as e:
+            logger.error(f"Error archiving old records: {e}")
+        return moved
+    
+    def _incremental_vacuum(self, cursor):
+        """Release free pages if the file uses incremental auto-vacuum"""
+        auto_vacuum = cursor.execute("PRAGMA main.auto_vacuum").fetchone()[0]
+        if auto_vacuum != 2:
+            # Converting needs a full VACUUM, which blocks writers for the
+            # whole rewrite; it is left to enable_incremental_vacuum
+            logger.info("Database is not in incremental auto-vacuum mode, freed pages are kept for reuse")
+            return
+        cursor.execute("PRAGMA main.incremental_vacuum").fetchall()
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """Convert an existing file to incremental auto-vacuum with a one-time VACUUM
+        
+        The VACUUM rewrites the whole file: it blocks every write until it
+        finishes and needs free disk space for a second copy, so run it
+        while the bot is stopped (db_tools.py `enable-incremental-vacuum`).
+        Returns True if the file was converted.
+        """
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                if cursor.execute("PRAGMA main.auto_vacuum").fetchone()[0] == 2:
+                    return False
+                # auto_vacuum can only change on an empty file or through a full VACUUM
+                cursor.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+                cursor.execute("VACUUM main")
+                logger.info("Database converted to incremental auto-vacuum")
+                return True
+        except Exception as e:
+            logger.error(f"Error converting database to incremental auto-vacuum: {e}")
+            return False
+
+
+class AsyncDatabaseManager:
+    """Awaitable facade over DatabaseManager that keeps SQLite off the event loop
+
+    Every public DatabaseManager method is exposed as a coroutine with the
+    same signature. Writes go through a single dedicated writer thread, so
+    the bot's own writes never wait on each other for the SQLite write
+    lock; reads share a small executor. Other processes on the same file
+    (db_tools.py) can still hold the lock, and pooled connections then
+    wait up to busy_timeout.
+    """
+
+    WRITE_METHODS = frozenset({
+        'create_order',
+        'create_location',
+        'claim_outbox_messages',
+        'complete_outbox_message',
+        'fail_outbox_message',
+        'update_order_status',
+        'transition_order_status',
+        'update_order_location_and_fee',
+        'log_admin_access',
+        'log_admin_access_batch',
+        'rebuild_statistics',
+    })
+
+    # Long batch jobs for db_tools.py; on the writer thread they would
+    # hold up every order and status change queued behind them
+    MAINTENANCE_METHODS = frozenset({
+        'archive_old_records',
+        'enable_incremental_vacuum',
+        'compact_order_payloads',
+        'backfill_phone_numbers',
+    })
+
+    def __init__(self, manager: DatabaseManager, max_readers: int = 4):
+        self.manager = manager
+        self._reader = ThreadPoolExecutor(max_workers=max_readers, thread_name_prefix="db-reader")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    def __getattr__(self, name: str):
+        if name in self.MAINTENANCE_METHODS:
+            raise AttributeError(f"{name} is a maintenance task, run it with db_tools.py")
+        attr = getattr(self.manager, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        executor = self._writer if name in self.WRITE_METHODS else self._reader
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(attr, *args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    async def initialize(self):
+        """Apply pending migrations on the writer thread"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self.manager.init_database)
+
+    async def close(self):
+        """Wait for queued database work, stop the executors and close the pool"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        self._writer.shutdown(wait=True)
+        self._reader.shutdown(wait=True)
+        self.manager.close()
+
+class AdminLogBuffer:
+    """Write-behind sink for admin audit log entries
+    
+    log() only appends to an in-memory buffer. A background task writes
+    buffered entries in one batched transaction once batch_size entries
+    are waiting or flush_interval seconds have passed. close() flushes
+    whatever is left. Entries are dropped (and counted) when the buffer is
+    full, and counted as delayed when a failed flush first puts them back.
+    Each buffered item is (entry, failed_attempts).
+    """
+
+    def __init__(self, database: "Storage", max_entries: int = 1000,
+                 batch_size: int = 50, flush_interval: float = 2.0):
+        self.database = database
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._entries = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.flushed = 0
+        self.dropped = 0
+        self.delayed = 0
+
+    def log(self, user_id: int, username: str, first_name: str, action: str, details: str = "") -> bool:
+        """Buffer an admin log entry; returns False if it had to be dropped"""
+        if len(self._entries) >= self.max_entries:
+            self.dropped += 1
+            logger.warning(f"Admin log buffer full, dropped: {action} by user {user_id}")
+            return False
+        
+        # Keep the time of the event, not of the flush
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._entries.append(((user_id, username or '', first_name or '', action, details, created_at), 0))
+        
+        if len(self._entries) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+        return True
+
+    async def flush(self) -> int:
+        """Write all buffered entries; returns the number written"""
+        written = 0
+        while self._entries:
+            batch = [self._entries.popleft() for _ in range(min(self.batch_size, len(self._entries)))]
+            if not await self.database.log_admin_access_batch([entry for entry, _ in batch]):
+                # Put the batch back in front, dropping what no longer fits
+                room = self.max_entries - len(self._entries)
+                self.dropped += len(batch[room:])
+                batch = batch[:room]
+                self.delayed += sum(1 for _, attempts in batch if attempts == 0)
+                self._entries.extendleft(reversed([(entry, attempts + 1) for entry, attempts in batch]))
+                break
+            written += len(batch)
+        self.flushed += written
+        return written
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop the background task and flush remaining entries"""
+        # Let an in-flight flush finish instead of cancelling it mid-batch
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        logger.info(f"Admin log buffer closed: {self.stats()}")
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring the sink"""
+        return {
+            'buffered': len(self._entries),
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'delayed': self.delayed,
+        }
+
+class OutboxDispatcher:
+    """Background sender for notifications queued in the outbox table
+
+    Senders are registered per message kind with the handler() decorator
+    and called as `await sender(bot, payload, attempts)`. A sender that
+    raises is retried with exponential backoff up to max_attempts; after
+    that the message is marked failed. wake() skips the poll delay after
+    a new message has been committed.
+    """
+
+    def __init__(self, database: "Storage", batch_size: int = 20, poll_interval: float = 1.0,
+                 max_attempts: int = 8, max_retry_delay: float = 300.0, lease_seconds: int = 60):
+        self.database = database
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_retry_delay = max_retry_delay
+        self.lease_seconds = lease_seconds
+        self.senders: Dict[str, Callable[..., Awaitable[None]]] = {}
+        self.bot = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def handler(self, kind: str):
+        """Decorator registering the sender for one message kind"""
+        def register(sender):
+            self.senders[kind] = sender
+            return sender
+        return register
+
+    def wake(self):
+        """Deliver newly committed messages without waiting for the next poll"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def dispatch(self) -> int:
+        """Claim and send one batch of due messages; returns the batch size"""
+        messages = await self.database.claim_outbox_messages(self.batch_size, self.lease_seconds)
+        for message in messages:
+            sender = self.senders.get(message['kind'])
+            try:
+                if sender is None:
+                    raise LookupError(f"no sender registered for {message['kind']!r}")
+                await sender(self.bot, message['payload'], message['attempts'])
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if message['attempts'] >= self.max_attempts or sender is None:
+                    self.failed += 1
+                    logger.error(f"Outbox message {message['id']} failed permanently: {error}")
+                    await self.database.fail_outbox_message(message['id'], error)
+                else:
+                    self.retried += 1
+                    retry_in = min(2 ** message['attempts'], self.max_retry_delay)
+                    logger.warning(f"Outbox message {message['id']} failed, retrying in {retry_in}s: {error}")
+                    await self.database.fail_outbox_message(message['id'], error, retry_in)
+                continue
+            self.sent += 1
+            await self.database.complete_outbox_message(message['id'])
+        return len(messages)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                # A full batch means more may be due right away
+                if await self.dispatch() == self.batch_size:
+                    continue
+            except Exception as e:
+                logger.error(f"Outbox dispatch error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self, bot):
+        """Start the background dispatch task on the running event loop"""
+        self.bot = bot
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop the background task after the batch in flight
 
+        Undelivered messages stay in the outbox for the next start.
+        """
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        logger.info(f"Outbox dispatcher closed: {self.stats()}")
 
-# Create database instance
-db = DatabaseManager()
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring the dispatcher"""
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
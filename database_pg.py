@@ -0,0 +1,1010 @@
+"""
+PostgreSQL storage backend for POPAYS Bot
+
+Selected with DB_BACKEND=postgres and DATABASE_URL=postgresql://... in
+env.txt. Unlike the single SQLite file it can take writes from several
+bot processes at once. Methods mirror DatabaseManager and return the same
+OrderRow objects and dicts, so handlers work unchanged.
+"""
+import re
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any
+
+try:
+    import asyncpg
+except ImportError:  # only required when DB_BACKEND=postgres
+    asyncpg = None
+
+from database import (
+    ORDER_COLUMNS, LOCATION_COLUMNS, ORDER_STATUSES, ORDER_TRANSITIONS, STATS_DAY_OFFSET, ID_MAX_ATTEMPTS, OrderRow, _decode_order, _distance_km,
+    _geohash_cells, _location_dict, _order_search_row, _radius_bbox, geohash_encode, new_record_id, normalize_phone,
+)
+
+logger = logging.getLogger(__name__)
+
+# Timestamps are stored as UTC TIMESTAMP (whole seconds, like SQLite's
+# CURRENT_TIMESTAMP) and read back as the same text format
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+NOW_UTC = "date_trunc('second', timezone('utc', now()))"
+
+def _select_column(column: str) -> str:
+    if column in ('created_at', 'updated_at'):
+        return f"to_char({column}, 'YYYY-MM-DD HH24:MI:SS') AS {column}"
+    return column
+
+ORDER_SELECT = ', '.join(_select_column(column) for column in ORDER_COLUMNS)
+ORDER_LIST_SELECT = ', '.join(
+    'NULL AS order_data' if column == 'order_data' else _select_column(column) for column in ORDER_COLUMNS
+)
+LOCATION_SELECT = ', '.join(_select_column(column) for column in LOCATION_COLUMNS)
+
+def _is_duplicate_id(error: Exception, table: str) -> bool:
+    """True when an insert failed because the generated id already exists"""
+    return isinstance(error, asyncpg.UniqueViolationError) and error.constraint_name == f"{table}_pkey"
+
+def _search_text(order_id: str, customer_name: str, customer_phone: str,
+                 username: str, item_names: List[str]) -> str:
+    """orders.search_text: the same fields SQLite puts in orders_fts"""
+    return ' '.join(_order_search_row(order_id, customer_name, customer_phone, username, item_names)[1:])
+
+def _search_tsquery(query: str) -> str:
+    """Whole words, the last one as a prefix, like the SQLite FTS5 search"""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return ''
+    return ' & '.join(words[:-1] + [f"{words[-1]}:*"])
+
+def _to_timestamp(value) -> Optional[datetime]:
+    """Accept the text timestamps handlers pass around (keyset cursors, log entries)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+async def _pg_migration_base_schema(conn):
+    """Create orders, order_items, locations, admin_logs and users"""
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            customer_name TEXT,
+            customer_phone TEXT,
+            customer_location TEXT,
+            order_data TEXT NOT NULL,
+            total_amount DOUBLE PRECISION,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION,
+            delivery_fee INTEGER DEFAULT 0,
+            nearest_branch TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP NOT NULL DEFAULT {NOW_UTC},
+            updated_at TIMESTAMP DEFAULT {NOW_UTC}
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_orders_created_id ON orders (created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, total_amount);
+
+        CREATE TABLE IF NOT EXISTS order_items (
+            id BIGSERIAL PRIMARY KEY,
+            order_id TEXT NOT NULL REFERENCES orders (id),
+            item_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price DOUBLE PRECISION NOT NULL,
+            selected_size TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);
+
+        CREATE TABLE IF NOT EXISTS locations (
+            id TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            address TEXT,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION,
+            accuracy DOUBLE PRECISION,
+            map_links TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {NOW_UTC}
+        );
+        CREATE INDEX IF NOT EXISTS idx_locations_created_at ON locations (created_at);
+
+        CREATE TABLE IF NOT EXISTS admin_logs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            action TEXT NOT NULL,
+            details TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {NOW_UTC}
+        );
+        CREATE INDEX IF NOT EXISTS idx_admin_logs_created_at ON admin_logs (created_at);
+
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            total_spent DOUBLE PRECISION NOT NULL DEFAULT 0,
+            last_order_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT {NOW_UTC}
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_last_order ON users (last_order_at);
+    ''')
+
+async def _pg_migration_order_stats(conn):
+    """Add the order_stats rollup row kept current by triggers"""
+    status_columns = ''.join(
+        f"{status}_orders BIGINT NOT NULL DEFAULT 0,\n" for status in ORDER_STATUSES
+    )
+    insert_status_updates = ''.join(
+        f", {status}_orders = {status}_orders + (NEW.status IS NOT DISTINCT FROM '{status}')::int"
+        for status in ORDER_STATUSES
+    )
+    update_status_updates = ''.join(
+        f", {status}_orders = {status}_orders"
+        f" - (OLD.status IS NOT DISTINCT FROM '{status}')::int"
+        f" + (NEW.status IS NOT DISTINCT FROM '{status}')::int"
+        for status in ORDER_STATUSES
+    )
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS order_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_orders BIGINT NOT NULL DEFAULT 0,
+            total_revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+            total_locations BIGINT NOT NULL DEFAULT 0,
+            {status_columns}
+            updated_at TIMESTAMP DEFAULT {NOW_UTC}
+        );
+        INSERT INTO order_stats (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION order_stats_on_order() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE order_stats SET
+                    total_orders = total_orders + 1,
+                    total_revenue = total_revenue
+                        + CASE WHEN NEW.status = 'completed' THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+                    {insert_status_updates}
+                WHERE id = 1;
+            ELSE
+                UPDATE order_stats SET
+                    total_revenue = total_revenue
+                        - CASE WHEN OLD.status = 'completed' THEN COALESCE(OLD.total_amount, 0) ELSE 0 END
+                        + CASE WHEN NEW.status = 'completed' THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+                    {update_status_updates}
+                WHERE id = 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION order_stats_on_location() RETURNS trigger AS $$
+        BEGIN
+            UPDATE order_stats SET total_locations = total_locations + 1 WHERE id = 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS trg_order_stats_order ON orders;
+        CREATE TRIGGER trg_order_stats_order AFTER INSERT OR UPDATE OF status, total_amount ON orders
+            FOR EACH ROW EXECUTE FUNCTION order_stats_on_order();
+        DROP TRIGGER IF EXISTS trg_order_stats_location ON locations;
+        CREATE TRIGGER trg_order_stats_location AFTER INSERT ON locations
+            FOR EACH ROW EXECUTE FUNCTION order_stats_on_location();
+    ''')
+    await _pg_rebuild_order_stats(conn)
+
+async def _pg_rebuild_order_stats(conn):
+    """Recompute the order_stats row from the orders and locations tables"""
+    status_counts = dict(await conn.fetch("SELECT status, COUNT(*) FROM orders GROUP BY status"))
+    total_orders = await conn.fetchval("SELECT COUNT(*) FROM orders")
+    total_revenue = await conn.fetchval("SELECT SUM(total_amount) FROM orders WHERE status = 'completed'") or 0
+    total_locations = await conn.fetchval("SELECT COUNT(*) FROM locations")
+
+    status_assignments = ', '.join(
+        f"{status}_orders = ${i + 4}" for i, status in enumerate(ORDER_STATUSES)
+    )
+    await conn.execute(f'''
+        UPDATE order_stats SET total_orders = $1, total_revenue = $2, total_locations = $3,
+            {status_assignments}
+        WHERE id = 1
+    ''', total_orders, total_revenue, total_locations,
+        *(status_counts.get(status, 0) for status in ORDER_STATUSES))
+
+async def _pg_migration_order_search(conn):
+    """Add orders.search_text with a GIN full-text index and backfill it"""
+    await conn.execute('''
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS search_text TEXT;
+        CREATE INDEX IF NOT EXISTS idx_orders_search ON orders
+            USING GIN (to_tsvector('simple', coalesce(search_text, '')));
+    ''')
+    rows = await conn.fetch('''
+        SELECT o.id, o.customer_name, o.customer_phone, o.username,
+               (SELECT string_agg(item_name, ' ') FROM order_items WHERE order_id = o.id)
+        FROM orders o
+    ''')
+    await conn.executemany(
+        "UPDATE orders SET search_text = $1 WHERE id = $2",
+        [(_search_text(row[0], row[1], row[2], row[3], [row[4] or '']), row[0]) for row in rows],
+    )
+
+async def _pg_migration_phone_normalized(conn):
+    """Add orders.phone_normalized with a (phone, created_at) index and backfill it"""
+    await conn.execute('''
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS phone_normalized TEXT;
+        CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders (phone_normalized, created_at);
+    ''')
+    rows = await conn.fetch("SELECT id, customer_phone FROM orders WHERE phone_normalized IS NULL")
+    await conn.executemany(
+        "UPDATE orders SET phone_normalized = $1 WHERE id = $2",
+        [(normalize_phone(row[1]), row[0]) for row in rows if normalize_phone(row[1])],
+    )
+
+async def _pg_migration_geohash(conn):
+    """Add a geohash column and prefix index to locations and orders, filled from their coordinates"""
+    for table in ('locations', 'orders'):
+        # Byte order ("C") keeps a prefix range contiguous whatever the database collation
+        await conn.execute(f'''
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS geohash TEXT;
+            CREATE INDEX IF NOT EXISTS idx_{table}_geohash ON {table} ((geohash COLLATE "C"));
+        ''')
+        rows = await conn.fetch(f'''
+            SELECT id, latitude, longitude FROM {table}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND geohash IS NULL
+        ''')
+        await conn.executemany(
+            f"UPDATE {table} SET geohash = $1 WHERE id = $2",
+            [(geohash_encode(row[1], row[2]), row[0]) for row in rows],
+        )
+
+def _pg_stats_day(column: str) -> str:
+    """SQL expression for the local report day of a UTC timestamp column"""
+    return f"({column} + interval '{STATS_DAY_OFFSET}')::date"
+
+async def _pg_rebuild_daily_branch_stats(conn):
+    """Recompute every daily_branch_stats row from the orders table"""
+    status_columns = ''.join(f", {status}_orders" for status in ORDER_STATUSES)
+    status_sums = ''.join(f", COUNT(*) FILTER (WHERE status = '{status}')" for status in ORDER_STATUSES)
+    await conn.execute(f"""
+        DELETE FROM daily_branch_stats;
+        INSERT INTO daily_branch_stats (day, branch, total_orders, order_amount, revenue{status_columns})
+        SELECT {_pg_stats_day('created_at')}, COALESCE(nearest_branch, ''), COUNT(*),
+               COALESCE(SUM(total_amount), 0),
+               COALESCE(SUM(total_amount) FILTER (WHERE status = 'completed'), 0){status_sums}
+        FROM orders
+        GROUP BY 1, 2;
+    """)
+
+async def _pg_migration_daily_branch_stats(conn):
+    """Add the daily_branch_stats rollup kept current by a trigger on orders"""
+    status_columns = ''.join(f"{status}_orders BIGINT NOT NULL DEFAULT 0,\n" for status in ORDER_STATUSES)
+    status_names = ''.join(f", {status}_orders" for status in ORDER_STATUSES)
+    status_values = ''.join(f", (NEW.status IS NOT DISTINCT FROM '{status}')::int" for status in ORDER_STATUSES)
+    status_increments = ''.join(
+        f", {status}_orders = daily_branch_stats.{status}_orders + excluded.{status}_orders"
+        for status in ORDER_STATUSES
+    )
+    status_decrements = ''.join(
+        f", {status}_orders = {status}_orders - (OLD.status IS NOT DISTINCT FROM '{status}')::int"
+        for status in ORDER_STATUSES
+    )
+    await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS daily_branch_stats (
+            day DATE NOT NULL,
+            branch TEXT NOT NULL,
+            total_orders BIGINT NOT NULL DEFAULT 0,
+            order_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+            revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+            {status_columns}
+            PRIMARY KEY (day, branch)
+        );
+
+        CREATE OR REPLACE FUNCTION daily_branch_stats_on_order() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                UPDATE daily_branch_stats SET
+                    total_orders = total_orders - 1,
+                    order_amount = order_amount - COALESCE(OLD.total_amount, 0),
+                    revenue = revenue
+                        - CASE WHEN OLD.status = 'completed' THEN COALESCE(OLD.total_amount, 0) ELSE 0 END
+                    {status_decrements}
+                WHERE day = {_pg_stats_day('OLD.created_at')} AND branch = COALESCE(OLD.nearest_branch, '');
+            END IF;
+            INSERT INTO daily_branch_stats (day, branch, total_orders, order_amount, revenue{status_names})
+            VALUES ({_pg_stats_day('NEW.created_at')}, COALESCE(NEW.nearest_branch, ''), 1,
+                    COALESCE(NEW.total_amount, 0),
+                    CASE WHEN NEW.status = 'completed' THEN COALESCE(NEW.total_amount, 0) ELSE 0 END{status_values})
+            ON CONFLICT (day, branch) DO UPDATE SET
+                total_orders = daily_branch_stats.total_orders + 1,
+                order_amount = daily_branch_stats.order_amount + excluded.order_amount,
+                revenue = daily_branch_stats.revenue + excluded.revenue{status_increments};
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS trg_daily_branch_stats_order ON orders;
+        CREATE TRIGGER trg_daily_branch_stats_order
+            AFTER INSERT OR UPDATE OF status, total_amount, nearest_branch, created_at ON orders
+            FOR EACH ROW EXECUTE FUNCTION daily_branch_stats_on_order();
+    """)
+    await _pg_rebuild_daily_branch_stats(conn)
+
+async def _pg_migration_active_order_index(conn):
+    """Add a partial index over pending orders for get_user_current_order"""
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_user_pending ON orders (user_id, created_at)
+        WHERE status = 'pending'
+    ''')
+
+async def _pg_migration_outbox(conn):
+    """Add the outbox table for notifications written with their order"""
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT {NOW_UTC},
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {NOW_UTC}
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) WHERE status = 'pending';
+    ''')
+
+# Ordered schema migrations; the position in this list is the schema version
+PG_MIGRATIONS = [
+    _pg_migration_base_schema,
+    _pg_migration_order_stats,
+    _pg_migration_order_search,
+    _pg_migration_phone_normalized,
+    _pg_migration_geohash,
+    _pg_migration_daily_branch_stats,
+    _pg_migration_active_order_index,
+    _pg_migration_outbox,
+]
+PG_SCHEMA_VERSION = len(PG_MIGRATIONS)
+
+# Serializes migrations across bot processes sharing one database
+MIGRATION_LOCK_ID = 0x504f50415953
+
+class PostgresStorage:
+    """Storage backend on a pooled asyncpg connection
+
+    schema puts all tables in a separate Postgres schema (search_path),
+    e.g. for a throwaway smoke-test run against a shared server.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 schema: Optional[str] = None):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.schema = schema
+        self.pool = None
+
+    async def initialize(self):
+        """Open the connection pool and apply pending migrations"""
+        if asyncpg is None:
+            raise RuntimeError("DB_BACKEND=postgres requires the asyncpg package")
+        if self.pool is None:
+            server_settings = {'search_path': self.schema} if self.schema else None
+            if self.schema:
+                conn = await asyncpg.connect(self.dsn)
+                try:
+                    await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+                finally:
+                    await conn.close()
+            self.pool = await asyncpg.create_pool(
+                self.dsn, min_size=self.min_size, max_size=self.max_size,
+                server_settings=server_settings,
+            )
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+                await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+                current_version = await conn.fetchval("SELECT MAX(version) FROM schema_version") or 0
+                if current_version >= PG_SCHEMA_VERSION:
+                    return
+
+                for version in range(current_version + 1, PG_SCHEMA_VERSION + 1):
+                    migration = PG_MIGRATIONS[version - 1]
+                    logger.info(f"Applying database migration {version}: {migration.__doc__}")
+                    await migration(conn)
+
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", PG_SCHEMA_VERSION)
+                logger.info(f"Database migrated from version {current_version} to {PG_SCHEMA_VERSION}")
+
+    async def close(self):
+        """Close the connection pool"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def create_order(self, user_id: int, username: str, first_name: str, order_data: Dict[str, Any],
+                           outbox: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> str:
+        """Create a new order, queueing outbox notifications in the same transaction"""
+        try:
+            customer = order_data.get('customer', {})
+            total_amount = order_data.get('total', 0)
+            payload = json.dumps(order_data)
+            items = [
+                (item.get('name', ''), item.get('quantity', 1),
+                 item.get('total', 0), item.get('selectedSize', ''))
+                for item in order_data.get('items', [])
+            ]
+
+            async with self.pool.acquire() as conn:
+                for attempt in range(ID_MAX_ATTEMPTS):
+                    order_id = new_record_id()
+                    try:
+                        async with conn.transaction():
+                            await conn.execute('''
+                                INSERT INTO orders (id, user_id, username, first_name, customer_name,
+                                                    customer_phone, customer_location, order_data, total_amount,
+                                                    search_text, phone_normalized)
+                                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+                            ''', order_id, user_id, username, first_name, customer.get('name', ''),
+                                customer.get('phone', ''), customer.get('location', ''), payload, total_amount,
+                                _search_text(order_id, customer.get('name', ''), customer.get('phone', ''),
+                                             username, [item[0] for item in items]),
+                                normalize_phone(customer.get('phone', '')))
+
+                            await conn.executemany('''
+                                INSERT INTO order_items (order_id, item_name, quantity, price, selected_size)
+                                VALUES ($1, $2, $3, $4, $5)
+                            ''', [(order_id, *item) for item in items])
+
+                            await conn.execute(f'''
+                                INSERT INTO users (user_id, username, first_name, order_count, total_spent, last_order_at)
+                                VALUES ($1, $2, $3, 1, $4, {NOW_UTC})
+                                ON CONFLICT (user_id) DO UPDATE SET
+                                    username = excluded.username,
+                                    first_name = excluded.first_name,
+                                    order_count = users.order_count + 1,
+                                    total_spent = users.total_spent + excluded.total_spent,
+                                    last_order_at = excluded.last_order_at
+                            ''', user_id, username, first_name, total_amount or 0)
+
+                            if outbox:
+                                await conn.executemany(
+                                    "INSERT INTO outbox (kind, payload) VALUES ($1, $2)",
+                                    [(kind, json.dumps(dict(payload, order_id=order_id))) for kind, payload in outbox],
+                                )
+                        break
+                    except Exception as e:
+                        if attempt == ID_MAX_ATTEMPTS - 1 or not _is_duplicate_id(e, 'orders'):
+                            raise
+                        logger.warning(f"Order id {order_id} already exists, retrying with a new id")
+
+            logger.info(f"Order {order_id} created successfully")
+            return order_id
+
+        except Exception as e:
+            logger.error(f"Error creating order: {e}")
+            raise
+
+    async def create_location(self, user_id: int, username: str, first_name: str,
+                              location_data: Dict[str, Any]) -> str:
+        """Create a new location record in the database"""
+        try:
+            coordinates = location_data.get('coordinates', {})
+            latitude = coordinates.get('latitude')
+            longitude = coordinates.get('longitude')
+            geohash = geohash_encode(latitude, longitude) if latitude is not None and longitude is not None else None
+
+            async with self.pool.acquire() as conn:
+                for attempt in range(ID_MAX_ATTEMPTS):
+                    location_id = new_record_id()
+                    try:
+                        await conn.execute('''
+                            INSERT INTO locations (id, user_id, username, first_name, address,
+                                                   latitude, longitude, accuracy, map_links, geohash)
+                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                        ''', location_id, user_id, username, first_name, location_data.get('address', ''),
+                            latitude, longitude, coordinates.get('accuracy'),
+                            json.dumps(location_data.get('maps', {})), geohash)
+                        break
+                    except Exception as e:
+                        if attempt == ID_MAX_ATTEMPTS - 1 or not _is_duplicate_id(e, 'locations'):
+                            raise
+                        logger.warning(f"Location id {location_id} already exists, retrying with a new id")
+
+            logger.info(f"Location {location_id} created successfully")
+            return location_id
+
+        except Exception as e:
+            logger.error(f"Error creating location: {e}")
+            raise
+
+    async def _decode_orders(self, conn, orders) -> List[OrderRow]:
+        """Attach items to a page of order records with one ANY($1) lookup"""
+        order_ids = [order_row['id'] for order_row in orders]
+        items_by_order = {}
+        if order_ids:
+            rows = await conn.fetch('''
+                SELECT order_id, item_name, quantity, price, selected_size
+                FROM order_items WHERE order_id = ANY($1::text[])
+                ORDER BY id
+            ''', order_ids)
+            for row in rows:
+                items_by_order.setdefault(row[0], []).append(tuple(row)[1:])
+        return [
+            _decode_order(tuple(order_row), items_by_order.get(order_row['id'], []))
+            for order_row in orders
+        ]
+
+    async def get_order(self, order_id: str) -> Optional[OrderRow]:
+        """Get order by ID"""
+        try:
+            async with self.pool.acquire() as conn:
+                order_row = await conn.fetchrow(f"SELECT {ORDER_SELECT} FROM orders WHERE id = $1", order_id)
+                if not order_row:
+                    return None
+                items = await conn.fetch('''
+                    SELECT item_name, quantity, price, selected_size
+                    FROM order_items WHERE order_id = $1 ORDER BY id
+                ''', order_id)
+                return _decode_order(tuple(order_row), [tuple(item) for item in items])
+        except Exception as e:
+            logger.error(f"Error getting order {order_id}: {e}")
+            return None
+
+    async def get_location(self, location_id: str) -> Optional[Dict[str, Any]]:
+        """Get location by ID"""
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(f'''
+                    SELECT {LOCATION_SELECT} FROM locations WHERE id = $1
+                ''', location_id)
+            if not row:
+                return None
+            return _location_dict(tuple(row))
+        except Exception as e:
+            logger.error(f"Error getting location {location_id}: {e}")
+            return None
+
+    async def _select_in_bbox(self, conn, table: str, columns: str,
+                              bbox: Tuple[float, float, float, float]) -> list:
+        """Rows of table inside bbox, read as one geohash range per covering cell"""
+        min_lat, min_lon, max_lat, max_lon = bbox
+        rows = []
+        for prefix in _geohash_cells(*bbox):
+            rows.extend(await conn.fetch(f'''
+                SELECT {columns} FROM {table}
+                WHERE geohash COLLATE "C" >= $1 AND geohash COLLATE "C" < $2
+                  AND latitude BETWEEN $3 AND $4 AND longitude BETWEEN $5 AND $6
+            ''', prefix, prefix + '~', min_lat, max_lat, min_lon, max_lon))
+        return rows
+
+    async def get_locations_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                                    limit: int = 100) -> List[Dict[str, Any]]:
+        """Locations inside a latitude/longitude box, newest first"""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await self._select_in_bbox(conn, 'locations', LOCATION_SELECT,
+                                                  (min_lat, min_lon, max_lat, max_lon))
+            rows = sorted((tuple(row) for row in rows), key=lambda row: (row[9], row[0]), reverse=True)
+            return [_location_dict(row) for row in rows[:limit]]
+        except Exception as e:
+            logger.error(f"Error getting locations in bounding box: {e}")
+            return []
+
+    async def get_locations_within_radius(self, latitude: float, longitude: float, radius_km: float,
+                                          limit: int = 50) -> List[Dict[str, Any]]:
+        """Locations within radius_km of a point, nearest first, each with distance_km"""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await self._select_in_bbox(conn, 'locations', LOCATION_SELECT,
+                                                  _radius_bbox(latitude, longitude, radius_km))
+            locations = []
+            for row in rows:
+                distance = _distance_km(latitude, longitude, row[5], row[6])
+                if distance <= radius_km:
+                    location = _location_dict(tuple(row))
+                    location['distance_km'] = round(distance, 3)
+                    locations.append(location)
+            locations.sort(key=lambda location: location['distance_km'])
+            return locations[:limit]
+        except Exception as e:
+            logger.error(f"Error getting locations within radius: {e}")
+            return []
+
+    async def get_orders_within_radius(self, latitude: float, longitude: float, radius_km: float,
+                                       limit: int = 50, with_payload: bool = False) -> List[OrderRow]:
+        """Orders delivered within radius_km of a point, nearest first"""
+        try:
+            columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+            async with self.pool.acquire() as conn:
+                rows = await self._select_in_bbox(conn, 'orders', columns,
+                                                  _radius_bbox(latitude, longitude, radius_km))
+                nearby = [
+                    (_distance_km(latitude, longitude, row['latitude'], row['longitude']), row)
+                    for row in rows
+                ]
+                nearby = sorted((entry for entry in nearby if entry[0] <= radius_km), key=lambda entry: entry[0])
+                return await self._decode_orders(conn, [row for _, row in nearby[:limit]])
+        except Exception as e:
+            logger.error(f"Error getting orders within radius: {e}")
+            return []
+
+    async def update_order_status(self, order_id: str, status: str) -> bool:
+        """Update order status"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(f'''
+                    UPDATE orders SET status = $1, updated_at = {NOW_UTC} WHERE id = $2
+                ''', status, order_id)
+            logger.info(f"Order {order_id} status updated to {status}")
+            return True
+        except Exception as e:
+            logger.error(f"Error updating order status: {e}")
+            return False
+
+    async def transition_order_status(self, order_id: str, status: str) -> Optional[OrderRow]:
+        """Move an order to status if ORDER_TRANSITIONS allows it; None if another caller got there first"""
+        sources = ORDER_TRANSITIONS.get(status)
+        if sources is None:
+            raise ValueError(f"No transitions lead to order status {status!r}")
+        try:
+            async with self.pool.acquire() as conn:
+                order_row = await conn.fetchrow(f'''
+                    UPDATE orders SET status = $1, updated_at = {NOW_UTC}
+                    WHERE id = $2 AND status = ANY($3::text[])
+                    RETURNING {ORDER_SELECT}
+                ''', status, order_id, list(sources))
+                if not order_row:
+                    return None
+                items = await conn.fetch('''
+                    SELECT item_name, quantity, price, selected_size
+                    FROM order_items WHERE order_id = $1 ORDER BY id
+                ''', order_id)
+            logger.info(f"Order {order_id} status changed to {status}")
+            return _decode_order(tuple(order_row), [tuple(item) for item in items])
+        except Exception as e:
+            logger.error(f"Error changing order {order_id} status to {status}: {e}")
+            return None
+
+    async def update_order_location_and_fee(self, order_id: str, latitude: float, longitude: float,
+                                            delivery_fee: int, nearest_branch: str):
+        """Update order with location and delivery fee"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    UPDATE orders SET latitude = $1, longitude = $2, geohash = $3, delivery_fee = $4,
+                                      nearest_branch = $5
+                    WHERE id = $6
+                ''', latitude, longitude, geohash_encode(latitude, longitude), delivery_fee, nearest_branch, order_id)
+            logger.info(f"Updated order {order_id} with location and delivery fee")
+        except Exception as e:
+            logger.error(f"Error updating order location and fee: {e}")
+
+    async def get_user_current_order(self, user_id: int) -> Optional[OrderRow]:
+        """The user's newest pending order, or None (one idx_orders_user_pending seek)"""
+        try:
+            async with self.pool.acquire() as conn:
+                orders = await conn.fetch(f'''
+                    SELECT {ORDER_LIST_SELECT} FROM orders
+                    WHERE user_id = $1 AND status = 'pending'
+                    ORDER BY orders.created_at DESC LIMIT 1
+                ''', user_id)
+                orders = await self._decode_orders(conn, orders)
+            return orders[0] if orders else None
+        except Exception as e:
+            logger.error(f"Error getting current order for user {user_id}: {e}")
+            return None
+
+    async def get_user_orders(self, user_id: int, limit: int = 10, with_payload: bool = True) -> List[OrderRow]:
+        """Get user's recent orders"""
+        try:
+            columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+            async with self.pool.acquire() as conn:
+                orders = await conn.fetch(f'''
+                    SELECT {columns} FROM orders WHERE user_id = $1
+                    ORDER BY orders.created_at DESC LIMIT $2
+                ''', user_id, limit)
+                return await self._decode_orders(conn, orders)
+        except Exception as e:
+            logger.error(f"Error getting user orders: {e}")
+            return []
+
+    async def get_all_orders(self, limit: int = 50, with_payload: bool = True) -> List[OrderRow]:
+        """Get all orders (for admin)"""
+        try:
+            columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+            async with self.pool.acquire() as conn:
+                orders = await conn.fetch(f'''
+                    SELECT {columns} FROM orders ORDER BY orders.created_at DESC LIMIT $1
+                ''', limit)
+                return await self._decode_orders(conn, orders)
+        except Exception as e:
+            logger.error(f"Error getting all orders: {e}")
+            return []
+
+    async def get_recent_orders_admin(self, limit: int = 20, before: Optional[Tuple[str, str]] = None,
+                                      after: Optional[Tuple[str, str]] = None,
+                                      with_payload: bool = True) -> List[OrderRow]:
+        """Get recent orders for admin panel with keyset pagination on (created_at, id)"""
+        try:
+            columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+            async with self.pool.acquire() as conn:
+                if before:
+                    orders = await conn.fetch(f'''
+                        SELECT {columns} FROM orders WHERE (orders.created_at, id) < ($1, $2)
+                        ORDER BY orders.created_at DESC, id DESC LIMIT $3
+                    ''', _to_timestamp(before[0]), before[1], limit)
+                elif after:
+                    orders = await conn.fetch(f'''
+                        SELECT {columns} FROM orders WHERE (orders.created_at, id) > ($1, $2)
+                        ORDER BY orders.created_at ASC, id ASC LIMIT $3
+                    ''', _to_timestamp(after[0]), after[1], limit)
+                    orders = orders[::-1]
+                else:
+                    orders = await conn.fetch(f'''
+                        SELECT {columns} FROM orders ORDER BY orders.created_at DESC, id DESC LIMIT $1
+                    ''', limit)
+                return await self._decode_orders(conn, orders)
+        except Exception as e:
+            logger.error(f"Error getting recent orders for admin: {e}")
+            return []
+
+    async def search_orders(self, query: str, limit: int = 10, with_payload: bool = False) -> List[OrderRow]:
+        """Find orders by customer name, phone, username or item name, newest first"""
+        tsquery = _search_tsquery(query)
+        if not tsquery:
+            return []
+        try:
+            columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+            async with self.pool.acquire() as conn:
+                orders = await conn.fetch(f'''
+                    SELECT {columns} FROM orders
+                    WHERE to_tsvector('simple', coalesce(search_text, '')) @@ to_tsquery('simple', $1)
+                    ORDER BY orders.created_at DESC, id DESC LIMIT $2
+                ''', tsquery, limit)
+                return await self._decode_orders(conn, orders)
+        except Exception as e:
+            logger.error(f"Error searching orders: {e}")
+            return []
+
+    async def get_orders_by_phone(self, phone: str, limit: int = 20, with_payload: bool = False) -> List[OrderRow]:
+        """Customer order history by phone number, newest first"""
+        phone_normalized = normalize_phone(phone)
+        if not phone_normalized:
+            return []
+        try:
+            columns = ORDER_SELECT if with_payload else ORDER_LIST_SELECT
+            async with self.pool.acquire() as conn:
+                orders = await conn.fetch(f'''
+                    SELECT {columns} FROM orders WHERE phone_normalized = $1
+                    ORDER BY orders.created_at DESC LIMIT $2
+                ''', phone_normalized, limit)
+                return await self._decode_orders(conn, orders)
+        except Exception as e:
+            logger.error(f"Error getting orders by phone: {e}")
+            return []
+
+    async def get_total_orders_count(self) -> int:
+        """Get total count of orders"""
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval("SELECT total_orders FROM order_stats WHERE id = 1") or 0
+        except Exception as e:
+            logger.error(f"Error getting total orders count: {e}")
+            return 0
+
+    async def get_statistics(self) -> Dict[str, Any]:
+        """Get database statistics from the order_stats rollup row"""
+        try:
+            status_columns = ', '.join(f"{status}_orders" for status in ORDER_STATUSES)
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(f'''
+                    SELECT total_orders, total_revenue, total_locations, {status_columns}
+                    FROM order_stats WHERE id = 1
+                ''')
+            if not row:
+                return {}
+            return {
+                'total_orders': row[0],
+                'total_revenue': row[1] or 0,
+                'total_locations': row[2],
+                'orders_by_status': {
+                    status: count for status, count in zip(ORDER_STATUSES, tuple(row)[3:]) if count
+                }
+            }
+        except Exception as e:
+            logger.error(f"Error getting statistics: {e}")
+            return {}
+
+    async def get_daily_branch_stats(self, days: int = 7, branch: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Per-branch totals for the last `days` report days, newest day first"""
+        try:
+            status_columns = ''.join(f", {status}_orders" for status in ORDER_STATUSES)
+            branch_filter = "AND branch = $2" if branch is not None else ""
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(f'''
+                    SELECT to_char(day, 'YYYY-MM-DD'), branch, total_orders, order_amount, revenue{status_columns}
+                    FROM daily_branch_stats
+                    WHERE day > {_pg_stats_day(NOW_UTC)} - $1::int AND total_orders > 0 {branch_filter}
+                    ORDER BY day DESC, branch
+                ''', days, *(() if branch is None else (branch,)))
+            return [
+                {
+                    'day': row[0],
+                    'branch': row[1],
+                    'total_orders': row[2],
+                    'order_amount': row[3],
+                    'revenue': row[4],
+                    'orders_by_status': {
+                        status: count for status, count in zip(ORDER_STATUSES, tuple(row)[5:]) if count
+                    },
+                }
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Error getting daily branch statistics: {e}")
+            return []
+
+    async def rebuild_statistics(self) -> bool:
+        """Recompute the order_stats and daily_branch_stats rollups with full scans (drift recovery)"""
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("LOCK TABLE orders, locations IN SHARE MODE")
+                    await _pg_rebuild_order_stats(conn)
+                    await _pg_rebuild_daily_branch_stats(conn)
+            logger.info("Order statistics rebuilt")
+            return True
+        except Exception as e:
+            logger.error(f"Error rebuilding statistics: {e}")
+            return False
+
+    async def get_all_users_with_orders(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Get all users who have placed orders (for admin)"""
+        try:
+            async with self.pool.acquire() as conn:
+                users = await conn.fetch('''
+                    SELECT user_id, username, first_name, order_count, total_spent,
+                           to_char(last_order_at, 'YYYY-MM-DD HH24:MI:SS')
+                    FROM users ORDER BY last_order_at DESC LIMIT $1
+                ''', limit)
+            return [
+                {
+                    'user_id': user_row[0],
+                    'username': user_row[1] or 'N/A',
+                    'first_name': user_row[2] or 'N/A',
+                    'order_count': user_row[3],
+                    'total_spent': user_row[4] or 0,
+                    'last_order_date': user_row[5]
+                }
+                for user_row in users
+            ]
+        except Exception as e:
+            logger.error(f"Error getting users with orders: {e}")
+            return []
+
+    async def get_all_users_for_broadcast(self) -> List[Dict[str, Any]]:
+        """Get all unique users for broadcast messaging"""
+        try:
+            async with self.pool.acquire() as conn:
+                users = await conn.fetch("SELECT user_id, username, first_name FROM users ORDER BY user_id")
+            return [
+                {'user_id': user_row[0], 'username': user_row[1] or '', 'first_name': user_row[2] or ''}
+                for user_row in users
+            ]
+        except Exception as e:
+            logger.error(f"Error getting users for broadcast: {e}")
+            return []
+
+    async def claim_outbox_messages(self, limit: int = 20, lease_seconds: int = 60) -> List[Dict[str, Any]]:
+        """Take due outbox messages for delivery, oldest first (see DatabaseManager)"""
+        try:
+            async with self.pool.acquire() as conn:
+                # SKIP LOCKED lets several bot processes share the outbox
+                rows = await conn.fetch(f'''
+                    UPDATE outbox SET attempts = attempts + 1,
+                                      next_attempt_at = {NOW_UTC} + make_interval(secs => $2)
+                    WHERE id IN (
+                        SELECT id FROM outbox
+                        WHERE status = 'pending' AND next_attempt_at <= {NOW_UTC}
+                        ORDER BY next_attempt_at, id LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, kind, payload, attempts
+                ''', limit, float(lease_seconds))
+            rows = sorted(rows, key=lambda row: row['id'])
+            return [
+                {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload']),
+                 'attempts': row['attempts']}
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Error claiming outbox messages: {e}")
+            return []
+
+    async def complete_outbox_message(self, message_id: int) -> bool:
+        """Remove a delivered outbox message"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute("DELETE FROM outbox WHERE id = $1", message_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error completing outbox message {message_id}: {e}")
+            return False
+
+    async def fail_outbox_message(self, message_id: int, error: str, retry_in: Optional[float] = None) -> bool:
+        """Record a failed delivery: retry after retry_in seconds, or give up when it is None"""
+        try:
+            async with self.pool.acquire() as conn:
+                if retry_in is None:
+                    await conn.execute(
+                        "UPDATE outbox SET status = 'failed', last_error = $1 WHERE id = $2",
+                        error[:500], message_id,
+                    )
+                else:
+                    await conn.execute(f'''
+                        UPDATE outbox SET last_error = $1, next_attempt_at = {NOW_UTC} + make_interval(secs => $2)
+                        WHERE id = $3
+                    ''', error[:500], float(retry_in), message_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error recording outbox failure for {message_id}: {e}")
+            return False
+
+    async def log_admin_access(self, user_id: int, username: str, first_name: str, action: str, details: str = ""):
+        """Log admin panel access"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO admin_logs (user_id, username, first_name, action, details)
+                    VALUES ($1, $2, $3, $4, $5)
+                ''', user_id, username or '', first_name or '', action, details)
+            logger.info(f"Admin access logged: {action} by user {user_id}")
+        except Exception as e:
+            logger.error(f"Error logging admin access: {e}")
+
+    async def log_admin_access_batch(self, entries: List[tuple]) -> bool:
+        """Write many admin log entries in one transaction
+
+        Each entry is (user_id, username, first_name, action, details, created_at).
+        """
+        try:
+            rows = [(*entry[:5], _to_timestamp(entry[5])) for entry in entries]
+            async with self.pool.acquire() as conn:
+                await conn.executemany('''
+                    INSERT INTO admin_logs (user_id, username, first_name, action, details, created_at)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                ''', rows)
+            logger.info(f"Admin access logged: {len(entries)} entries")
+            return True
+        except Exception as e:
+            logger.error(f"Error logging admin access batch: {e}")
+            return False
+
+    async def get_admin_logs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Get admin access logs"""
+        try:
+            async with self.pool.acquire() as conn:
+                logs = await conn.fetch('''
+                    SELECT id, user_id, username, first_name, action, details,
+                           to_char(created_at, 'YYYY-MM-DD HH24:MI:SS')
+                    FROM admin_logs ORDER BY created_at DESC LIMIT $1
+                ''', limit)
+            return [
+                {
+                    'id': log_row[0],
+                    'user_id': log_row[1],
+                    'username': log_row[2],
+                    'first_name': log_row[3],
+                    'action': log_row[4],
+                    'details': log_row[5],
+                    'created_at': log_row[6]
+                }
+                for log_row in logs
+            ]
+        except Exception as e:
+            logger.error(f"Error getting admin logs: {e}")
+            return []
@@ -0,0 +1,504 @@
+"""
+Database maintenance tools for POPAYS Bot
+
+Usage:
+    python db_tools.py check-plans                           # fail if any query method does a full table scan
+    python db_tools.py rebuild-stats [--db PATH]             # recompute the order_stats rollup
+    python db_tools.py archive [--days N]                    # move old rows to the archive database
+    python db_tools.py enable-incremental-vacuum [--db PATH] # one-time VACUUM to incremental auto-vacuum
+    python db_tools.py compact-payloads [--db PATH]          # rewrite JSON order payloads in the compact format
+    python db_tools.py backfill-phones [--db PATH]           # fill the normalized phone column on old orders
+    python db_tools.py smoke [--dsn DSN]                     # storage interface checks (SQLite, and Postgres if given)
+"""
+import os
+import re
+import sys
+import uuid
+import asyncio
+import argparse
+import tempfile
+import logging
+from datetime import datetime, timezone
+
+from database import DatabaseManager, AsyncDatabaseManager, OutboxDispatcher
+
+SAMPLE_ORDER = {
+    'type': 'order',
+    'customer': {'name': 'Test Mijoz', 'phone': '+998 91 123 45 67', 'location': "Qo'qon"},
+    'items': [
+        {'name': 'Burger', 'quantity': 2, 'total': 50000, 'selectedSize': 'Katta'},
+        {'name': 'Cola', 'quantity': 1, 'total': 8000, 'selectedSize': '0.5L'},
+    ],
+    'total': 58000,
+}
+
+SAMPLE_LOCATION = {
+    'coordinates': {'latitude': 40.528, 'longitude': 70.951, 'accuracy': 10},
+    'address': "Qo'qon",
+    'maps': {'google': 'https://maps.google.com/?q=40.528,70.951'},
+}
+
+# Statement prefixes whose plans are checked; DDL and PRAGMAs are ignored
+PLANNED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+def query_method_calls(order_id: str, location_id: str):
+    """Representative call for every DatabaseManager query method"""
+    return [
+        ('get_order', (order_id,)),
+        ('get_location', (location_id,)),
+        ('update_order_status', (order_id, 'accepted')),
+        ('transition_order_status', (order_id, 'completed')),
+        ('get_user_orders', (1,)),
+        ('get_user_current_order', (1,)),
+        ('get_all_orders', ()),
+        ('get_statistics', ()),
+        ('get_all_users_with_orders', ()),
+        ('get_recent_orders_admin', (5,)),
+        ('get_recent_orders_admin', (5, ('2025-01-01 00:00:00', order_id))),
+        ('get_recent_orders_admin', (5, None, ('2025-01-01 00:00:00', order_id))),
+        ('get_total_orders_count', ()),
+        ('get_daily_branch_stats', ()),
+        ('get_daily_branch_stats', (30, 'Kosmonavt filiali')),
+        ('search_orders', ('Test Mijoz',)),
+        ('get_orders_by_phone', ('+998 91 123 45 67',)),
+        ('get_locations_in_bbox', (40.5, 70.9, 40.55, 71.0)),
+        ('get_locations_within_radius', (40.528, 70.951, 2.0)),
+        ('get_orders_within_radius', (40.528, 70.951, 2.0)),
+        ('update_order_location_and_fee', (order_id, 40.528, 70.951, 0, 'Kosmonavt filiali')),
+        ('get_admin_logs', ()),
+        ('get_all_users_for_broadcast', ()),
+        ('compact_order_payloads', ()),
+        ('backfill_phone_numbers', ()),
+        ('claim_outbox_messages', ()),
+        ('fail_outbox_message', (1, 'smoke', 5)),
+        ('fail_outbox_message', (1, 'smoke')),
+        ('complete_outbox_message', (1,)),
+        ('archive_old_records', (30,)),
+        # Unknown id: falls through to the archive created above
+        ('get_order', ('missing',)),
+        ('get_location', ('missing',)),
+    ]
+
+# Methods that must read every row of a table by design
+FULL_SCAN_ALLOWED = {
+    # A broadcast goes to every user; cost grows with users, not orders
+    ('get_all_users_for_broadcast', 'users'),
+    # FTS5 reads its one-row config table when a connection first queries the index
+    ('search_orders', 'main.orders_fts_config'),
+    # Exact COUNT(*) over every order; the admin panel reads the order_stats rollup instead
+    ('get_total_orders_count', 'orders'),
+}
+
+def is_table_scan(detail: str) -> bool:
+    """True for plan steps that walk a whole table without an index"""
+    if not detail.startswith('SCAN '):
+        return False
+    if ' VIRTUAL TABLE INDEX ' in detail:
+        # Virtual tables (FTS5) report idxNum 0 with no idxStr for a full read
+        return detail.endswith(' INDEX 0:')
+    if ' USING ' not in detail:
+        return True
+    # SCAN ... USING [COVERING] INDEX walks the whole index (e.g. for an
+    # ORDER BY); only SEARCH steps carry a (col=? / col>?) constraint
+    return '(' not in detail.split(' USING ', 1)[1]
+
+def is_bounded_index_walk(detail: str, sql: str) -> bool:
+    """True for an index walked in order by an unfiltered ... ORDER BY ... LIMIT ?
+
+    The walk stops after LIMIT rows, so it reads a page, not the table.
+    """
+    return (' USING ' in detail and re.search(r'\bLIMIT\b', sql) is not None
+            and re.search(r'\bWHERE\b', sql) is None)
+
+def scanned_table(detail: str) -> str:
+    """Table name from a 'SCAN <table>' plan step"""
+    return detail.split()[1]
+
+def check_query_plans() -> int:
+    """Run EXPLAIN QUERY PLAN on every statement issued by the query methods"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = DatabaseManager(os.path.join(tmp_dir, "plans.db"))
+        manager.init_database()
+        try:
+            for i in range(20):
+                order_id = manager.create_order(i % 4, 'planner', 'Planner', SAMPLE_ORDER,
+                                                outbox=[('new_order', {'chat_id': 1})])
+                location_id = manager.create_location(i % 4, 'planner', 'Planner', SAMPLE_LOCATION)
+                manager.log_admin_access(i % 4, 'planner', 'Planner', 'plan_check')
+
+            # Route every query through one traced connection
+            manager.pool.close_all()
+            statements = []
+            create_connection = manager.pool._create_connection
+
+            def traced_connection():
+                conn = create_connection()
+                conn.set_trace_callback(statements.append)
+                return conn
+
+            manager.pool._create_connection = traced_connection
+
+            failures = 0
+            for method_name, args in query_method_calls(order_id, location_id):
+                # Empty the read caches so every call reaches the database
+                manager.orders.clear()
+                manager.active_orders.clear()
+                statements.clear()
+                getattr(manager, method_name)(*args)
+                executed = [sql for sql in statements if sql.strip().upper().startswith(PLANNED_STATEMENTS)]
+
+                method_failures = 0
+                with manager.pool.connection() as conn:
+                    conn.set_trace_callback(None)
+                    for sql in executed:
+                        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+                        scans = [
+                            row[3] for row in plan
+                            if is_table_scan(row[3])
+                            and not is_bounded_index_walk(row[3], sql)
+                            and (method_name, scanned_table(row[3])) not in FULL_SCAN_ALLOWED
+                        ]
+                        if scans:
+                            method_failures += 1
+                            print(f"❌ {method_name}: {', '.join(scans)}\n   {' '.join(sql.split())}")
+                    conn.set_trace_callback(statements.append)
+
+                failures += method_failures
+                if not method_failures:
+                    print(f"✅ {method_name}: {len(executed)} statement(s) use indexes")
+
+            if failures:
+                print(f"\n❌ {failures} statement(s) do a full table scan")
+                return 1
+            print("\n✅ No full table scans")
+            return 0
+        finally:
+            manager.close()
+
+def rebuild_statistics(db_path: str) -> int:
+    """Recompute the order_stats rollup from the orders and locations tables"""
+    manager = DatabaseManager(db_path)
+    manager.init_database()
+    try:
+        before = manager.get_statistics()
+        if not manager.rebuild_statistics():
+            print("❌ Failed to rebuild statistics")
+            return 1
+        after = manager.get_statistics()
+        print(f"✅ Statistics rebuilt\n   before: {before}\n   after:  {after}")
+        return 0
+    finally:
+        manager.close()
+
+def archive_records(db_path: str, days: int, batch_size: int) -> int:
+    """Move rows older than days into the archive database"""
+    manager = DatabaseManager(db_path)
+    manager.init_database()
+    try:
+        moved = manager.archive_old_records(days, batch_size)
+        print(f"✅ Archived to {manager.archive_path}")
+        for table, count in moved.items():
+            print(f"   {table}: {count}")
+        return 0
+    finally:
+        manager.close()
+
+def enable_incremental_vacuum(db_path: str) -> int:
+    """One-time VACUUM switching an existing file to incremental auto-vacuum"""
+    manager = DatabaseManager(db_path)
+    manager.init_database()
+    try:
+        size_before = os.path.getsize(db_path)
+        if not manager.enable_incremental_vacuum():
+            print("✅ Database already uses incremental auto-vacuum")
+            return 0
+    finally:
+        manager.close()
+    size_after = os.path.getsize(db_path)
+    print("✅ Converted to incremental auto-vacuum; archive runs now return freed pages")
+    print(f"   {db_path}: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB")
+    return 0
+
+def compact_payloads(db_path: str, batch_size: int) -> int:
+    """Rewrite existing JSON order payloads in the compact format and report the size change"""
+    manager = DatabaseManager(db_path)
+    manager.init_database()
+    try:
+        # Measure after any pending migrations have reached the main file
+        with manager.pool.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_before = os.path.getsize(db_path)
+        rewritten = manager.compact_order_payloads(batch_size)
+        if rewritten:
+            # Repack the half-empty pages left behind by the shorter rows
+            with manager.pool.connection() as conn:
+                conn.execute("VACUUM")
+    finally:
+        # Closing the last connection checkpoints the WAL into the main file
+        manager.close()
+    size_after = os.path.getsize(db_path)
+    print(f"✅ Compacted {rewritten} order payloads")
+    print(f"   {db_path}: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB")
+    return 0
+
+def backfill_phones(db_path: str, batch_size: int) -> int:
+    """Fill phone_normalized for orders created before the column existed"""
+    manager = DatabaseManager(db_path)
+    manager.init_database()
+    try:
+        updated = manager.backfill_phone_numbers(batch_size)
+        print(f"✅ Normalized phone numbers on {updated} orders")
+        return 0
+    finally:
+        manager.close()
+
+async def _check_storage(storage) -> int:
+    """Exercise every Storage method and compare results; returns the failure count"""
+    failures = 0
+
+    def check(name: str, ok: bool, detail: str = ""):
+        nonlocal failures
+        if ok:
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name} {detail}")
+
+    order_ids = [await storage.create_order(i % 3, f'user{i % 3}', 'Smoke', SAMPLE_ORDER) for i in range(7)]
+    order = await storage.get_order(order_ids[0])
+    check("create_order / get_order", order is not None
+          and order['customer_name'] == 'Test Mijoz'
+          and order['total_amount'] == 58000
+          and order['status'] == 'pending'
+          and [item['name'] for item in order['items']] == ['Burger', 'Cola']
+          and order['order_data']['customer']['phone'] == SAMPLE_ORDER['customer']['phone'],
+          repr(order))
+    check("get_order unknown id", await storage.get_order('missing') is None)
+
+    location_id = await storage.create_location(1, 'user1', 'Smoke', SAMPLE_LOCATION)
+    location = await storage.get_location(location_id)
+    check("create_location / get_location", location is not None
+          and location['address'] == SAMPLE_LOCATION['address']
+          and location['map_links'] == SAMPLE_LOCATION['maps'], repr(location))
+
+    await storage.update_order_status(order_ids[0], 'completed')
+    await storage.update_order_status(order_ids[1], 'rejected')
+    order = await storage.get_order(order_ids[0])
+    check("update_order_status", order['status'] == 'completed', order['status'])
+
+    await storage.update_order_location_and_fee(order_ids[1], 40.528, 70.951, 5000, 'Kosmonavt filiali')
+    order = await storage.get_order(order_ids[1])
+    check("update_order_location_and_fee", order['latitude'] == 40.528
+          and order['delivery_fee'] == 5000 and order['nearest_branch'] == 'Kosmonavt filiali')
+
+    nearby = await storage.get_locations_within_radius(40.53, 70.95, 1.0)
+    check("get_locations_within_radius", [l['id'] for l in nearby] == [location_id]
+          and 0 < nearby[0]['distance_km'] < 1.0
+          and await storage.get_locations_within_radius(40.6, 70.95, 1.0) == [], repr(nearby))
+    in_box = await storage.get_locations_in_bbox(40.52, 70.94, 40.53, 70.96)
+    check("get_locations_in_bbox", [l['id'] for l in in_box] == [location_id], repr(in_box))
+    nearby_orders = await storage.get_orders_within_radius(40.53, 70.95, 1.0)
+    check("get_orders_within_radius", [o['id'] for o in nearby_orders] == [order_ids[1]], repr(nearby_orders))
+
+    current = await storage.get_user_current_order(1)
+    check("get_user_current_order", current is not None and current['id'] == order_ids[4]
+          and current['status'] == 'pending' and await storage.get_user_current_order(99) is None, repr(current))
+    # order_ids[1], user 1's other order, is already rejected
+    await storage.update_order_status(order_ids[4], 'cancelled')
+    cancelled = await storage.get_user_current_order(1)
+    await storage.update_order_status(order_ids[4], 'pending')
+    current = await storage.get_user_current_order(1)
+    check("get_user_current_order after status changes", cancelled is None
+          and current is not None and current['id'] == order_ids[4], repr((cancelled, current)))
+
+    user_orders = await storage.get_user_orders(0, limit=10, with_payload=False)
+    check("get_user_orders", sorted(o['id'] for o in user_orders) == sorted(order_ids[0::3])
+          and all(o['order_data'] == {} and len(o['items']) == 2 for o in user_orders))
+
+    pages, before = [], None
+    while True:
+        page = await storage.get_recent_orders_admin(limit=3, before=before, with_payload=False)
+        if not page:
+            break
+        pages.append(page)
+        before = (page[-1]['created_at'], page[-1]['id'])
+    seen = [o['id'] for page in pages for o in page]
+    check("get_recent_orders_admin keyset pages", sorted(seen) == sorted(order_ids) and len(set(seen)) == len(seen),
+          repr(seen))
+    previous = await storage.get_recent_orders_admin(limit=3, after=(pages[1][0]['created_at'], pages[1][0]['id']))
+    check("get_recent_orders_admin previous page", [o['id'] for o in previous] == [o['id'] for o in pages[0]])
+    found = await storage.search_orders('burger user1', limit=10)
+    check("search_orders", sorted(o['id'] for o in found) == sorted(order_ids[1::3])
+          and await storage.search_orders('"*(') == [], repr(found))
+    by_phone = await storage.get_orders_by_phone('91 123-45-67', limit=10)
+    check("get_orders_by_phone", sorted(o['id'] for o in by_phone) == sorted(order_ids)
+          and len(await storage.get_orders_by_phone('(91) 1234567', limit=3)) == 3
+          and await storage.get_orders_by_phone('12345') == [], repr(by_phone))
+    check("get_total_orders_count", await storage.get_total_orders_count() == len(order_ids))
+    check("get_all_orders", len(await storage.get_all_orders(limit=50)) == len(order_ids))
+
+    stats = await storage.get_statistics()
+    check("get_statistics", stats.get('total_orders') == len(order_ids)
+          and stats.get('total_revenue') == 58000
+          and stats.get('total_locations') == 1
+          and stats.get('orders_by_status') == {'pending': 5, 'completed': 1, 'rejected': 1}, repr(stats))
+    daily = await storage.get_daily_branch_stats(days=1)
+    check("get_daily_branch_stats", sorted((d['branch'], d['total_orders']) for d in daily)
+          == [('', 6), ('Kosmonavt filiali', 1)]
+          and sum(d['order_amount'] for d in daily) == 7 * 58000
+          and await storage.get_daily_branch_stats(days=1, branch='Kosmonavt filiali') == [
+              d for d in daily if d['branch'] == 'Kosmonavt filiali'], repr(daily))
+    check("rebuild_statistics", await storage.rebuild_statistics() and await storage.get_statistics() == stats
+          and await storage.get_daily_branch_stats(days=1) == daily)
+
+    users = await storage.get_all_users_with_orders()
+    check("get_all_users_with_orders", sorted(u['order_count'] for u in users) == [2, 2, 3], repr(users))
+    broadcast = await storage.get_all_users_for_broadcast()
+    check("get_all_users_for_broadcast", [u['user_id'] for u in broadcast] == [0, 1, 2])
+
+    contested = await storage.create_order(3, 'user3', 'User 3', SAMPLE_ORDER)
+    winners = [order for order in await asyncio.gather(
+        storage.transition_order_status(contested, 'accepted'),
+        storage.transition_order_status(contested, 'rejected'),
+        storage.transition_order_status(contested, 'cancelled'),
+    ) if order]
+    check("transition_order_status: one concurrent winner", len(winners) == 1
+          and (await storage.get_order(contested))['status'] == winners[0]['status'], repr(winners))
+    completed = await storage.transition_order_status(contested, 'completed')
+    check("transition_order_status: accepted -> completed only",
+          (completed is not None) == (winners[0]['status'] == 'accepted')
+          and await storage.transition_order_status(contested, 'accepted') is None)
+
+    outbox_order = await storage.create_order(3, 'user3', 'User 3', SAMPLE_ORDER,
+                                              outbox=[('new_order', {'chat_id': 10})])
+    claimed = await storage.claim_outbox_messages()
+    check("create_order outbox / claim_outbox_messages", [(m['kind'], m['payload'], m['attempts']) for m in claimed]
+          == [('new_order', {'chat_id': 10, 'order_id': outbox_order}, 1)]
+          and await storage.claim_outbox_messages() == [], repr(claimed))
+    await storage.fail_outbox_message(claimed[0]['id'], 'smoke', retry_in=0)
+    retried = await storage.claim_outbox_messages()
+    await storage.complete_outbox_message(claimed[0]['id'])
+    await storage.fail_outbox_message(claimed[0]['id'], 'smoke', retry_in=0)
+    check("fail_outbox_message / complete_outbox_message", [m['attempts'] for m in retried] == [2]
+          and await storage.claim_outbox_messages() == [], repr(retried))
+
+    dispatcher = OutboxDispatcher(storage)
+    delivered = []
+
+    @dispatcher.handler('new_order')
+    async def record_delivery(bot, payload, attempts):
+        delivered.append((bot, payload['order_id'], attempts))
+
+    dispatcher.bot = 'bot'
+    await storage.create_order(3, 'user3', 'User 3', SAMPLE_ORDER, outbox=[('new_order', {'chat_id': 10}),
+                                                                           ('unknown', {})])
+    sent = await dispatcher.dispatch()
+    check("OutboxDispatcher.dispatch", sent == 2 and len(delivered) == 1 and delivered[0][0] == 'bot'
+          and dispatcher.stats() == {'sent': 1, 'retried': 0, 'failed': 1}
+          and await storage.claim_outbox_messages() == [], repr((delivered, dispatcher.stats())))
+
+    await storage.log_admin_access(1, 'admin', 'Admin', 'smoke_single')
+    created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    await storage.log_admin_access_batch([(1, 'admin', 'Admin', 'smoke_batch', str(i), created_at) for i in range(3)])
+    logs = await storage.get_admin_logs()
+    check("log_admin_access / get_admin_logs", sorted(log['action'] for log in logs)
+          == ['smoke_batch'] * 3 + ['smoke_single'], repr(logs))
+
+    return failures
+
+async def _smoke_postgres(dsn: str) -> int:
+    """Run the storage checks in a throwaway Postgres schema"""
+    from database_pg import PostgresStorage, asyncpg
+    if asyncpg is None:
+        print("⏭️  postgres: asyncpg is not installed, skipped")
+        return 0
+
+    schema = f"popays_smoke_{uuid.uuid4().hex[:8]}"
+    storage = PostgresStorage(dsn, schema=schema)
+    try:
+        await storage.initialize()
+    except (OSError, asyncpg.PostgresError) as e:
+        print(f"⏭️  postgres: cannot connect ({e}), skipped")
+        return 0
+    try:
+        return await _check_storage(storage)
+    finally:
+        await storage.close()
+        conn = await asyncpg.connect(dsn)
+        try:
+            await conn.execute(f'DROP SCHEMA "{schema}" CASCADE')
+        finally:
+            await conn.close()
+
+async def _smoke_sqlite() -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = AsyncDatabaseManager(DatabaseManager(os.path.join(tmp_dir, "smoke.db")))
+        await storage.initialize()
+        try:
+            return await _check_storage(storage)
+        finally:
+            await storage.close()
+
+def smoke_test(dsn: str = None) -> int:
+    """Storage interface checks against SQLite, and Postgres when a DSN is given"""
+    print("🔎 sqlite")
+    failures = asyncio.run(_smoke_sqlite())
+    if dsn:
+        print("\n🔎 postgres")
+        failures += asyncio.run(_smoke_postgres(dsn))
+
+    if failures:
+        print(f"\n❌ {failures} storage check(s) failed")
+        return 1
+    print("\n✅ All storage checks passed")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POPAYS Bot database tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('check-plans', help="fail if any query method does a full table scan")
+    rebuild_parser = subparsers.add_parser('rebuild-stats', help="recompute the order_stats rollup")
+    rebuild_parser.add_argument('--db', default="delivery_bot.db", help="database file")
+    archive_parser = subparsers.add_parser('archive', help="move old rows to the archive database")
+    archive_parser.add_argument('--db', default="delivery_bot.db", help="database file")
+    archive_parser.add_argument('--days', type=int, default=None,
+                                help="archive rows older than this (default: ARCHIVE_AFTER_DAYS)")
+    archive_parser.add_argument('--batch-size', type=int, default=500, help="rows moved per transaction")
+    vacuum_parser = subparsers.add_parser('enable-incremental-vacuum',
+                                          help="one-time VACUUM to incremental auto-vacuum (stop the bot first)")
+    vacuum_parser.add_argument('--db', default="delivery_bot.db", help="database file")
+    compact_parser = subparsers.add_parser('compact-payloads', help="rewrite JSON order payloads in the compact format")
+    compact_parser.add_argument('--db', default="delivery_bot.db", help="database file")
+    compact_parser.add_argument('--batch-size', type=int, default=500, help="rows rewritten per transaction")
+    phones_parser = subparsers.add_parser('backfill-phones', help="fill the normalized phone column on old orders")
+    phones_parser.add_argument('--db', default="delivery_bot.db", help="database file")
+    phones_parser.add_argument('--batch-size', type=int, default=500, help="rows updated per transaction")
+    smoke_parser = subparsers.add_parser('smoke', help="run the storage interface checks")
+    smoke_parser.add_argument('--dsn', default=os.getenv('TEST_DATABASE_URL'),
+                              help="Postgres DSN to also check (default: $TEST_DATABASE_URL)")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == 'check-plans':
+        return check_query_plans()
+    if args.command == 'rebuild-stats':
+        return rebuild_statistics(args.db)
+    if args.command == 'archive':
+        days = args.days
+        if days is None:
+            from config import ARCHIVE_AFTER_DAYS
+            days = ARCHIVE_AFTER_DAYS
+        return archive_records(args.db, days, args.batch_size)
+    if args.command == 'enable-incremental-vacuum':
+        return enable_incremental_vacuum(args.db)
+    if args.command == 'compact-payloads':
+        return compact_payloads(args.db, args.batch_size)
+    if args.command == 'backfill-phones':
+        return backfill_phones(args.db, args.batch_size)
+    if args.command == 'smoke':
+        return smoke_test(args.dsn)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
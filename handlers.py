@@ -1,12 +1,13 @@
 from aiogram import Router, F
 from aiogram.types import Message, WebAppData, CallbackQuery
 from aiogram.filters import Command
-import uuid
 import json
+import html
 
 from config import BOT_NAME, BOT_DESCRIPTION, RESTAURANT_NAME, RESTOURAND_FILIAL1, RESTOURAND_FILIAL2, RESTAURANT_PHONE1, RESTAURANT_PHONE2, RESTAURANT_WORKING_HOURS, ORDER_CHANNEL_ID, DEREZLIK_CHANNEL_ID, ADMIN_ID
-from keyboards import get_start_keyboard, get_main_menu_keyboard, get_back_keyboard, get_order_approval_keyboard, get_admin_pagination_keyboard
-from database import db
+from keyboards import get_start_keyboard, get_main_menu_keyboard, get_back_keyboard, get_order_approval_keyboard, get_admin_pagination_keyboard, get_branch_stats_keyboard, decode_page_cursor
+from storage import async_db, audit_log, outbox
+from database import new_record_id
 from utils import calculate_delivery_fee, format_delivery_info
 
 # Create router
@@ -75,7 +76,7 @@ async def cmd_admin(message: Message):
     # Check if user is admin
     if user_id != ADMIN_ID:
         # Log unauthorized admin access attempt
-        db.log_admin_access(
+        audit_log.log(
             user_id=user_id,
             username=message.from_user.username or '',
             first_name=message.from_user.first_name or '',
@@ -89,7 +90,7 @@ async def cmd_admin(message: Message):
         return
     
     # Log admin access attempt
-    db.log_admin_access(
+    audit_log.log(
         user_id=user_id,
         username=message.from_user.username or '',
         first_name=message.from_user.first_name or '',
@@ -113,7 +114,7 @@ async def cmd_broadcast(message: Message):
     # Check if user is admin
     if user_id != ADMIN_ID:
         # Log unauthorized broadcast attempt
-        db.log_admin_access(
+        audit_log.log(
             user_id=user_id,
             username=message.from_user.username or '',
             first_name=message.from_user.first_name or '',
@@ -127,7 +128,7 @@ async def cmd_broadcast(message: Message):
         return
     
     # Log broadcast attempt
-    db.log_admin_access(
+    audit_log.log(
         user_id=user_id,
         username=message.from_user.username or '',
         first_name=message.from_user.first_name or '',
@@ -143,11 +144,83 @@ async def cmd_broadcast(message: Message):
         reply_markup=get_back_keyboard()
     )
 
+@router.message(Command("search"))
+async def cmd_search(message: Message):
+    """Handle /search command - find orders by customer name, phone, username or item"""
+    user_id = message.from_user.id
+    
+    # Check if user is admin
+    if user_id != ADMIN_ID:
+        audit_log.log(
+            user_id=user_id,
+            username=message.from_user.username or '',
+            first_name=message.from_user.first_name or '',
+            action="unauthorized_search_attempt",
+            details=f"User {user_id} tried to search orders"
+        )
+        await message.answer(
+            "❌ Siz admin emassiz! Bu buyruq faqat admin uchun.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    parts = (message.text or '').split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ''
+    if not query:
+        await message.answer(
+            "🔎 <b>Buyurtma qidirish</b>\n\n"
+            "Mijoz ismi, telefon raqami, username yoki taom nomini yozing:\n"
+            "<code>/search Ali</code>\n"
+            "<code>/search 91 123 45 67</code>\n"
+            "<code>/search burger</code>"
+        )
+        return
+    
+    audit_log.log(
+        user_id=user_id,
+        username=message.from_user.username or '',
+        first_name=message.from_user.first_name or '',
+        action="orders_searched",
+        details=query[:100]
+    )
+    
+    try:
+        orders = await async_db.search_orders(query, limit=10)
+        
+        if not orders:
+            await message.answer(f"🔎 <b>{html.escape(query)}</b> bo'yicha buyurtma topilmadi.")
+            return
+        
+        status_texts = {
+            'pending': 'Kutilmoqda',
+            'accepted': 'Qabul qilingan',
+            'rejected': 'Rad etilgan',
+            'completed': 'Tugallangan',
+            'cancelled': 'Bekor qilingan'
+        }
+        
+        result_message = f"🔎 <b>{html.escape(query)}</b> bo'yicha {len(orders)} ta buyurtma:\n"
+        for i, order in enumerate(orders, 1):
+            created_at = str(order.get('created_at') or 'N/A')[:16]
+            result_message += f"""
+<b>{i}. Buyurtma #{order['id']}</b> [{status_texts.get(order['status'], order['status'])}]
+Mijoz: {html.escape(order['customer_name'] or 'N/A')} (@{html.escape(order['username'] or 'N/A')})
+Telefon: {html.escape(order['customer_phone'] or 'N/A')}
+Summa: {order['total_amount'] or 0:,.0f} so'm
+Sana: {created_at}
+"""
+        
+        await message.answer(result_message)
+        
+    except Exception as e:
+        print(f"❌ Error in order search: {e}")
+        await message.answer("❌ Qidirishda xatolik yuz berdi. Iltimos, qayta urinib ko'ring.")
+
 async def broadcast_message_to_all_users(bot, message_text: str, admin_user_id: int) -> dict:
     """Send broadcast message to all users"""
     try:
         # Get all users from database
-        users = db.get_all_users_for_broadcast()
+        users = await async_db.get_all_users_for_broadcast()
         
         if not users:
             return {
@@ -162,7 +235,7 @@ async def broadcast_message_to_all_users(bot, message_text: str, admin_user_id:
         failed_users = []
         
         # Log broadcast start
-        db.log_admin_access(
+        audit_log.log(
             user_id=admin_user_id,
             username='',
             first_name='',
@@ -195,7 +268,7 @@ async def broadcast_message_to_all_users(bot, message_text: str, admin_user_id:
                 print(f"❌ Failed to send broadcast to user {user_id}: {e}")
         
         # Log broadcast completion
-        db.log_admin_access(
+        audit_log.log(
             user_id=admin_user_id,
             username='',
             first_name='',
@@ -220,11 +293,15 @@ async def broadcast_message_to_all_users(bot, message_text: str, admin_user_id:
             'failed': 0
         }
 
-async def show_admin_panel(message: Message, page: int = 1):
-    """Show admin panel after password verification"""
+async def show_admin_panel(message: Message, page: int = 1, before=None, after=None):
+    """Show admin panel after password verification
+    
+    `before`/`after` are (created_at, id) keyset cursors from the
+    pagination keyboard; without them the newest orders are shown.
+    """
     try:
         # Log successful admin panel access
-        db.log_admin_access(
+        audit_log.log(
             user_id=message.from_user.id,
             username=message.from_user.username or '',
             first_name=message.from_user.first_name or '',
@@ -232,19 +309,18 @@ async def show_admin_panel(message: Message, page: int = 1):
             details=f"Admin panel accessed, page {page}"
         )
         
-        # Get statistics
-        stats = db.get_statistics()
+        # Get statistics; the rollup's order total also sizes the pagination
+        stats = await async_db.get_statistics()
+        total_orders = stats.get('total_orders', 0)
         
-        # Get recent orders with pagination
+        # Get recent orders with keyset pagination
         orders_per_page = 5
-        offset = (page - 1) * orders_per_page
-        recent_orders = db.get_recent_orders_admin(limit=orders_per_page, offset=offset)
-        
-        # Get total orders count for pagination
-        total_orders = db.get_total_orders_count()
+        recent_orders = await async_db.get_recent_orders_admin(
+            limit=orders_per_page, before=before, after=after, with_payload=False
+        )
         
         # Get users with orders
-        users_with_orders = db.get_all_users_with_orders(limit=20)
+        users_with_orders = await async_db.get_all_users_with_orders(limit=20)
         
         # Format admin panel message
         admin_message = f"""
@@ -321,7 +397,12 @@ Sana: {created_at}
 """
         
         # Create pagination keyboard
-        keyboard = get_admin_pagination_keyboard(page, total_orders, orders_per_page)
+        keyboard = get_admin_pagination_keyboard(
+            page, total_orders, orders_per_page,
+            first_order=recent_orders[0] if recent_orders else None,
+            # The rollup also counts archived orders, so a short page is the last one
+            last_order=recent_orders[-1] if len(recent_orders) == orders_per_page else None
+        )
         
         await message.answer(admin_message, reply_markup=keyboard)
         
@@ -346,6 +427,145 @@ async def order_handler(message: Message):
         reply_markup=get_main_menu_keyboard()
     )
 
+# Failed channel posts retried before a new order goes to the admin instead
+CHANNEL_SEND_ATTEMPTS = 2
+
+def format_order_channel_message(order) -> str:
+    """Branch channel message for a new order, built from the stored order"""
+    order_data = order['order_data']
+    customer = order_data.get('customer', {})
+    items = order_data.get('items', [])
+    total = order_data.get('total', 0)
+    timestamp = order_data.get('timestamp', '')
+    restaurant = order_data.get('restaurant', 'POPAYS')
+    map_data = order_data.get('mapData', {})
+    
+    order_message = f"""
+🆕 <b>YANGI BUYURTMA!</b> 🆕
+
+🏪 <b>Filial:</b> {order_data.get('branch', 'N/A')}
+
+👤 <b>Mijoz ma'lumotlari:</b>
+• Ism: {customer.get('name', 'N/A')}
+• Telefon: {customer.get('phone', 'N/A')}
+• Manzil: {customer.get('location', 'N/A')}
+"""
+    
+    # Add map data and delivery fee if available
+    delivery_fee = 0
+    if map_data and map_data.get('coordinates'):
+        coords = map_data['coordinates']
+        map_links = map_data.get('mapLinks', {})
+        
+        delivery_info_text = ""
+        try:
+            latitude = coords.get('latitude')
+            longitude = coords.get('longitude')
+            if latitude and longitude:
+                delivery_info = calculate_delivery_fee(latitude, longitude, total)
+                delivery_fee = delivery_info['total_delivery_fee']
+                delivery_info_text = format_delivery_info(delivery_info)
+        except Exception as e:
+            print(f"❌ Error calculating delivery fee: {e}")
+            delivery_fee = 0
+            delivery_info_text = ""
+        
+        order_message += f"""
+📍 <b>Lokatsiya ma'lumotlari:</b>
+• Koordinatalar: {coords.get('latitude', 'N/A')}, {coords.get('longitude', 'N/A')}
+• Aniqlik: {coords.get('accuracy', 'N/A')}m
+"""
+        
+        # Add delivery fee information
+        if delivery_info_text:
+            order_message += f"\n🚚 <b>Yetkazib berish ma'lumotlari:</b>\n{delivery_info_text}\n"
+        
+        # Add map links
+        if map_links:
+            order_message += "\n🗺️ <b>Xarita linklari:</b>\n"
+            if map_links.get('google'):
+                order_message += f"• Google Maps: {map_links['google']}\n"
+            if map_links.get('yandex'):
+                order_message += f"• Yandex Maps: {map_links['yandex']}\n"
+            if map_links.get('osm'):
+                order_message += f"• OpenStreetMap: {map_links['osm']}\n"
+    
+    # Add items if available
+    if items:
+        order_message += "\n🍽️ <b>Buyurtma:</b>\n"
+        for item in items:
+            name = item.get('name', 'N/A')
+            quantity = item.get('quantity', 1)
+            item_total = item.get('total', 0)
+            selected_size = item.get('selectedSize', '')
+            
+            # Format item with size if available
+            if selected_size:
+                order_message += f"• {name} ({selected_size}) x{quantity} = {item_total:,} so'm\n"
+            else:
+                order_message += f"• {name} x{quantity} = {item_total:,} so'm\n"
+    
+    # Add total and other info
+    if total:
+        if delivery_fee > 0:
+            order_message += f"\n💰 <b>Taomlar: {total:,} so'm</b>"
+            order_message += f"\n🚚 <b>Yetkazib berish: {delivery_fee:,} so'm</b>"
+            order_message += f"\n💳 <b>JAMI: {total + delivery_fee:,} so'm</b>"
+        else:
+            order_message += f"\n💰 <b>Jami: {total:,} so'm</b>"
+    
+    order_message += f"\n🏪 <b>Restoran:</b> {restaurant}"
+    order_message += f"\n🏢 <b>Filial:</b> {order_data.get('branch', 'N/A')}"
+    order_message += f"\n⏰ <b>Vaqt:</b> {timestamp}"
+    order_message += f"\n📱 <b>Telegram:</b> @{order['username'] or 'N/A'}"
+    order_message += f"\n🆔 <b>User ID:</b> {order['user_id']}"
+    order_message += f"\n🆔 <b>Order ID:</b> {order['id']}"
+    return order_message
+
+@outbox.handler("new_order")
+async def send_new_order_notification(bot, payload: dict, attempts: int):
+    """Post a queued new order to its branch channel
+    
+    Raising makes the outbox retry. After CHANNEL_SEND_ATTEMPTS failures
+    the order goes to the admin instead, as when the channel is not
+    accessible.
+    """
+    order = await async_db.get_order(payload['order_id'])
+    if not order:
+        print(f"❌ Order {payload['order_id']} not found, channel notification dropped")
+        return
+    
+    chat_id = payload['chat_id']
+    if attempts > CHANNEL_SEND_ATTEMPTS and payload.get('fallback_chat_id'):
+        chat_id = payload['fallback_chat_id']
+    channel_name = "Derezlik filiali" if chat_id == DEREZLIK_CHANNEL_ID else (
+        "admin" if chat_id == ADMIN_ID else "Kosmonavt filiali")
+    
+    # Send detailed order with inline keyboard
+    print(f"📤 Sending order to chat: {chat_id} ({channel_name}), attempt {attempts}")
+    await bot.send_message(
+        chat_id,
+        format_order_channel_message(order),
+        reply_markup=get_order_approval_keyboard(order['id'])
+    )
+    print(f"✅ Buyurtma yuborildi: {chat_id} ({channel_name}) - Order ID: {order['id']}")
+    
+    # If map data available, also send location; the order itself is
+    # already posted, so a failure here is not retried
+    coords = (order['order_data'].get('mapData') or {}).get('coordinates') or {}
+    lat = coords.get('latitude')
+    lon = coords.get('longitude')
+    if lat and lon:
+        try:
+            await bot.send_location(
+                chat_id=chat_id,
+                latitude=float(lat),
+                longitude=float(lon)
+            )
+            print(f"✅ Lokatsiya yuborildi: {lat}, {lon} ({channel_name})")
+        except Exception as loc_error:
+            print(f"❌ Lokatsiya yuborishda xatolik: {loc_error}")
+
 @router.message(F.web_app_data)
 async def web_app_handler(message: Message):
     """Handle web app data from POPAYS website"""
@@ -442,7 +662,7 @@ async def web_app_handler(message: Message):
             
             # Save location to database
             try:
-                location_id = db.create_location(
+                location_id = await async_db.create_location(
                     user_id=message.from_user.id,
                     username=message.from_user.username or '',
                     first_name=message.from_user.first_name or '',
@@ -451,7 +671,7 @@ async def web_app_handler(message: Message):
                 print(f"✅ Location saved to database with ID: {location_id}")
             except Exception as db_error:
                 print(f"❌ Error saving location to database: {db_error}")
-                location_id = str(uuid.uuid4())[:8]  # Fallback ID
+                location_id = new_record_id()  # Fallback ID
             
             # Format location message
             location_message = f"""
@@ -534,7 +754,7 @@ async def web_app_handler(message: Message):
                     'timestamp': map_data.get('timestamp', '')
                 }
                 
-                map_id = db.create_location(
+                map_id = await async_db.create_location(
                     user_id=message.from_user.id,
                     username=message.from_user.username or '',
                     first_name=message.from_user.first_name or '',
@@ -543,7 +763,7 @@ async def web_app_handler(message: Message):
                 print(f"✅ Map data saved to database with ID: {map_id}")
             except Exception as db_error:
                 print(f"❌ Error saving map data to database: {db_error}")
-                map_id = str(uuid.uuid4())[:8]  # Fallback ID
+                map_id = new_record_id()  # Fallback ID
             
             # Format map data message
             map_message = f"""
@@ -618,20 +838,46 @@ async def web_app_handler(message: Message):
             customer = order_data.get('customer', {})
             items = order_data.get('items', [])
             total = order_data.get('total', 0)
-            timestamp = order_data.get('timestamp', '')
-            restaurant = order_data.get('restaurant', 'POPAYS')
             map_data = order_data.get('mapData', {})
             
             print(f"📊 Order details: customer={customer.get('name', 'N/A')}, items={len(items)}, total={total}")
             
-            # Save order to database
+            # Check the delivery distance before anything is saved
+            delivery_info = None
+            coords = (map_data or {}).get('coordinates') or {}
+            latitude = coords.get('latitude')
+            longitude = coords.get('longitude')
+            if latitude and longitude:
+                try:
+                    delivery_info = calculate_delivery_fee(latitude, longitude, total)
+                except Exception as e:
+                    print(f"❌ Error calculating delivery fee: {e}")
+                
+                # Check if delivery is available (within 20km)
+                if delivery_info and not delivery_info.get('is_delivery_available', True):
+                    # Distance is too far, send error message to user
+                    try:
+                        await message.answer(
+                            delivery_info['error_message'],
+                            reply_markup=get_main_menu_keyboard()
+                        )
+                    except Exception as delivery_msg_error:
+                        print(f"❌ Error sending delivery error message: {delivery_msg_error}")
+                    return
+            
+            # Determine which channel to send the order to based on branch
+            target_channel_id = get_order_channel_id(order_data.get('branch', ''))
+            
+            # Save order to database; the channel notification is queued in
+            # the same transaction and sent by the outbox dispatcher
             print(f"💾 Saving order to database...")
             try:
-                order_id = db.create_order(
+                order_id = await async_db.create_order(
                     user_id=message.from_user.id,
                     username=message.from_user.username or '',
                     first_name=message.from_user.first_name or '',
-                    order_data=order_data
+                    order_data=order_data,
+                    outbox=[("new_order", {'chat_id': target_channel_id, 'fallback_chat_id': ADMIN_ID})]
                 )
                 print(f"✅ Order saved to database with ID: {order_id}")
             except Exception as db_error:
@@ -647,213 +893,23 @@ async def web_app_handler(message: Message):
                     print(f"❌ Error sending database error message: {db_msg_error}")
                 return
             
-            # Format order message
-            order_message = f"""
-🆕 <b>YANGI BUYURTMA!</b> 🆕
-
-🏪 <b>Filial:</b> {order_data.get('branch', 'N/A')}
-
-👤 <b>Mijoz ma'lumotlari:</b>
-• Ism: {customer.get('name', 'N/A')}
-• Telefon: {customer.get('phone', 'N/A')}
-• Manzil: {customer.get('location', 'N/A')}
-"""
+            outbox.wake()
             
-            # Add map data and calculate delivery fee if available
-            delivery_fee = 0
-            delivery_info_text = ""
-            if map_data and map_data.get('coordinates'):
-                coords = map_data['coordinates']
-                map_links = map_data.get('mapLinks', {})
-                
-                
-                # Calculate delivery fee based on coordinates
+            # Update order with delivery fee
+            if delivery_info:
                 try:
-                    latitude = coords.get('latitude')
-                    longitude = coords.get('longitude')
-                    if latitude and longitude:
-                        delivery_info = calculate_delivery_fee(latitude, longitude, total)
-                        
-                        # Check if delivery is available (within 20km)
-                        if not delivery_info.get('is_delivery_available', True):
-                            # Distance is too far, send error message to user
-                            try:
-                                await message.answer(
-                                    delivery_info['error_message'],
-                                    reply_markup=get_main_menu_keyboard()
-                                )
-                            except Exception as delivery_msg_error:
-                                print(f"❌ Error sending delivery error message: {delivery_msg_error}")
-                            return
-                        
-                        delivery_fee = delivery_info['total_delivery_fee']
-                        delivery_info_text = format_delivery_info(delivery_info)
-                        
-                        # Update order with delivery fee
-                        db.update_order_location_and_fee(
-                            order_id=order_id,
-                            latitude=latitude,
-                            longitude=longitude,
-                            delivery_fee=delivery_fee,
-                            nearest_branch=delivery_info['nearest_branch']
-                        )
-                        
-                        print(f"💰 Delivery fee calculated: {delivery_fee} sum")
-                        
+                    await async_db.update_order_location_and_fee(
+                        order_id=order_id,
+                        latitude=latitude,
+                        longitude=longitude,
+                        delivery_fee=delivery_info['total_delivery_fee'],
+                        nearest_branch=delivery_info['nearest_branch']
+                    )
+                    print(f"💰 Delivery fee calculated: {delivery_info['total_delivery_fee']} sum")
                 except Exception as e:
-                    print(f"❌ Error calculating delivery fee: {e}")
-                    # Continue without delivery fee if calculation fails
-                    delivery_fee = 0
-                    delivery_info_text = ""
-                
-                order_message += f"""
-📍 <b>Lokatsiya ma'lumotlari:</b>
-• Koordinatalar: {coords.get('latitude', 'N/A')}, {coords.get('longitude', 'N/A')}
-• Aniqlik: {coords.get('accuracy', 'N/A')}m
-"""
-                
-                # Add delivery fee information
-                if delivery_info_text:
-                    order_message += f"\n🚚 <b>Yetkazib berish ma'lumotlari:</b>\n{delivery_info_text}\n"
-                
-                # Add map links
-                if map_links:
-                    order_message += "\n🗺️ <b>Xarita linklari:</b>\n"
-                    if map_links.get('google'):
-                        order_message += f"• Google Maps: {map_links['google']}\n"
-                    if map_links.get('yandex'):
-                        order_message += f"• Yandex Maps: {map_links['yandex']}\n"
-                    if map_links.get('osm'):
-                        order_message += f"• OpenStreetMap: {map_links['osm']}\n"
-            
-            # Add items if available
-            if items:
-                order_message += "\n🍽️ <b>Buyurtma:</b>\n"
-                for item in items:
-                    name = item.get('name', 'N/A')
-                    quantity = item.get('quantity', 1)
-                    total = item.get('total', 0)
-                    selected_size = item.get('selectedSize', '')
-                    
-                    # Format item with size if available
-                    if selected_size:
-                        order_message += f"• {name} ({selected_size}) x{quantity} = {total:,} so'm\n"
-                    else:
-                        order_message += f"• {name} x{quantity} = {total:,} so'm\n"
-            
-            # Add total and other info
-            if total:
-                if delivery_fee > 0:
-                    order_message += f"\n💰 <b>Taomlar: {total:,} so'm</b>"
-                    order_message += f"\n🚚 <b>Yetkazib berish: {delivery_fee:,} so'm</b>"
-                    order_message += f"\n💳 <b>JAMI: {total + delivery_fee:,} so'm</b>"
-                else:
-                    order_message += f"\n💰 <b>Jami: {total:,} so'm</b>"
-            
-            order_message += f"\n🏪 <b>Restoran:</b> {restaurant}"
-            order_message += f"\n🏢 <b>Filial:</b> {order_data.get('branch', 'N/A')}"
-            order_message += f"\n⏰ <b>Vaqt:</b> {timestamp}"
-            order_message += f"\n📱 <b>Telegram:</b> @{message.from_user.username or 'N/A'}"
-            order_message += f"\n🆔 <b>User ID:</b> {message.from_user.id}"
-            order_message += f"\n🆔 <b>Order ID:</b> {order_id}"
-            
-            # Create short message for user
-            customer_name = customer.get('name', 'N/A')
-            customer_phone = customer.get('phone', 'N/A')
-            
-            user_message = f"✅ <b>Buyurtma qabul qilindi!</b>\n\n"
-            user_message += f"👤 <b>Ism:</b> {customer_name}\n"
-            user_message += f"📞 <b>Telefon:</b> {customer_phone}\n\n"
-            
-            # Add items
-            if items:
-                user_message += "🍽️ <b>Buyurtma:</b>\n"
-                for item in items[:3]:  # Show first 3 items
-                    name = item.get('name', 'N/A')
-                    quantity = item.get('quantity', 1)
-                    selected_size = item.get('selectedSize', '')
-                    if selected_size:
-                        user_message += f"• {name} ({selected_size}) x{quantity}\n"
-                    else:
-                        user_message += f"• {name} x{quantity}\n"
-                if len(items) > 3:
-                    user_message += f"• ... va yana {len(items) - 3} ta\n"
-            
-            # Add delivery fee
-            if delivery_fee > 0:
-                user_message += f"\n🚚 <b>Yetkazib berish:</b> {delivery_fee:,} so'm"
-            
-            # User message removed - only channel gets the order details
-            print(f"📤 User confirmation message skipped - only channel notification sent")
+                    print(f"❌ Error saving delivery fee: {e}")
             
-            # Determine which channel to send the order to based on branch
-            target_channel_id = get_order_channel_id(order_data.get('branch', ''))
-            channel_name = "Derezlik filiali" if target_channel_id == DEREZLIK_CHANNEL_ID else "Kosmonavt filiali"
-            
-            # Send detailed order to appropriate channel with inline keyboard
-            print(f"📤 Sending order to channel: {target_channel_id} ({channel_name})")
-            try:
-                await message.bot.send_message(
-                    target_channel_id, 
-                    order_message, 
-                    reply_markup=get_order_approval_keyboard(order_id)
-                )
-                print(f"✅ Buyurtma kanalga yuborildi: {target_channel_id} ({channel_name}) - Order ID: {order_id}")
-                
-                # If map data available, also send location
-                if map_data:
-                    coords = map_data.get('coordinates', {})
-                    if coords:
-                        lat = coords.get('latitude')
-                        lon = coords.get('longitude')
-                        
-                        if lat and lon:
-                            try:
-                                # Send location as Telegram location
-                                await message.bot.send_location(
-                                    chat_id=target_channel_id,
-                                    latitude=float(lat),
-                                    longitude=float(lon)
-                                )
-                                print(f"✅ Lokatsiya kanalga yuborildi: {lat}, {lon} ({channel_name})")
-                            except Exception as loc_error:
-                                print(f"❌ Lokatsiya yuborishda xatolik: {loc_error}")
-                
-            except Exception as e:
-                print(f"❌ Kanalga yuborishda xatolik: {e}")
-                # If channel not accessible, send to admin
-                try:
-                    from config import ADMIN_ID
-                    # Add order info to admin message too
-                    admin_order_message = order_message
-                    await message.bot.send_message(
-                        ADMIN_ID, 
-                        admin_order_message, 
-                        reply_markup=get_order_approval_keyboard()
-                    )
-                    print(f"✅ Buyurtma admin ga yuborildi: {ADMIN_ID} - Order ID: {order_id}")
-                    
-                    # Also send location to admin if available
-                    if map_data and map_data.get('coordinates'):
-                        coords = map_data['coordinates']
-                        try:
-                            await message.bot.send_location(
-                                chat_id=ADMIN_ID,
-                                latitude=coords.get('latitude'),
-                                longitude=coords.get('longitude')
-                            )
-                            print(f"✅ Lokatsiya admin ga yuborildi: {coords.get('latitude')}, {coords.get('longitude')}")
-                        except Exception as loc_error:
-                            print(f"❌ Admin ga lokatsiya yuborishda xatolik: {loc_error}")
-                            
-                except Exception as admin_error:
-                    print(f"❌ Admin ga yuborishda xatolik: {admin_error}")
-                    # If even admin notification fails, at least inform the user
-                    await message.answer(
-                        "⚠️ <b>Buyurtma qabul qilindi, lekin kanalga yuborishda muammo bor!</b>\n\n"
-                        "Iltimos, @popays_support ga murojaat qiling.",
-                        reply_markup=get_main_menu_keyboard()
-                    )
+            print(f"📤 Order {order_id} queued for channel {target_channel_id}")
                 
         else:
             try:
@@ -886,7 +942,7 @@ async def my_orders_handler(message: Message):
     
     try:
         # Get user's orders from database
-        orders = db.get_user_orders(user_id, limit=10)
+        orders = await async_db.get_user_orders(user_id, limit=10, with_payload=False)
         
         if not orders:
             await message.answer(
@@ -1000,7 +1056,7 @@ async def password_handler(message: Message):
         # Check password
         if message.text == ADMIN_PASSWORD:
             # Log successful password verification
-            db.log_admin_access(
+            audit_log.log(
                 user_id=user_id,
                 username=message.from_user.username or '',
                 first_name=message.from_user.first_name or '',
@@ -1011,7 +1067,7 @@ async def password_handler(message: Message):
             await show_admin_panel(message)
         else:
             # Log failed password attempt
-            db.log_admin_access(
+            audit_log.log(
                 user_id=user_id,
                 username=message.from_user.username or '',
                 first_name=message.from_user.first_name or '',
@@ -1075,7 +1131,7 @@ async def confirm_order_callback(callback: CallbackQuery):
     """Handle order confirmation by customer"""
     try:
         user_id = callback.from_user.id
-        current_order = db.get_user_current_order(user_id)
+        current_order = await async_db.get_user_current_order(user_id)
         
         if not current_order:
             await callback.answer("❌ Sizda faol buyurtma yo'q!", show_alert=True)
@@ -1083,22 +1139,14 @@ async def confirm_order_callback(callback: CallbackQuery):
         
         order_id = current_order['id']
         
-        # Update order status in database
-        try:
-            db.update_order_status(order_id, "accepted")
-            print(f"✅ Order {order_id} status updated to 'accepted' in database")
-        except Exception as db_error:
-            print(f"❌ Error updating order status in database: {db_error}")
-        
-        # Extract customer user ID from the message
-        message_text = callback.message.text
-        customer_user_id = None
-        
-        # Look for customer user ID in the message
-        import re
-        user_id_match = re.search(r'🆔 <b>User ID:</b> (\d+)', message_text)
-        if user_id_match:
-            customer_user_id = int(user_id_match.group(1))
+        # Only one of concurrent taps on a pending order wins
+        order_details = await async_db.transition_order_status(order_id, "accepted")
+        if not order_details:
+            await callback.answer("❌ Sizda faol buyurtma yo'q!", show_alert=True)
+            print(f"⚠️ Order {order_id} was already processed, confirmation ignored")
+            return
+        print(f"✅ Order {order_id} status updated to 'accepted' in database")
+        customer_user_id = order_details['user_id']
         
         # Edit the message to show it's accepted
         original_text = callback.message.text
@@ -1111,8 +1159,6 @@ async def confirm_order_callback(callback: CallbackQuery):
         # Send confirmation to customer if user ID found
         if customer_user_id:
             try:
-                # Get order details for short message
-                order_details = db.get_order(order_id)
                 customer_name = order_details.get('customer_name', 'N/A') if order_details else 'N/A'
                 customer_phone = order_details.get('customer_phone', 'N/A') if order_details else 'N/A'
                 total_amount = order_details.get('total_amount', 0) if order_details else 0
@@ -1171,7 +1217,7 @@ async def cancel_order_callback(callback: CallbackQuery):
     """Handle order cancellation by customer"""
     try:
         user_id = callback.from_user.id
-        current_order = db.get_user_current_order(user_id)
+        current_order = await async_db.get_user_current_order(user_id)
         
         if not current_order:
             await callback.answer("❌ Sizda faol buyurtma yo'q!", show_alert=True)
@@ -1179,8 +1225,10 @@ async def cancel_order_callback(callback: CallbackQuery):
         
         order_id = current_order['id']
         
-        # Cancel the order
-        db.update_order_status(order_id, "cancelled")
+        # Cancel the order unless an admin has already handled it
+        if not await async_db.transition_order_status(order_id, "cancelled"):
+            await callback.answer("❌ Buyurtma allaqachon ko'rib chiqilgan, bekor qilib bo'lmaydi!", show_alert=True)
+            return
         
         await callback.message.edit_text(
             "❌ <b>Buyurtma bekor qilindi</b>\n\n"
@@ -1201,22 +1249,15 @@ async def accept_order_callback(callback: CallbackQuery):
     try:
         order_id = callback.data.replace("accept_order_", "")
         
-        # Update order status in database
-        try:
-            db.update_order_status(order_id, "accepted")
-            print(f"✅ Order {order_id} status updated to 'accepted' in database")
-        except Exception as db_error:
-            print(f"❌ Error updating order status in database: {db_error}")
-        
-        # Extract customer user ID from the message
-        message_text = callback.message.text
-        customer_user_id = None
-        
-        # Look for customer user ID in the message
-        import re
-        user_id_match = re.search(r'🆔 <b>User ID:</b> (\d+)', message_text)
-        if user_id_match:
-            customer_user_id = int(user_id_match.group(1))
+        # Only the first admin to accept or reject a pending order wins;
+        # everyone else gets an alert and the post is left alone
+        order_details = await async_db.transition_order_status(order_id, "accepted")
+        if not order_details:
+            await callback.answer("⚠️ Bu buyurtma allaqachon ko'rib chiqilgan!", show_alert=True)
+            print(f"⚠️ Order {order_id} was already processed, accept by {callback.from_user.id} ignored")
+            return
+        print(f"✅ Order {order_id} status updated to 'accepted' in database")
+        customer_user_id = order_details['user_id']
         
         # Edit the message to show it's accepted
         original_text = callback.message.text
@@ -1229,8 +1270,6 @@ async def accept_order_callback(callback: CallbackQuery):
         # Send acceptance notification to customer if user ID found
         if customer_user_id:
             try:
-                # Get order details for notification
-                order_details = db.get_order(order_id)
                 customer_name = order_details.get('customer_name', 'N/A') if order_details else 'N/A'
                 customer_phone = order_details.get('customer_phone', 'N/A') if order_details else 'N/A'
                 total_amount = order_details.get('total_amount', 0) if order_details else 0
@@ -1290,22 +1329,15 @@ async def reject_order_callback(callback: CallbackQuery):
     try:
         order_id = callback.data.replace("reject_order_", "")
         
-        # Update order status in database
-        try:
-            db.update_order_status(order_id, "rejected")
-            print(f"✅ Order {order_id} status updated to 'rejected' in database")
-        except Exception as db_error:
-            print(f"❌ Error updating order status in database: {db_error}")
-        
-        # Extract customer user ID from the message
-        message_text = callback.message.text
-        customer_user_id = None
-        
-        # Look for customer user ID in the message
-        import re
-        user_id_match = re.search(r'🆔 <b>User ID:</b> (\d+)', message_text)
-        if user_id_match:
-            customer_user_id = int(user_id_match.group(1))
+        # Only the first admin to accept or reject a pending order wins;
+        # everyone else gets an alert and the post is left alone
+        order_details = await async_db.transition_order_status(order_id, "rejected")
+        if not order_details:
+            await callback.answer("⚠️ Bu buyurtma allaqachon ko'rib chiqilgan!", show_alert=True)
+            print(f"⚠️ Order {order_id} was already processed, reject by {callback.from_user.id} ignored")
+            return
+        print(f"✅ Order {order_id} status updated to 'rejected' in database")
+        customer_user_id = order_details['user_id']
         
         # Edit the message to show it's rejected
         original_text = callback.message.text
@@ -1318,8 +1350,6 @@ async def reject_order_callback(callback: CallbackQuery):
         # Send rejection notification to customer if user ID found
         if customer_user_id:
             try:
-                # Get order details for rejection message
-                order_details = db.get_order(order_id)
                 customer_name = order_details.get('customer_name', 'N/A') if order_details else 'N/A'
                 
                 customer_message = f"😔 <b>Buyurtmangiz rad etildi</b>\n\n"
@@ -1357,7 +1387,7 @@ async def handle_location(message: Message):
         
         # Get user's current order from database
         user_id = message.from_user.id
-        current_order = db.get_user_current_order(user_id)
+        current_order = await async_db.get_user_current_order(user_id)
         
         if not current_order:
             await message.reply(
@@ -1375,7 +1405,7 @@ async def handle_location(message: Message):
         delivery_text = format_delivery_info(delivery_info)
         
         # Update order with location and delivery fee
-        db.update_order_location_and_fee(
+        await async_db.update_order_location_and_fee(
             order_id=current_order['id'],
             latitude=latitude,
             longitude=longitude,
@@ -1410,7 +1440,7 @@ async def handle_location(message: Message):
 async def request_location(message: Message):
     """Request location from user"""
     user_id = message.from_user.id
-    current_order = db.get_user_current_order(user_id)
+    current_order = await async_db.get_user_current_order(user_id)
     
     if not current_order:
         await message.reply(
@@ -1431,13 +1461,83 @@ async def request_location(message: Message):
 async def admin_pagination_callback(callback: CallbackQuery):
     """Handle admin panel pagination"""
     try:
-        page = int(callback.data.replace("admin_page_", ""))
-        await show_admin_panel(callback.message, page)
+        # admin_page_<page>[_<o|n>_<cursor>]
+        parts = callback.data.replace("admin_page_", "").split("_", 2)
+        page = int(parts[0])
+        before = after = None
+        if len(parts) == 3:
+            cursor = decode_page_cursor(parts[2])
+            if parts[1] == "o":
+                before = cursor
+            else:
+                after = cursor
+        else:
+            # Page 1, or a button from before keyset pagination
+            page = 1
+        await show_admin_panel(callback.message, page, before=before, after=after)
         await callback.answer()
     except Exception as e:
         print(f"Error in admin pagination: {e}")
         await callback.answer("❌ Xatolik yuz berdi!", show_alert=True)
 
+@router.callback_query(F.data.startswith("admin_branch_stats_"))
+async def admin_branch_stats_callback(callback: CallbackQuery):
+    """Show per-branch, per-day order totals from the daily rollup"""
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("❌ Siz admin emassiz!", show_alert=True)
+        return
+    
+    try:
+        days = int(callback.data.replace("admin_branch_stats_", ""))
+        daily_stats = await async_db.get_daily_branch_stats(days=days)
+        
+        audit_log.log(
+            user_id=callback.from_user.id,
+            username=callback.from_user.username or '',
+            first_name=callback.from_user.first_name or '',
+            action="branch_stats_viewed",
+            details=f"Branch report for {days} days"
+        )
+        
+        period_text = "bugun" if days == 1 else f"oxirgi {days} kun"
+        report = f"<b>FILIALLAR HISOBOTI</b> ({period_text})\n"
+        
+        if not daily_stats:
+            report += "\nBu davrda buyurtmalar yo'q."
+        else:
+            # Period totals per branch
+            totals = {}
+            for row in daily_stats:
+                branch_total = totals.setdefault(row['branch'], {'orders': 0, 'amount': 0, 'revenue': 0})
+                branch_total['orders'] += row['total_orders']
+                branch_total['amount'] += row['order_amount']
+                branch_total['revenue'] += row['revenue']
+            
+            report += "\n<b>Jami:</b>\n"
+            for branch, branch_total in sorted(totals.items()):
+                branch_name = html.escape(branch) if branch else "Filial aniqlanmagan"
+                report += (f"• {branch_name}: {branch_total['orders']} ta, {branch_total['amount']:,.0f} so'm "
+                           f"(tugallangan: {branch_total['revenue']:,.0f} so'm)\n")
+            
+            # Day-by-day breakdown, newest first, cut to fit one Telegram message
+            current_day = None
+            for row in daily_stats:
+                if len(report) > 3500:
+                    report += "\n..."
+                    break
+                if row['day'] != current_day:
+                    current_day = row['day']
+                    report += f"\n<b>{current_day}</b>\n"
+                branch_name = html.escape(row['branch']) if row['branch'] else "Filial aniqlanmagan"
+                report += (f"• {branch_name}: {row['total_orders']} ta, {row['order_amount']:,.0f} so'm "
+                           f"(tugallangan: {row['revenue']:,.0f} so'm)\n")
+        
+        await callback.message.answer(report, reply_markup=get_branch_stats_keyboard(days))
+        await callback.answer()
+    except Exception as e:
+        print(f"Error in branch stats: {e}")
+        await callback.answer("❌ Xatolik yuz berdi!", show_alert=True)
+
 @router.callback_query(F.data == "admin_main_menu")
 async def admin_main_menu_callback(callback: CallbackQuery):
     """Handle return to main menu from admin panel"""
@@ -6,9 +6,21 @@ import json
 
 from config import BOT_NAME, BOT_DESCRIPTION, RESTAURANT_NAME, RESTAURANT_ADDRESS, RESTOURAND_FILIAL1, RESTOURAND_FILIAL2, RESTAURANT_PHONE1, RESTAURANT_PHONE2, RESTAURANT_WORKING_HOURS, RESTAURANT_FEATURES, ORDER_CHANNEL_ID, DEREZLIK_CHANNEL_ID, ADMIN_ID
 from keyboards import get_start_keyboard, get_main_menu_keyboard, get_back_keyboard, get_order_approval_keyboard
-from database import db
+from database import DatabaseManager
 from utils import calculate_delivery_fee, format_delivery_info
 
+# This legacy copy of the handlers uses its own synchronous manager,
+# created on first use so that importing the module never opens the database
+_db = None
+
+def get_db() -> DatabaseManager:
+    """The module's DatabaseManager, created and migrated on first call"""
+    global _db
+    if _db is None:
+        _db = DatabaseManager()
+        _db.init_database()
+    return _db
+
 # Create router
 router = Router()
 
@@ -88,13 +100,13 @@ async def show_admin_panel(message: Message):
     """Show admin panel after password verification"""
     try:
         # Get statistics
-        stats = db.get_statistics()
+        stats = get_db().get_statistics()
         
         # Get recent orders
-        recent_orders = db.get_recent_orders_admin(limit=10)
+        recent_orders = get_db().get_recent_orders_admin(limit=10)
         
         # Get users with orders
-        users_with_orders = db.get_all_users_with_orders(limit=20)
+        users_with_orders = get_db().get_all_users_with_orders(limit=20)
         
         # Format admin panel message
         admin_message = f"""
@@ -265,7 +277,7 @@ async def web_app_handler(message: Message):
             
             # Save location to database
             try:
-                location_id = db.create_location(
+                location_id = get_db().create_location(
                     user_id=message.from_user.id,
                     username=message.from_user.username or '',
                     first_name=message.from_user.first_name or '',
@@ -354,7 +366,7 @@ async def web_app_handler(message: Message):
                     'timestamp': map_data.get('timestamp', '')
                 }
                 
-                map_id = db.create_location(
+                map_id = get_db().create_location(
                     user_id=message.from_user.id,
                     username=message.from_user.username or '',
                     first_name=message.from_user.first_name or '',
@@ -439,7 +451,7 @@ async def web_app_handler(message: Message):
             
             # Save order to database
             try:
-                order_id = db.create_order(
+                order_id = get_db().create_order(
                     user_id=message.from_user.id,
                     username=message.from_user.username or '',
                     first_name=message.from_user.first_name or '',
@@ -492,7 +504,7 @@ async def web_app_handler(message: Message):
                         delivery_info_text = format_delivery_info(delivery_info)
                         
                         # Update order with delivery fee
-                        db.update_order_location_and_fee(
+                        get_db().update_order_location_and_fee(
                             order_id=order_id,
                             latitude=latitude,
                             longitude=longitude,
@@ -660,7 +672,7 @@ async def my_orders_handler(message: Message):
     
     try:
         # Get user's orders from database
-        orders = db.get_user_orders(user_id, limit=10)
+        orders = get_db().get_user_orders(user_id, limit=10)
         
         if not orders:
             await message.answer(
@@ -796,7 +808,7 @@ async def confirm_order_callback(callback: CallbackQuery):
     """Handle order confirmation by customer"""
     try:
         user_id = callback.from_user.id
-        current_order = db.get_user_current_order(user_id)
+        current_order = get_db().get_user_current_order(user_id)
         
         if not current_order:
             await callback.answer("❌ Sizda faol buyurtma yo'q!", show_alert=True)
@@ -806,7 +818,7 @@ async def confirm_order_callback(callback: CallbackQuery):
         
         # Update order status in database
         try:
-            db.update_order_status(order_id, "accepted")
+            get_db().update_order_status(order_id, "accepted")
             print(f"✅ Order {order_id} status updated to 'accepted' in database")
         except Exception as db_error:
             print(f"❌ Error updating order status in database: {db_error}")
@@ -833,7 +845,7 @@ async def confirm_order_callback(callback: CallbackQuery):
         if customer_user_id:
             try:
                 # Get order details for short message
-                order_details = db.get_order(order_id)
+                order_details = get_db().get_order(order_id)
                 customer_name = order_details.get('customer_name', 'N/A') if order_details else 'N/A'
                 customer_phone = order_details.get('customer_phone', 'N/A') if order_details else 'N/A'
                 total_amount = order_details.get('total_amount', 0) if order_details else 0
@@ -883,7 +895,7 @@ async def cancel_order_callback(callback: CallbackQuery):
     """Handle order cancellation by customer"""
     try:
         user_id = callback.from_user.id
-        current_order = db.get_user_current_order(user_id)
+        current_order = get_db().get_user_current_order(user_id)
         
         if not current_order:
             await callback.answer("❌ Sizda faol buyurtma yo'q!", show_alert=True)
@@ -892,7 +904,7 @@ async def cancel_order_callback(callback: CallbackQuery):
         order_id = current_order['id']
         
         # Cancel the order
-        db.update_order_status(order_id, "cancelled")
+        get_db().update_order_status(order_id, "cancelled")
         
         await callback.message.edit_text(
             "❌ <b>Buyurtma bekor qilindi</b>\n\n"
@@ -915,7 +927,7 @@ async def accept_order_callback(callback: CallbackQuery):
         
         # Update order status in database
         try:
-            db.update_order_status(order_id, "rejected")
+            get_db().update_order_status(order_id, "rejected")
             print(f"✅ Order {order_id} status updated to 'rejected' in database")
         except Exception as db_error:
             print(f"❌ Error updating order status in database: {db_error}")
@@ -984,7 +996,7 @@ async def handle_location(message: Message):
         
         # Get user's current order from database
         user_id = message.from_user.id
-        current_order = db.get_user_current_order(user_id)
+        current_order = get_db().get_user_current_order(user_id)
         
         if not current_order:
             await message.reply(
@@ -1002,7 +1014,7 @@ async def handle_location(message: Message):
         delivery_text = format_delivery_info(delivery_info)
         
         # Update order with location and delivery fee
-        db.update_order_location_and_fee(
+        get_db().update_order_location_and_fee(
             order_id=current_order['id'],
             latitude=latitude,
             longitude=longitude,
@@ -1037,7 +1049,7 @@ async def handle_location(message: Message):
 async def request_location(message: Message):
     """Request location from user"""
     user_id = message.from_user.id
-    current_order = db.get_user_current_order(user_id)
+    current_order = get_db().get_user_current_order(user_id)
     
     if not current_order:
         await message.reply(
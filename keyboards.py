@@ -70,19 +70,58 @@ def get_location_keyboard() -> ReplyKeyboardMarkup:
     )
     return keyboard
 
-def get_admin_pagination_keyboard(current_page: int, total_orders: int, orders_per_page: int) -> InlineKeyboardMarkup:
-    """Create pagination keyboard for admin panel"""
+def encode_page_cursor(order: dict) -> str:
+    """Encode an order's (created_at, id) keyset cursor for callback data"""
+    return f"{order['created_at']}|{order['id']}"
+
+def decode_page_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_page_cursor into (created_at, id)"""
+    created_at, order_id = cursor.rsplit("|", 1)
+    return created_at, order_id
+
+def get_admin_pagination_keyboard(current_page: int, total_orders: int, orders_per_page: int,
+                                  first_order: dict = None, last_order: dict = None) -> InlineKeyboardMarkup:
+    """Create pagination keyboard for admin panel
+    
+    Callback data carries a keyset cursor instead of an offset:
+    admin_page_<page>_o_<cursor> for older orders and
+    admin_page_<page>_n_<cursor> for newer ones.
+    """
     total_pages = (total_orders + orders_per_page - 1) // orders_per_page
     keyboard_buttons = []
     
     # Add navigation buttons
-    if current_page > 1:
-        keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"admin_page_{current_page - 1}")])
+    if current_page > 1 and first_order:
+        if current_page == 2:
+            # Page 1 always starts from the newest order
+            prev_data = "admin_page_1"
+        else:
+            prev_data = f"admin_page_{current_page - 1}_n_{encode_page_cursor(first_order)}"
+        keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Oldingi", callback_data=prev_data)])
     
-    if current_page < total_pages:
-        keyboard_buttons.append([InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"admin_page_{current_page + 1}")])
+    if current_page < total_pages and last_order:
+        next_data = f"admin_page_{current_page + 1}_o_{encode_page_cursor(last_order)}"
+        keyboard_buttons.append([InlineKeyboardButton(text="Keyingi ➡️", callback_data=next_data)])
     
-    # Add main menu button
+    # Add branch report and main menu buttons
+    keyboard_buttons.append([InlineKeyboardButton(text="📊 Filiallar hisoboti", callback_data="admin_branch_stats_7")])
     keyboard_buttons.append([InlineKeyboardButton(text="🏠 Asosiy menyu", callback_data="admin_main_menu")])
     
-    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
\ No newline at end of file
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+def get_branch_stats_keyboard(days: int) -> InlineKeyboardMarkup:
+    """Period switcher for the per-branch report: admin_branch_stats_<days>"""
+    periods = [(1, "Bugun"), (7, "7 kun"), (30, "30 kun")]
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=f"✅ {label}" if period == days else label,
+                    callback_data=f"admin_branch_stats_{period}"
+                )
+                for period, label in periods
+            ],
+            [InlineKeyboardButton(text="🔙 Admin panel", callback_data="admin_page_1")]
+        ]
+    )
+    return keyboard
\ No newline at end of file
@@ -1,3 +1,8 @@
+import time
+
+# Process start, for the import-to-first-poll startup time
+STARTED_AT = time.perf_counter()
+
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
@@ -7,6 +12,7 @@ from aiogram.client.default import DefaultBotProperties
 from aiohttp import ClientTimeout, TCPConnector
 
 from config import BOT_TOKEN
+from storage import async_db, audit_log, outbox
 from handlers import router
 
 # Configure logging
@@ -31,7 +37,7 @@ async def test_bot_connection(bot: Bot) -> bool:
 
 async def main():
     """Main function to start the POPAYS bot"""
-    logger.info("Starting POPAYS Bot...")
+    logger.info(f"Starting POPAYS Bot... (imports took {(time.perf_counter() - STARTED_AT) * 1e3:.0f} ms)")
     
     # Initialize bot with default settings first
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -47,6 +53,19 @@ async def main():
         await bot.session.close()
         return
     
+    # Open the storage backend and bring its schema up to date; importing
+    # storage does not touch the database, this is the only place it is set up
+    init_started = time.perf_counter()
+    await async_db.initialize()
+    logger.info(f"Database initialized in {(time.perf_counter() - init_started) * 1e3:.0f} ms")
+    
+    # Start the write-behind admin log sink
+    audit_log.start()
+    
+    # Start the channel notification outbox; orders queued before a
+    # restart are picked up here
+    outbox.start(bot)
+    
     # Start polling with retry logic
     max_retries = 3
     retry_delay = 5
@@ -56,6 +75,8 @@ async def main():
             try:
                 logger.info("POPAYS Bot started successfully! 🍕")
                 logger.info("Orders will be sent to channel: -1002958129439")
+                if attempt == 0:
+                    logger.info(f"Startup took {(time.perf_counter() - STARTED_AT) * 1e3:.0f} ms from import to first poll")
                 await dp.start_polling(bot)
                 break
             except Exception as e:
@@ -67,7 +88,11 @@ async def main():
                 else:
                     logger.error("Max retries reached. Bot failed to start.")
     finally:
+        # Stop the outbox first so an in-flight send can still use the session
+        await outbox.close()
         await bot.session.close()
+        await audit_log.close()
+        await async_db.close()
 
 if __name__ == "__main__":
     try:
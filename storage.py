@@ -0,0 +1,120 @@
+"""
+Storage backend selection for POPAYS Bot
+
+Handlers talk to the `async_db` object defined here. It is one of:
+
+    sqlite    AsyncDatabaseManager over database.DatabaseManager (default)
+    postgres  database_pg.PostgresStorage, an asyncpg connection pool
+
+chosen by DB_BACKEND in config. Both implement the Storage protocol below
+and return the same row types (OrderRow, plain dicts), so handlers do not
+know which one is in use.
+
+`audit_log` and `outbox` are the background admin log sink and channel
+notification dispatcher on top of it; main.py starts and stops them.
+Importing this module does not touch the database: main.py calls
+`await async_db.initialize()` once at startup.
+"""
+from typing import Any, Dict, List, Optional, Protocol, Tuple, runtime_checkable
+
+from config import DB_BACKEND, DATABASE_URL
+from database import AsyncDatabaseManager, AdminLogBuffer, DatabaseManager, OrderRow, OutboxDispatcher
+
+BACKENDS = ('sqlite', 'postgres')
+
+@runtime_checkable
+class Storage(Protocol):
+    """Async storage interface shared by all backends"""
+
+    async def initialize(self) -> None:
+        """Open connections and bring the schema up to date"""
+
+    async def close(self) -> None:
+        """Finish queued work and release connections"""
+
+    async def create_order(self, user_id: int, username: str, first_name: str, order_data: Dict[str, Any],
+                           outbox: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> str: ...
+
+    async def create_location(self, user_id: int, username: str, first_name: str,
+                              location_data: Dict[str, Any]) -> str: ...
+
+    async def get_order(self, order_id: str) -> Optional[OrderRow]: ...
+
+    async def get_location(self, location_id: str) -> Optional[Dict[str, Any]]: ...
+
+    async def get_locations_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                                    limit: int = 100) -> List[Dict[str, Any]]: ...
+
+    async def get_locations_within_radius(self, latitude: float, longitude: float, radius_km: float,
+                                          limit: int = 50) -> List[Dict[str, Any]]: ...
+
+    async def get_orders_within_radius(self, latitude: float, longitude: float, radius_km: float,
+                                       limit: int = 50, with_payload: bool = False) -> List[OrderRow]: ...
+
+    async def update_order_status(self, order_id: str, status: str) -> bool: ...
+
+    async def transition_order_status(self, order_id: str, status: str) -> Optional[OrderRow]: ...
+
+    async def update_order_location_and_fee(self, order_id: str, latitude: float, longitude: float,
+                                            delivery_fee: int, nearest_branch: str): ...
+
+    async def get_user_current_order(self, user_id: int) -> Optional[OrderRow]: ...
+
+    async def get_user_orders(self, user_id: int, limit: int = 10,
+                              with_payload: bool = True) -> List[OrderRow]: ...
+
+    async def get_all_orders(self, limit: int = 50, with_payload: bool = True) -> List[OrderRow]: ...
+
+    async def get_recent_orders_admin(self, limit: int = 20, before: Optional[Tuple[str, str]] = None,
+                                      after: Optional[Tuple[str, str]] = None,
+                                      with_payload: bool = True) -> List[OrderRow]: ...
+
+    async def search_orders(self, query: str, limit: int = 10,
+                            with_payload: bool = False) -> List[OrderRow]: ...
+
+    async def get_orders_by_phone(self, phone: str, limit: int = 20,
+                                  with_payload: bool = False) -> List[OrderRow]: ...
+
+    async def get_total_orders_count(self) -> int: ...
+
+    async def get_statistics(self) -> Dict[str, Any]: ...
+
+    async def get_daily_branch_stats(self, days: int = 7,
+                                     branch: Optional[str] = None) -> List[Dict[str, Any]]: ...
+
+    async def rebuild_statistics(self) -> bool: ...
+
+    async def get_all_users_with_orders(self, limit: int = 50) -> List[Dict[str, Any]]: ...
+
+    async def get_all_users_for_broadcast(self) -> List[Dict[str, Any]]: ...
+
+    async def claim_outbox_messages(self, limit: int = 20, lease_seconds: int = 60) -> List[Dict[str, Any]]: ...
+
+    async def complete_outbox_message(self, message_id: int) -> bool: ...
+
+    async def fail_outbox_message(self, message_id: int, error: str, retry_in: Optional[float] = None) -> bool: ...
+
+    async def log_admin_access(self, user_id: int, username: str, first_name: str,
+                               action: str, details: str = ""): ...
+
+    async def log_admin_access_batch(self, entries: List[tuple]) -> bool: ...
+
+    async def get_admin_logs(self, limit: int = 50) -> List[Dict[str, Any]]: ...
+
+def create_storage(backend: str = 'sqlite', url: str = "delivery_bot.db", **options) -> Storage:
+    """Build a storage backend
+
+    url is the database file for sqlite and the connection DSN for
+    postgres; options go to the backend constructor.
+    """
+    if backend == 'sqlite':
+        return AsyncDatabaseManager(DatabaseManager(url, **options))
+    if backend == 'postgres':
+        # asyncpg is only imported when it is actually used
+        from database_pg import PostgresStorage
+        return PostgresStorage(url, **options)
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of {BACKENDS}")
+
+async_db = create_storage(DB_BACKEND, DATABASE_URL)
+audit_log = AdminLogBuffer(async_db)
+outbox = OutboxDispatcher(async_db)